@@ -16,7 +16,8 @@
 # Python + packages Requirements
 
 # Python 3.9
-# nltk, bitarray, bitstring, re, dahuffmann
+# nltk, lingua, bitarray, dahuffmann
+# heavy packages are imported by the modes that use them only, see import_codec_modules and import_tokenizer_modules
 
 # Performance : ratios between x2.6 for Middle to Modern and elaborate English (ex: Shakespeare)
 # Up to x3 and more for simple english.
@@ -169,28 +170,29 @@ cat outngrams.bin | awk '{ print length, bash $0 }' | sort -n -s | cut -d" " -f2
 
 import sys
 import os
-import pickle
+import io
 import traceback
-from collections import Counter, OrderedDict
-import numpy as np
+from collections import Counter, OrderedDict, deque
+from weakref import WeakKeyDictionary
 from itertools import cycle,islice
+from array import array
+from functools import partial
 
 import codecs
-import nltk
-from nltk.tokenize import TweetTokenizer
-tknzr = TweetTokenizer()
-
 import re
-import bitstring
-from bitarray import bitarray
 import struct
 import time
-from dahuffman import HuffmanCodec
+import mmap
+import zlib
 
-import pycld2 as cld2
-from lingua import Language, LanguageDetectorBuilder
+# imported on demand, see import_codec_modules and import_tokenizer_modules
+bitarray = None
+HuffmanCodec = None
+nltk = None
+tknzr = None
+Language = None
+LanguageDetectorBuilder = None
 
-from bidict import bidict
 
 #print(len(sys.argv))
 #op = (sys.argv[1]).encode("ascii").decode("ascii")
@@ -199,95 +201,207 @@ from bidict import bidict
 
 interactive = False
 no_final_huf = False
+server = False
+train = False
+batch = False
+stream = False
+# block mode (-b1 .. -b9) : BWT blocks of 100 kB .. 900 kB of token stream, 0 for a single block. See compress_frame.
+bwt_block_size = 0
+# move-to-front and zero run stage (-mtf) instead of RLE after the BWT, see mtf_encode.
+mtf_stage = False
+# frames of a shorter token stream keep RLE in mtf_stage, see compress_frame
+mtf_min_size = 2048
+# sentinel-free blocks : BWT primary index in the block header and in-band RLE, see compress_block.
+# False writes the version 1 format (absent char shiftdown, BWT eof 255 and RLE separator) for older readers.
+primary_index_bwt = True
+# final pass codec (-fp N after -c, -sc or -bc) : 0 is huffmann_final_pass.bin, 1 .. 15 the codecs trained by -tf
+# (huffmann_final_pass_<N>.bin, see train_final_pass). The id is written in the frame flags.
+final_pass_codec_id = 0
+# per block final pass code : a block whose own Huffmann code (with its code lengths) is smaller than the final pass
+# codec is written with it, see encode_block_table. Framed streams only (frame_flag_tables), a -c stream becomes one
+# when its table pays for the container header too.
+adaptive_tables = True
+# order-1 rANS final stage (-rans) : a block is coded by rANS instead of the final huffmann pass when that is smaller,
+# see rans_encode and encode_block_table. Framed streams only.
+rans_stage = False
+# worker processes (--jobs N) for frames and blocks, see map_ordered. 1 does everything in this process.
+jobs = 1
+compress = False
+gendic = False
+huffmann_only = False
+infile = ''
+outfile = ''
+
+# command line, skipped when the script is imported as a module (see dicstrv_bench.py)
+if (__name__ == "__main__"):
+    # block mode option of -c, -sc and -bc, anywhere after the operation
+    block_args = [arg for arg in sys.argv[2:] if re.fullmatch(r"-b[1-9]", arg)]
+    if (len(block_args)):
+        bwt_block_size = int(block_args[-1][2:]) * 100000
+        sys.argv = [arg for arg in sys.argv if (arg not in block_args)]
+    # move-to-front stage option of -c, -sc and -bc, anywhere after the operation
+    if ("-mtf" in sys.argv[2:]):
+        mtf_stage = True
+        sys.argv.remove("-mtf")
+    # rANS final stage option of -c, -sc and -bc, anywhere after the operation
+    if ("-rans" in sys.argv[2:]):
+        rans_stage = True
+        sys.argv.remove("-rans")
+    # final pass codec option of -c, -sc and -bc, anywhere after the operation
+    if ("-fp" in sys.argv[2:-1]):
+        codec_idx = sys.argv.index("-fp", 2)
+        final_pass_codec_id = int(sys.argv[codec_idx + 1])
+        del(sys.argv[codec_idx:codec_idx + 2])
+    # worker processes option, anywhere after the operation
+    if ("--jobs" in sys.argv[2:-1]):
+        jobs_idx = sys.argv.index("--jobs", 2)
+        jobs = max(1, int(sys.argv[jobs_idx + 1]))
+        del(sys.argv[jobs_idx:jobs_idx + 2])
+
+    if (sys.argv[1] == "-i"):
+        interactive = True
+        batch = False
+        compress = False
+        gendic = False
+        huffmann_only = False
+    elif (sys.argv[1] == "-c"):
+        interactive = False
+        batch = False
+        compress = True
+        gendic = False
+        huffmann_only = False
+    elif (sys.argv[1] == "-bc"):
+        interactive = False
+        compress = True
+        gendic = False
+        huffmann_only = False
+        batch = True
+        if(sys.argv[-1] == "-nfh"):
+            no_final_huf = True
+
+    elif (sys.argv[1] == "-sc"): # streaming compression to framed chunks, input can be stdin
+        interactive = False
+        batch = False
+        compress = True
+        gendic = False
+        huffmann_only = False
+        stream = True
+    elif (sys.argv[1] == "-d"):
+        interactive = False
+        batch = False
+        compress = True
+        gendic = True
+        huffmann_only = False
+    elif (sys.argv[1] == "-x"):
+        interactive = False
+        batch = False
+        compress = False
+        gendic = False
+        huffmann_only = False
+    elif (sys.argv[1] == "-hc"): # only use huffmann compression - to compare performance.
+        interactive = False
+        batch = False
+        compress = True
+        gendic = False
+        huffmann_only = True
+    elif (sys.argv[1] == "-hx"): # only yse huffmann decompression - to compare performance.
+        interactive = False
+        batch = False
+        compress = False
+        gendic = False
+        huffmann_only = True
+    elif (sys.argv[1] == "-tf"): # final pass codec training over a corpus folder
+        interactive = False
+        batch = False
+        compress = True
+        gendic = False
+        huffmann_only = False
+        train = True
+    elif (sys.argv[1] == "-srv"): # compression daemon on a unix domain socket
+        interactive = False
+        batch = False
+        compress = False
+        gendic = False
+        huffmann_only = False
+        server = True
+    else:
+        print("unknown operation: " + str(sys.argv[0]) + " type 'python3 dicstrv3.py' for help")
 
-if (sys.argv[1] == "-i"):
-    interactive = True
-    batch = False
-    compress = False
-    gendic = False
-    huffmann_only = False
-elif (sys.argv[1] == "-c"):
-    interactive = False
-    batch = False
-    compress = True
-    gendic = False
-    huffmann_only = False
-elif (sys.argv[1] == "-bc"):
-    interactive = False
-    compress = True
-    gendic = False
-    huffmann_only = False
-    batch = True
-    if(sys.argv[-1] == "-nfh"):
-        no_final_huf = True
-
-elif (sys.argv[1] == "-d"):
-    interactive = False
-    batch = False
-    compress = True
-    gendic = True
-    huffmann_only = False
-elif (sys.argv[1] == "-x"):
-    interactive = False
-    batch = False
-    compress = False
-    gendic = False
-    huffmann_only = False
-elif (sys.argv[1] == "-hc"): # only use huffmann compression - to compare performance.
-    interactive = False
-    batch = False
-    compress = True
-    gendic = False
-    huffmann_only = True
-elif (sys.argv[1] == "-hx"): # only yse huffmann decompression - to compare performance.
-    interactive = False
-    batch = False
-    compress = False
-    gendic = False
-    huffmann_only = True
-else:
-    print("unknown operation: " + str(sys.argv[0]) + " type 'python3 dicstrv3.py' for help")
-
-
-if (((len(sys.argv) < 3) or (len(sys.argv) > 5)) and not interactive):
-    print("Syntax for compression :\n")
-    print("python3 dicstrv.py -c <txt_inputfile> <compressed_outputfile>")
-    print("Reads txt_inputfile and writes compressed text stream to compressed_outputfile.\n") 
+
+    if (((len(sys.argv) < 3) or (len(sys.argv) > 5)) and not interactive):
+        print("Syntax for compression :\n")
+        print("python3 dicstrv.py -c <txt_inputfile> <compressed_outputfile>")
+        print("Reads txt_inputfile and writes compressed text stream to compressed_outputfile.\n") 
     
-    print("python3 dicstrv.py -c <txt_inputfile>")
-    print("Reads txt_input file and writes compressed output to stdout\n")
+        print("python3 dicstrv.py -c <txt_inputfile>")
+        print("Reads txt_input file and writes compressed output to stdout\n")
+
+        print("python3 dicstrv.py -sc <txt_inputfile|-> [compressed_outputfile]")
+        print("Streaming compression of a file or of stdin (-) of any size, in self-describing frames.")
+        print("Writes binary output, to stdout if no output file is given. Decompress with -x.\n")
+
+        print("-b1 .. -b9 after -c, -sc or -bc : block mode, BWT blocks of 100 kB .. 900 kB of token stream.")
+        print("Output is a framed stream (see -sc), decompress with -x.\n")
+
+        print("-mtf after -c, -sc or -bc : move-to-front and zero run coding instead of RLE after the BWT.")
+        print("Output is a framed stream (see -sc), decompress with -x.\n")
+
+        print("--jobs N after -sc, -c -b<n>, -x or -tf : frames and blocks are compressed / decompressed by N worker processes.\n")
+
+        print("-rans after -c, -sc or -bc : order-1 rANS coding of the blocks instead of the final huffmann pass,")
+        print("for the blocks it makes smaller.")
+        print("Output is a framed stream (see -sc), decompress with -x.\n")
 
-    print("python3 dicstrv.py -bc folder_path ext")
-    print("Reads all files recursively in folder_path and generates for each file a compressed file with extension '.ext'")
+        print("-fp N after -c, -sc or -bc : final pass codec N (1 .. 15, trained by -tf), 0 is huffmann_final_pass.bin.")
+        print("Output is a framed stream (see -sc), decompress with -x.\n")
+
+        print("python3 dicstrv.py -tf folder_path [suffix]")
+        print("Trains a final pass codec over the files of folder_path whose name ends with suffix (default '.', as -bc),")
+        print("written to huffmann_final_pass_<N>.bin with the first free id N, see -fp.\n")
+
+        print("python3 dicstrv.py -bc folder_path ext")
+        print("Reads all files recursively in folder_path and generates for each file a compressed file with extension '.ext'")
     
-    #print("python3 dicstrv.py -bc <txt_inputfile> <txt_inpputfile2> <txt_inputfile2> ...")
-    #print("Batch compress : reads txt_input files and writes compressed output to bin files, appending bin extension, filewise\n")
+        #print("python3 dicstrv.py -bc <txt_inputfile> <txt_inpputfile2> <txt_inputfile2> ...")
+        #print("Batch compress : reads txt_input files and writes compressed output to bin files, appending bin extension, filewise\n")
 
-    print("Syntax for decompression :\n")
-    print("python3 dicstrv.py -x <compressed_inputfile> <txt_outputfile>")
-    print("Reads compressed_inputfile and writes cleartext to txt_outputfile.\n") 
+        print("Syntax for decompression :\n")
+        print("python3 dicstrv.py -x <compressed_inputfile> <txt_outputfile>")
+        print("Reads compressed_inputfile and writes cleartext to txt_outputfile.\n") 
     
-    print("python3 dicstrv.py -x <compressed_inputfile>\n")
-    print("Reads compressed_input file and writes cleartext output to stdout\n")
+        print("python3 dicstrv.py -x <compressed_inputfile>\n")
+        print("Reads compressed_input file and writes cleartext output to stdout\n")
+        print("Framed streams (-sc) are detected, use - as compressed_inputfile to read stdin.\n")
 
-    print("NOTE: dictionary file count1_w.txt must be in the same directory as the script.")    
-    quit()
+        print("Syntax for the compression daemon :\n")
+        print("python3 dicstrv.py -srv <socket_path>")
+        print("Loads dictionaries once and serves compress / decompress requests on a unix domain socket.")
+        print("Use dicstrv_client.py <socket_path> -c|-x ... with the same arguments as -c and -x.\n")
 
+        print("NOTE: dictionary file count1_w.txt must be in the same directory as the script.")    
+        quit()
 
-if not interactive:
-    if (len(sys.argv) == 3):
-        infile = sys.argv[2]
-        outfile = ''
-    if (len(sys.argv) >= 4):
-        infile = sys.argv[2]
-        outfile = sys.argv[3]
+
+    if not interactive:
+        if (len(sys.argv) == 3):
+            infile = sys.argv[2]
+            outfile = ''
+        if (len(sys.argv) >= 4):
+            infile = sys.argv[2]
+            outfile = sys.argv[3]
 
 
 debug_on = True
 debug_ngrams_dic = False
 secondpass = True
 use_huffmann = False
-unknown_token_idx = 16384 + 128 + 2097152
+# tokenize with the precompiled regexes of tokenize_line / word_tokenize instead of nltk (same tokens, faster, no nltk)
+regex_tokenizer = False
+# session dictionary ids start after the primary dictionary and ngram ids, see SessionDict.
+session_id_start = 16384 + 128 + 2097152
+# maximum number of words of the session dictionary of a stream, the whole session id space by default.
+# past it, unknown words are escaped each time. The decoder must use the same capacity (or a larger one).
+session_capacity = 4194299 - session_id_start
 
 
 def debugw(strdebug):
@@ -299,8 +413,7 @@ def debugw(strdebug):
 
 
 
-codec_lower = HuffmanCodec.from_frequencies(
-{'e' :   56.88,	'm' :	15.36,
+freq_lower = {'e' :   56.88,	'm' :	15.36,
 'a'	:	43.31,	'h'	:	15.31,
 'r'	:	38.64,	'g'	:	12.59,
 'i'	:	38.45,	'b'	:	10.56,
@@ -314,17 +427,11 @@ codec_lower = HuffmanCodec.from_frequencies(
 'd'	:	17.25,	'j'	:	1,
 'p'	:	16.14,	'q'	:	1
 }
-)
-
-#codec_lower.print_code_table()
-debugw(codec_lower.get_code_table())
 
 # following is ASCII mixed upper and lower case frequency from an English writer from Palm OS PDA memos in 2002
 # Credit : http://fitaly.com/board/domper3/posts/136.html
 
-codec_upperlower = HuffmanCodec.from_frequencies(
-
-{'A' : 0.3132,
+freq_upperlower = {'A' : 0.3132,
 'B' : 0.2163,
 'C' : 0.3906,
 'D' : 0.3151,
@@ -376,16 +483,12 @@ codec_upperlower = HuffmanCodec.from_frequencies(
 'x' : 0.1950,
 'y' : 1.1330,
 'z' : 0.0596
-})
-
-debugw(codec_upperlower.get_code_table())
+}
 
 # following is ASCII alpha numeric frequency from an English writer from Palm OS PDA memos in 2002
 # Credit : http://fitaly.com/board/domper3/posts/136.html
 
-codec_alphanumeric = HuffmanCodec.from_frequencies(
-
-{'0' : 0.5516,
+freq_alphanumeric = {'0' : 0.5516,
 '1' : 0.4594,
 '2' : 0.3322,
 '3' : 0.1847,
@@ -447,16 +550,12 @@ codec_alphanumeric = HuffmanCodec.from_frequencies(
 'x' : 0.1950,
 'y' : 1.1330,
 'z' : 0.0596
-})
-
-debugw(codec_alphanumeric.get_code_table())
+}
 
 # following is Whole ASCII printable chars frequency except whitespace from an English writer from Palm OS PDA memos in 2002
 # Credit : http://fitaly.com/board/domper3/posts/136.html
 
-codec_all = HuffmanCodec.from_frequencies(
-
-{'!' : 0.0072,
+freq_all = {'!' : 0.0072,
 '\"' : 0.2442,
 '#' : 0.0179,
 '$' : 0.0561,
@@ -550,14 +649,12 @@ codec_all = HuffmanCodec.from_frequencies(
 '|' : 0.0007,
 '}' : 0.0026,
 '~' : 0.0003,
-})
+}
 
 # following is Whole ASCII printable chars frequency except whitespace from an English writer from Palm OS PDA memos in 2002
 # Credit : http://fitaly.com/board/domper3/posts/136.html
 
-codec_all_whitespace = HuffmanCodec.from_frequencies(
-
-{' ' : 17.1662,
+freq_all_whitespace = {' ' : 17.1662,
 '!' : 0.0072,
 '\"' : 0.2442,
 '#' : 0.0179,
@@ -654,103 +751,390 @@ codec_all_whitespace = HuffmanCodec.from_frequencies(
 '~' : 0.0003,
 '\n' : 0.06, #wild guess
 '\t' : 0.02 #wild guess
-})
-
+}
 
-debugw(codec_all.get_code_table())
-#quit()
-#
+# static codecs are built on first use, most runs only need a few of them (or none).
+# codec names are the frequency table names without the freq_ prefix.
+codec_frequencies = {'lower' : freq_lower, 'upperlower' : freq_upperlower, 'alphanumeric' : freq_alphanumeric,
+                     'all' : freq_all, 'all_whitespace' : freq_all_whitespace}
 
-dicts = {}
+def get_codec(name):
+    codec = get_codec.codecs.get(name)
+    if (codec is None):
+        codec = HuffmanCodec.from_frequencies(codec_frequencies[name])
+        debugw(codec.get_code_table())
+        get_codec.codecs[name] = codec
+    return codec
 
-def load_dicts(lang_id):
+get_codec.codecs = {}
 
+# treecode of unknown tokens -> static codec name
+unknown_token_codecs = {1 : 'lower', 2 : 'upperlower', 3 : 'alphanumeric', 4 : 'all'}
 
-    #initializing Python dicts
-    count = 1
-    onegrams = bidict()
-    duplicate_onegrams_indexes = []
+# Compiled primary dictionary (<lang_id>_1w.cdic)
+# The primary dictionary is compiled once from <lang_id>_1w.txt into a flat binary file that is memory-mapped.
+# id -> word and word -> id lookups are served straight from the mapping, no python dict is built,
+# and every process on the host shares the same pages through the OS page cache.
 
+# layout : all integers are uint32 in native byte order, all sections are 4 bytes aligned.
+# header : magic, byte order mark, number of ids, number of hash index slots, string table length
+# offsets : number of ids + 1 offsets, word of id i is string_table[offsets[i]:offsets[i+1] - 1]
+# an empty word is a hole (duplicate or empty line in the source dictionary, the id is unused).
+# hash index : open addressing table with linear probing, keyed by crc32 of the utf-8 word.
+# each slot holds id + 1, 0 is an empty slot.
+# string table : utf-8 words separated by chr(0)
 
-    if (not os.path.isfile('count_1w.pickle')):
+cdic_magic = b"PL1W"
+cdic_bom = 0x01020304
+cdic_header = struct.Struct("=4sIIII")
 
+def compile_primary_dict(txt_path, cdic_path):
 
-        debugw("first load of dic")
-        file1 = open(lang_id + '_1w.txt', 'r')
+    with open(txt_path, 'r') as file1:
         Lines = file1.readlines()
 
-        # special case : byte val 0 is equal to new line.
-        # TODO : make sure that windows CRLF is taken care of.
-        onegrams[0] = "\n"
+    # special case : byte val 0 is equal to new line.
+    # TODO : make sure that windows CRLF is taken care of.
+    words = ["\n"]
+    seen = {"\n"}
+    for line in Lines:
+        word = line.strip()
+        if word in seen:
+            # duplicate word, its id is left as a hole so the following ids do not move.
+            debugw("duplicate word in dictionary at id: " + str(len(words)))
+            words.append("")
+        else:
+            seen.add(word)
+            words.append(word)
+
+    encoded_words = [word.encode('utf-8') for word in words]
+    count = len(encoded_words)
+
+    offsets = [0] * (count + 1)
+    for word_id in range(0, count):
+        offsets[word_id + 1] = offsets[word_id] + len(encoded_words[word_id]) + 1
+
+    # keep the hash index at most half full
+    slots = 1
+    while slots < 2 * count:
+        slots <<= 1
+    mask = slots - 1
+    index = [0] * slots
+    for word_id in range(0, count):
+        if not len(encoded_words[word_id]):
+            continue
+        slot = zlib.crc32(encoded_words[word_id]) & mask
+        while index[slot]:
+            slot = (slot + 1) & mask
+        index[slot] = word_id + 1
+
+    strtab = b"\x00".join(encoded_words)
+
+    tmp_path = cdic_path + ".tmp" + str(os.getpid())
+    with open(tmp_path, 'wb') as handle:
+        handle.write(cdic_header.pack(cdic_magic, cdic_bom, count, slots, len(strtab)))
+        array('I', offsets).tofile(handle)
+        array('I', index).tofile(handle)
+        handle.write(strtab)
+    # atomic, concurrent processes never see a partially written dictionary
+    os.replace(tmp_path, cdic_path)
+
+class CompiledDict:
+
+    # Read-only id <-> word mapping over a memory-mapped compiled dictionary.
+    # Exposes the part of the bidict interface used by the codec : d[id], d.inverse[word], len(d).
+    # Words of the session dictionary are not part of it, see SessionDict.
+
+    def __init__(self, cdic_path):
+        with open(cdic_path, 'rb') as handle:
+            self._mm = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, bom, count, slots, strtab_len) = cdic_header.unpack_from(self._mm, 0)
+        if (magic != cdic_magic or bom != cdic_bom):
+            self._mm.close()
+            raise ValueError("not a compiled dictionary for this platform: " + cdic_path)
+        view = memoryview(self._mm)
+        offsets_pos = cdic_header.size
+        index_pos = offsets_pos + 4 * (count + 1)
+        self._count = count
+        self._mask = slots - 1
+        self._offsets = view[offsets_pos:index_pos].cast('I')
+        self._index = view[index_pos:index_pos + 4 * slots].cast('I')
+        self._strtab_pos = index_pos + 4 * slots
+        self._strtab_len = strtab_len
+        self._words = None
+        self.inverse = CompiledDictInverse(self)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, word_id):
+        if (0 <= word_id < self._count):
+            start = self._offsets[word_id]
+            end = self._offsets[word_id + 1] - 1
+            if (start != end):
+                return self._mm[self._strtab_pos + start:self._strtab_pos + end].decode('utf-8')
+        raise KeyError(word_id)
+
+    def words(self):
+        # dense id -> word list of the compiled ids (holes are empty strings), for bulk decoding.
+        # built on first call : one decode and split of the whole string table.
+        if (self._words is None):
+            strtab = self._mm[self._strtab_pos:self._strtab_pos + self._strtab_len]
+            self._words = strtab.decode('utf-8').split('\0')[:self._count]
+        return self._words
+
+    def compiled_word_id(self, word):
+        # id of a word of the compiled file, None if it is not in it
+        key = word.encode('utf-8')
+        slot = zlib.crc32(key) & self._mask
+        entry = self._index[slot]
+        while entry:
+            start = self._offsets[entry - 1]
+            end = self._offsets[entry] - 1
+            if (self._mm[self._strtab_pos + start:self._strtab_pos + end] == key):
+                return entry - 1
+            slot = (slot + 1) & self._mask
+            entry = self._index[slot]
+        return None
+
+    def word_id(self, word):
+        word_id = self.compiled_word_id(word)
+        if (word_id is None):
+            raise KeyError(word)
+        return word_id
+
+class CompiledDictInverse:
+
+    # word -> id side of a CompiledDict
+
+    def __init__(self, forward):
+        self._forward = forward
+
+    def __getitem__(self, word):
+        return self._forward.word_id(word)
+
+    def __contains__(self, word):
+        try:
+            self._forward.word_id(word)
+            return True
+        except KeyError:
+            return False
+
+# Compiled ngram dictionary (<lang_id>_4w.cdic)
+# ngrams are looked up by the compressed bytes of their tokens (3 to 15 bytes).
+# These bytes are packed with their length into a single integer key, so a lookup needs no string building :
+# key = int.from_bytes(ngram_bytes, 'little') << 4 | len(ngram_bytes)
+# The ngram code is the line number of the ngram in <lang_id>_4w.bin, as before.
+
+# layout : all integers are in native byte order, all sections are 8 bytes aligned.
+# header : magic, byte order mark, number of codes, number of hash index slots
+# keys : number of codes * 2 uint64, (low 64 bits, high 64 bits) of the key of each code. key 0 is a hole.
+# hash index : open addressing table with linear probing (uint32), each slot holds code + 1, 0 is an empty slot.
+
+cngram_magic = b"PL4W"
+cngram_header = struct.Struct("=4sIII")
+cngram_max_bytes = 15
+cngram_mult = 0x9E3779B97F4A7C15
+mask64 = 0xFFFFFFFFFFFFFFFF
+
+def ngram_key(ngram_bytes):
+    return (int.from_bytes(ngram_bytes, 'little') << 4) | len(ngram_bytes)
+
+def compile_ngram_dict(bin_path, cngram_path):
+
+    with open(bin_path, 'rt') as filengrams:
+        ngramlines = filengrams.readlines()
 
-        # populating dicts
-        for line in Lines:
-            try:
-                # Strips the newline character of the 1gram
-                onegrams[count] = line.strip()
-            except Exception as error:
-                print(error)
-                duplicate_onegrams_indexes.append(count)    
-            count += 1
+    count = len(ngramlines)
+    keys = array('Q', bytes(16 * count))
+    seen = set()
+    for code in range(0, count):
+        # lines are the hex representation of the compressed ngram, each byte prefixed with x
+        ngram_bytes = bytes.fromhex(ngramlines[code].strip().replace("x", ""))
+        key = ngram_key(ngram_bytes)
+        if (len(ngram_bytes) > cngram_max_bytes or key in seen):
+            # duplicate or oversized ngram, its code is left as a hole so the following codes do not move.
+            debugw("skipping ngram at code: " + str(code))
+            continue
+        seen.add(key)
+        keys[2 * code] = key & mask64
+        keys[2 * code + 1] = key >> 64
+
+    # keep the hash index at most half full
+    bits = 1
+    while (1 << bits) < 2 * count:
+        bits += 1
+    slots = 1 << bits
+    mask = slots - 1
+    index = array('I', bytes(4 * slots))
+    for code in range(0, count):
+        key = keys[2 * code] | (keys[2 * code + 1] << 64)
+        if not key:
+            continue
+        slot = (((key ^ (key >> 64)) & mask64) * cngram_mult & mask64) >> (64 - bits)
+        while index[slot]:
+            slot = (slot + 1) & mask
+        index[slot] = code + 1
+
+    tmp_path = cngram_path + ".tmp" + str(os.getpid())
+    with open(tmp_path, 'wb') as handle:
+        handle.write(cngram_header.pack(cngram_magic, cdic_bom, count, slots))
+        keys.tofile(handle)
+        index.tofile(handle)
+    # atomic, concurrent processes never see a partially written dictionary
+    os.replace(tmp_path, cngram_path)
+
+class CompiledNgramDict:
+
+    # Read-only key -> code mapping over a memory-mapped compiled ngram dictionary.
+    # d[key] and d.get(key) give the code of a packed ngram key, d.inverse[code] gives back the ngram bytes.
+
+    def __init__(self, cngram_path):
+        with open(cngram_path, 'rb') as handle:
+            self._mm = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, bom, count, slots) = cngram_header.unpack_from(self._mm, 0)
+        if (magic != cngram_magic or bom != cdic_bom):
+            self._mm.close()
+            raise ValueError("not a compiled ngram dictionary for this platform: " + cngram_path)
+        view = memoryview(self._mm)
+        keys_pos = cngram_header.size
+        index_pos = keys_pos + 16 * count
+        self._count = count
+        self._bits = slots.bit_length() - 1
+        self._mask = slots - 1
+        self._keys = view[keys_pos:index_pos].cast('Q')
+        self._index = view[index_pos:index_pos + 4 * slots].cast('I')
+        self.inverse = CompiledNgramDictInverse(self)
+
+    def __len__(self):
+        return self._count
+
+    def get(self, key, default=None):
+        low = key & mask64
+        high = key >> 64
+        slot = ((low ^ high) * cngram_mult & mask64) >> (64 - self._bits)
+        entry = self._index[slot]
+        while entry:
+            if (self._keys[2 * entry - 2] == low and self._keys[2 * entry - 1] == high):
+                return entry - 1
+            slot = (slot + 1) & self._mask
+            entry = self._index[slot]
+        return default
+
+    def __getitem__(self, key):
+        code = self.get(key)
+        if code is None:
+            raise KeyError(key)
+        return code
+
+    def ngram_bytes(self, code):
+        if not (0 <= code < self._count):
+            raise KeyError(code)
+        key = self._keys[2 * code] | (self._keys[2 * code + 1] << 64)
+        if not key:
+            raise KeyError(code)
+        return (key >> 4).to_bytes(key & 15, 'little')
+
+class CompiledNgramDictInverse:
+
+    # code -> ngram bytes side of a CompiledNgramDict
+
+    def __init__(self, forward):
+        self._forward = forward
+
+    def __getitem__(self, code):
+        return self._forward.ngram_bytes(code)
 
-        debugw("pickling dictionaries")
-        with open(lang_id + '_1w.pickle', 'wb') as handle:
-            pickle.dump(onegrams, handle, protocol=pickle.HIGHEST_PROTOCOL)
+dicts = {}
 
-    else:
+# Session dictionary of a stream : its unknown words get ids from session_id_start on, in order of first appearance,
+# so that they are recalled with a 3 byte code instead of being escaped again.
+# The encoder and the decoder each build theirs along the stream, it is dropped with the stream.
+# The encoder only needs the word -> id side (SessionDict), the decoder the id -> word side (SessionWords).
 
-        debugw("loading pickled dictionaries")
-        with open(lang_id + '_1w.pickle', 'rb') as handle:
-            onegrams = pickle.load(handle)
-        
+class SessionDict:
 
+    # word -> id side of the session dictionary (encoder)
 
+    def __init__(self, capacity=None):
+        self._ids = {}
+        self._next_id = session_id_start
+        self._capacity = session_capacity if (capacity is None) else capacity
 
-    fourgrams = bidict()
-    duplicate_fourgrams_indexes = []
+    def __len__(self):
+        return self._next_id - session_id_start
 
+    def get(self, word):
+        return self._ids.get(word)
 
-    if (not os.path.isfile(lang_id + '_4w.pickle')):
+    def add(self, word):
+        # the decoder gives an id to every escaped word : an id is used even if the word is already there.
+        if (self._next_id - session_id_start >= self._capacity):
+            debugw("session dic full, not adding: " + word)
+            return None
+        word_id = self._next_id
+        self._ids[word] = word_id
+        self._next_id += 1
+        return word_id
 
-        ### populating ngram dict
+class SessionWords:
 
-        filengrams = open(lang_id + '_4w.bin', 'rt')
-        ngramlines = filengrams.readlines()
+    # id -> word side of the session dictionary (decoder)
 
-        count = 0
-        # populating dicts
-        for ngramline in ngramlines:
-        # Strips the newline character
-            #keystr = "".join([f"\\x{byte:02x}" for byte in ngramline.strip()])
-            #keystr = keystr.replace("\\","")
-            #if(count == 71374):
-            keystr = ngramline.strip()
-            #print(ngramline.strip())
-            #print(keystr)
-            #quit()
-            try:
-                fourgrams[keystr] = count
-            except Exception as error:
-                print(error)
-                duplicate_fourgrams_indexes.append(count)    
-            count += 1
+    def __init__(self, capacity=None):
+        self._words = []
+        self._capacity = session_capacity if (capacity is None) else capacity
 
-        debugw("pickling ngram dictionaries")
-        with open(lang_id + '_4w.pickle', 'wb') as handle:
-            pickle.dump(fourgrams, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    def __len__(self):
+        return len(self._words)
 
-    else:
+    def __getitem__(self, word_id):
+        index = word_id - session_id_start
+        if (index < 0 or index >= len(self._words)):
+            raise KeyError(word_id)
+        return self._words[index]
 
-        debugw("loading pickled ngram dictionaries")
-        with open(lang_id + '_4w.pickle', 'rb') as handle:
-            fourgrams = pickle.load(handle)
-            
-    idx = 0
-    debugw("first ngram in dict:")
-    test = fourgrams.inverse[0]
-    debugw(test)
-    debugw(fourgrams[test])
-    count = 0
+    def add(self, word):
+        if (len(self._words) < self._capacity):
+            self._words.append(word)
+
+def load_dicts(lang_id):
+
+    txt_path = lang_id + '_1w.txt'
+    cdic_path = lang_id + '_1w.cdic'
+
+    # compile on first load, or when the source dictionary has been modified since.
+    if (not os.path.isfile(cdic_path) or
+        (os.path.isfile(txt_path) and os.path.getmtime(txt_path) > os.path.getmtime(cdic_path))):
+        debugw("first load of dic, compiling")
+        compile_primary_dict(txt_path, cdic_path)
+
+    try:
+        onegrams = CompiledDict(cdic_path)
+    except ValueError as error:
+        debugw(error)
+        debugw("recompiling dictionary")
+        compile_primary_dict(txt_path, cdic_path)
+        onegrams = CompiledDict(cdic_path)
+
+    bin_path = lang_id + '_4w.bin'
+    cngram_path = lang_id + '_4w.cdic'
+
+    if (not os.path.isfile(cngram_path) or
+        (os.path.isfile(bin_path) and os.path.getmtime(bin_path) > os.path.getmtime(cngram_path))):
+        debugw("first load of ngram dic, compiling")
+        compile_ngram_dict(bin_path, cngram_path)
+
+    try:
+        fourgrams = CompiledNgramDict(cngram_path)
+    except ValueError as error:
+        debugw(error)
+        debugw("recompiling ngram dictionary")
+        compile_ngram_dict(bin_path, cngram_path)
+        fourgrams = CompiledNgramDict(cngram_path)
+
+    debugw("number of ngrams in dict:")
+    debugw(len(fourgrams))
 
     return onegrams , fourgrams
 
@@ -758,9 +1142,9 @@ def load_dicts(lang_id):
 
 
 def restore_unused_chars_shiftup(unused_seqs,compressed):
-    # works in-place
     #we need to restore original sequence after bwt_decode, knowing the highest unused char number.
     #in our case, simple byte sorting by value, not lexicographic as we are working on the full ASCII range
+    # single byte shifts go through a bytes.translate table, two byte escapes through bytes.replace
     debugw("unused_seqs_to_shift_up_into:")
     debugw(unused_seqs)
 
@@ -772,269 +1156,222 @@ def restore_unused_chars_shiftup(unused_seqs,compressed):
             return compressed
         
         debugw("two absent chars")
-        compzip = zip(range(0,len(compressed)),compressed)
-        for byte_and_pos in compzip:
-            if (byte_and_pos[1] >= unused_seqs[0]):            
-                debugw("byte_and_pos[0]")
-                debugw(byte_and_pos[0])
-                
-                debugw("byte_and_pos[1]")
-                debugw(byte_and_pos[1])
-                
-                compressed[byte_and_pos[0]] += 1
-
-        return compressed
-        
-        # compress bytearray modified in place, no need to return it
+        # the encoder shifted down every byte above the lowest absent char (unused_seqs[1]).
+        # the RLE separator (unused_seqs[0]) is gone after RLE decoding, every byte from the lowest absent char up
+        # is shifted back.
+        lowest_abs_char = unused_seqs[1]
+        table = bytes(range(0, lowest_abs_char)) + bytes(range(lowest_abs_char + 1, 256)) + b'\xff'
+        return bytearray(bytes(compressed).translate(table))
     
     elif (isinstance(unused_seqs[0],bytearray) and (isinstance(unused_seqs[1],int))):
     
         debugw("single absent char")
-        compressed_new = bytearray()
-        
-        jump = 0
-        for byte_idx in range(0,len(compressed)):
-            
-            byte_idx += jump
-            
-            if(byte_idx>=len(compressed)):
-                break
-            
-            if(byte_idx < len(compressed) - 1):
-                if(compressed[byte_idx:byte_idx+2] == unused_seqs[0]):
-                    debugw("swap absent seq 0 back to 255")
-                    jump += 1
-                    compressed_new.append(255)
-                    # swap back bwt eof.
-            if(compressed[byte_idx] == unused_seqs[1]):
-                debugw("swap absent char back to 254")
-                compressed_new.append(254)
-                # swap back unused char into rle sep
-            else:
-                # all other chars.
-                debugw("other char, no change")
-                compressed_new.append(compressed[byte_idx])
-                    
-
-        return compressed_new    
+        # the escape sequence never contains the absent char, so the order of the two swaps does not matter.
+        table = bytearray(range(0, 256))
+        table[unused_seqs[1]] = 254
+        return bytearray(bytes(compressed).replace(bytes(unused_seqs[0]), b'\xff').translate(table))
     
     elif (isinstance(unused_seqs[0],bytearray) and (isinstance(unused_seqs[1],bytearray))):
 
         debugw("zero absent char")
-        compressed_new = bytearray()
-        
-        jump = 0
-        for byte_idx in range(0,len(compressed)):
-            
-            byte_idx += jump
-
-            if(byte_idx>=len(compressed)):
-                break
-            
-            if(byte_idx < len(compressed) - 1):
-                if(compressed[byte_idx:byte_idx+2] == unused_seqs[0]):
-                    debugw("swap absent seq 0 back to 255")
-                    jump += 1
-                    compressed_new.append(255)
-                    # swap back bwt eof.
-                elif(compressed[byte_idx:byte_idx+2] == unused_seqs[1]):
-                    debugw("swap absent seq 1 back to 254")
-                    jump += 1
-                    compressed_new.append(254)
-                    # swap back bwt eof.
-                else:
-                    # all other chars.
-                    debugw("other char, no change")
-                    compressed_new.append(compressed[byte_idx])
-            
-            else:
-                # all other chars.
-                debugw("other char, no change")
-                compressed_new.append(compressed[byte_idx])
-                   
-        return compressed_new
+        # the two escape sequences share no byte and never contain 254 or 255.
+        compressed_new = bytes(compressed).replace(bytes(unused_seqs[0]), b'\xff')
+        return bytearray(compressed_new.replace(bytes(unused_seqs[1]), b'\xfe'))
   
     
     
+# bytes of the first sort key of suffixArray (7 * 9 bits fit in an int64)
+suffixarray_prefix = 7
+
 def suffixArray(s):
     #''' creation du suffixe array avec leurs rangs ordonnés ''' 
-    satups = sorted([(s[i:], i) for i in range(0, len(s)+1)])
-    return map(lambda x: x[1], satups)
+    # suffix array of s as an int64 numpy array, with the empty suffix (position len(s)), that sorts first.
+    # prefix doubling (Larsson-Sadakane) : the rank of a suffix is the position in the suffix array of the first
+    # suffix of its group, the suffixes that share their first k bytes. Each step sorts the suffixes of groups
+    # of more than one suffix by (rank at i, rank at i + k), which splits them by their first 2k bytes.
+    # Settled suffixes are not sorted again, a step costs O(m log m) for m unsettled suffixes.
+    import numpy as np
+
+    n = len(s)
+    size = n + 1
+    # first grouping by the first suffixarray_prefix bytes, packed into one integer key :
+    # 9 bits per byte (byte value + 1), 0 past the end of s.
+    k = suffixarray_prefix
+    padded = np.zeros(size + k, dtype=np.int64)
+    padded[:n] = np.frombuffer(bytes(s), dtype=np.uint8)
+    padded[:n] += 1
+    keys = np.zeros(size, dtype=np.int64)
+    for j in range(0, k):
+        keys <<= 9
+        keys |= padded[j:j + size]
+    sa = np.argsort(keys)
+    sorted_keys = keys[sa]
+
+    # boundary[p] : sa[p] starts a group
+    boundary = np.ones(size, dtype=bool)
+    boundary[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    positions = np.arange(size, dtype=np.int64)
+    rank = np.empty(size, dtype=np.int64)
+    rank[sa] = np.maximum.accumulate(np.where(boundary, positions, 0))
+
+    while(True):
+        # groups of one suffix are settled
+        settled = boundary.copy()
+        settled[:-1] &= boundary[1:]
+        unsettled = np.flatnonzero(~settled)
+        if (not len(unsettled)):
+            return sa
+        members = sa[unsettled]
+        # unsettled suffixes share their first k bytes with another one : they are at least k bytes long
+        second = rank[np.minimum(members + k, n)]
+        keys = rank[members] * (size + 1) + second
+        order = np.argsort(keys)
+        # the groups are contiguous and in rank order : sorted members go back to the same positions
+        sa[unsettled] = members[order]
+        sorted_keys = keys[order]
+        split = np.ones(len(unsettled), dtype=bool)
+        split[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        boundary[unsettled] = split
+        rank[sa[unsettled]] = np.maximum.accumulate(np.where(split, unsettled, 0))
+        k *= 2
 
 def bwt_encode(t,eof):
     ''' transformation de Burrow-wheeler ''' 
-    bw = bytearray()
-    for si in suffixArray(t):
-        if si == 0:
-            bw.extend(eof)
-        else:
-            bw.append(t[si-1])
-            #bw.append(t[si-len(eof)])
-    return bw    
-
-def rankBwt(bw):
-    ''' Retourne les rangs ''' 
-    tots = dict()
-    ranks = []
-    for c in bw:
-        if c not in tots:
-            tots[c] = 0
-        ranks.append(tots[c])
-        tots[c] += 1
-    return ranks, tots
-
-
-def firstCol(tots):
-    ''' retourne la premiere colonne ''' 
-    first = {}
-    totc = 0
-    for c, count in sorted(tots.items()):
-        first[c] = (totc, totc + count)
-        totc += count 
-    return first # returns dictionary of lexicographic order key = character value, dic val = (index_start,index_end (excluded))
-
-def bwt_decode(bw,eof):
+    # last column of the sorted rotations of t + eof, eof (255) being the greatest byte of the stream.
+    import numpy as np
+
+    if (not len(t)):
+        return bytearray(eof)
+    sa = suffixArray(t)
+    data = np.frombuffer(bytes(t), dtype=np.uint8)
+    # the byte before each suffix, the suffix at 0 gets eof
+    bw = data[sa - 1]
+    bw[sa == 0] = eof[0]
+    return bytearray(bw.tobytes())
+
+def bwt_encode_primary(t):
+    # sentinel-free BWT (primary_index_bwt) : the output of bwt_encode without its eof byte, and the row the eof
+    # was in (primary index). No byte value is reserved.
+    import numpy as np
+
+    if (not len(t)):
+        return (bytearray(), 0)
+    sa = suffixArray(t)
+    data = np.frombuffer(bytes(t), dtype=np.uint8)
+    primary = int(np.flatnonzero(sa == 0)[0])
+    bw = data[np.delete(sa, primary) - 1]
+    return (bytearray(bw.tobytes()), primary)
+
+# inverse BWT walk stride, see bwt_decode
+bwt_decode_stride = 32
+
+def bwt_decode(bw,eof,primary=None):
     ''' Retourne le texte original de la transformation bw '''
-    ranks, tots = rankBwt(bw)
-    first = firstCol(tots)
-    
-    rowi = 0
-    t= bytearray()
-    t.extend(eof)
-    
-    while (int.from_bytes(bw[rowi:rowi+len(eof)],'little') !=  int.from_bytes(eof,'little')):
-        c = bw[rowi]
-        t[:0] = bytearray(c.to_bytes(1,'little'))        
-        rowi = first[c][0] + ranks[rowi] + 1
-
-
-    
-    del(t[-len(eof):])
-    return t
+    # psi maps each row of the sorted rotations to the row of the next rotation (inverse of the LF mapping).
+    # It is the stable counting sort of the last column, eof (the whole text row) sorting first.
+    # The text is t[j] = bw[psi^(j+1)(row of eof)] : the walk jumps bwt_decode_stride rows at a time with
+    # psi^stride, then all the strides are expanded at once, forward into the output buffer.
+    # primary : bw is the output of bwt_encode_primary, the eof row is not in bw, it is row primary.
+    import numpy as np
+
+    last = np.frombuffer(bytes(bw), dtype=np.uint8)
+    if (primary is not None):
+        if (primary > len(last)):
+            raise ValueError("bwt primary index out of range")
+        last = np.insert(last, primary, 0)
+        row = primary
+    n = len(last) - 1
+    if (n <= 0):
+        return bytearray()
+    if (primary is None):
+        row = int(np.flatnonzero(last == eof[0])[0])
+    key = last.astype(np.int16) + 1
+    key[row] = 0
+    psi = np.argsort(key, kind='stable').astype(np.int32)
+
+    jump = psi
+    stride = 1
+    while (stride < bwt_decode_stride):
+        jump = jump[jump]
+        stride *= 2
+
+    count = (n + stride - 1) // stride
+    starts = np.empty(count, dtype=np.int32)
+    next_row = jump.item
+    for idx in range(0, count):
+        starts[idx] = row
+        row = next_row(row)
+
+    out = np.empty((count, stride), dtype=np.uint8)
+    rows = starts
+    for idx in range(0, stride):
+        rows = psi[rows]
+        out[:, idx] = last[rows]
+    return bytearray(out.reshape(-1)[:n].tobytes())
 
 
 
 def reuse_unused_chars_shiftdown(compressed):
-    # works in-place
     #we need to ensure that byte 255 is unused for BWT (used as eof) because of lexicographic constraints
     #in our case, simple byte sorting by value, not lexicographic as we are working on the full ASCII range
     # we also need another byte to be free as a rle separator, so we return it. - no need to shift for this
     # one, just return it in abs_chars
+    import numpy as np
 
-    frequency = Counter(compressed).most_common()
-    frequency_dic = {}
-
-    for (ascii_code, count) in frequency:
-        frequency_dic[ascii_code] = count
-    
-    abs_chars = []
-
-    for charval in range(255,0,-1):
-        if charval not in frequency_dic.keys():
-            abs_chars = abs_chars + [charval]
-            debugw("charval")
-            debugw(charval)
-        if (len(abs_chars) >= 2):
-            if(abs_chars[0] == 255 and abs_chars[1] == 254):
-                debugw("reversing")
-                abs_chars.reverse()
-                return (abs_chars,compressed)
-            else:
-                break
+    histogram = np.bincount(np.frombuffer(bytes(compressed), dtype=np.uint8), minlength=256)
+    # absent chars, highest first. byte 0 is never used as a separator.
+    abs_chars = [int(charval) for charval in np.flatnonzero(histogram[1:] == 0)[::-1][0:2] + 1]
+    debugw("absent chars")
+    debugw(abs_chars)
 
+    if (abs_chars == [255, 254]):
+        debugw("reversing")
+        abs_chars.reverse()
+        return (abs_chars,compressed)
 
     if(len(abs_chars) == 2):
 
-        #highest_abs_char = abs_chars[0]
         lowest_abs_char = abs_chars[1]
-
-        # special case where bwt eof is absent and next absent char is not 254.
-        # then we shift at the second absent char.
-        #if((highest_abs_char) == 255):
-        #    highest_abs_char = abs_chars[1]
-
-
-        compzip = zip(range(0,len(compressed)),compressed)
-        for byte_and_pos in compzip:
-            #if (byte_and_pos[1] > highest_abs_char):
-            if (byte_and_pos[1] > lowest_abs_char):
-                compressed[byte_and_pos[0]] -= 1
+        # every byte above the lowest absent char is shifted down by one.
+        table = bytes(range(0, lowest_abs_char + 1)) + bytes(range(lowest_abs_char, 255))
+        compressed = bytearray(bytes(compressed).translate(table))
 
         abs_chars[0] -= 1 # this will be the RLE, bwt will be the 255 freed.
         return (abs_chars,compressed)
     
-    elif(len(abs_chars) == 1):    
+    elif((len(abs_chars) == 1) and (abs_chars[0] != 255)):
         tmpchar = abs_chars[0]
         # alg :find one absent sequence of two different chars, highest possible, 
         # that do not contain 255 or 254 or absent char.
-        # swap 255 (bwt eof) into absent char.
-        # swap 254 into absent sequence.
-        abs_seqs  = find_absent_sequences(compressed,1,abs_chars[0])
+        # swap 255 (bwt eof) into absent sequence.
+        # swap 254 (rle sep) into absent char.
+        abs_seqs  = find_absent_sequences(compressed,1,tmpchar)
 
-        #abs_chars[0] = bytearray((abs_seqs[0]).to_bytes(2,'little'))
         abs_chars[0] = abs_seqs[0]
-        abs_chars.append(tmpchar) # tmpchar is the char in which bwt eof (255) has been swapped into.
+        abs_chars.append(tmpchar) # tmpchar is the char in which rle sep (254) has been swapped into.
         
-        debugw("will swap 255 into the lone absent char")
-        debugw("will swap 254 with found 2 byte escape sequence")
-
-
-        compressed_new = bytearray()
-        compzip = zip(range(0,len(compressed)),compressed)
-        for byte_and_pos in compzip:
-            #if (byte_and_pos[1] > highest_abs_char):
-            if (byte_and_pos[1] == 255):
-                debugw("replacing: 255 with: " + str(abs_seqs[0]))
-                compressed_new.extend(abs_chars[0])
-            elif (byte_and_pos[1] == 254):
-                debugw("replacing: 254 with: " + str(tmpchar))
-                compressed_new.append(tmpchar)
-            else:
-                debugw("other character, no change")
-                compressed_new.append(byte_and_pos[1])
+        debugw("will swap 255 with found 2 byte escape sequence")
+        debugw("will swap 254 into the lone absent char")
+
+        table = bytearray(range(0, 256))
+        table[254] = tmpchar
+        compressed_new = bytes(compressed).translate(table).replace(b'\xff', bytes(abs_seqs[0]))
 
         # format : abs_char[0] = absent sequence of two different chars that do not contain 255,254 or absent_char to make room bwt eof 255
         # format : abs_char[1] = tmpchar (original absent char). the char in which rle sep (254) has been swapped into. 
         
+        return (abs_chars,bytearray(compressed_new))
 
-        return (abs_chars,compressed_new)
-
-    elif(len(abs_chars) == 0):
-        
+    else:
+        # no absent char, or only 255 : 254 cannot be swapped into 255 (bwt eof), both get an escape sequence.
         abs_seqs = find_absent_sequences(compressed,2,-1,True)
-        #abs_chars[0] = bytearray((abs_seqs[0]).to_bytes(2,'little'))
-        #abs_chars[1] = bytearray((abs_seqs[1]).to_bytes(2,'little'))
-        abs_chars.append(abs_seqs[0])
-        abs_chars.append(abs_seqs[1])
-        
+        abs_chars = [abs_seqs[0], abs_seqs[1]]
 
-        compressed_new = bytearray()
-        #compzip = zip(range(0,len(compressed)),compressed)
-        
-        #for byte_and_pos in compzip:
-            #if (byte_and_pos[1] > highest_abs_char):
-        for byte_idx in range(0,len(compressed)):
+        compressed_new = bytes(compressed).replace(b'\xff', bytes(abs_seqs[0])).replace(b'\xfe', bytes(abs_seqs[1]))
 
- 
-            if (compressed[byte_idx] == 255):
-                debugw("replacing: 255 with: " + str(abs_seqs[0]))
-                compressed_new.extend(abs_chars[0])
-            elif (compressed[byte_idx] == 254):
-                debugw("replacing: 254 with: " + str(abs_seqs[1]) )
-                compressed_new.extend(abs_chars[1])
-            else:
-                debugw("other character, no change")
-                compressed_new.append(compressed[byte_idx])
-                
-                      
-        return (abs_chars,compressed_new)
+        return (abs_chars,bytearray(compressed_new))
         # format : abs_char[0] = first found escape sequence to make room for bwt char
         # format : abs_char[1] = second escape sequence to make room for rle char
-        
-    
-    #else:
-    #    return [-1]
-    # compressed modified in place, no need to return. return -1 if there are less than two absent chars.
 
 """
 def bwt_encode(byte_array, eof):
@@ -1095,137 +1432,288 @@ def bwt_decode(bwt_result, original_index, eof):
     return decoded
 """
 
-def find_repeating_chars(byte_array, n):
-    repeating_chars = {}
-
-    current_char = byte_array[0]
-    current_start = 0
-    count = 1
-
-    for i in range(1, len(byte_array)):
-        if byte_array[i] == current_char:
-            count += 1
-        else:
-            if count >= n:
-                repeating_chars[current_char] = (current_start, count)
-            
-            current_char = byte_array[i]
-            current_start = i
-            count = 1
-
-    # Check for the last character sequence
-    if count >= n:
-        repeating_chars[current_char] = (current_start, count)
-
-    return repeating_chars
+# RLE of the BWT output : each run of at least rle_min_run identical bytes is replaced by the repeated byte value +
+# separator (an absent byte) + repetition count, on one byte (count < 255), or 255 + two bytes (little endian), or
+# 255 255 + three bytes. A two byte count whose low byte is 255 would read as the three byte marker, it is written on
+# three bytes. Runs longer than three bytes can count are written as several runs.
+# Encoding and decoding are vectorized with numpy, only the separators are visited one by one when decoding.
+rle_min_run = 4
 
 def replace_repeating_chars(byte_array, n, separator):
-    result_array = bytearray()
-    
-    current_char = byte_array[0]
-    current_start = 0
-    count = 1
-
-    for i in range(1, len(byte_array)):
-        if byte_array[i] == current_char:
-            count += 1
+    import numpy as np
+
+    data = np.frombuffer(bytes(byte_array), dtype=np.uint8)
+    if (len(data) == 0):
+        return bytearray()
+    starts = np.concatenate(([0], np.flatnonzero(data[1:] != data[:-1]) + 1))
+    lengths = np.diff(np.append(starts, len(data)))
+    encoded = lengths >= n
+
+    # runs too long for a three byte count, cut into runs of 0xFFFFFF (and the rest)
+    if (np.any(lengths > 0xFFFFFF)):
+        pieces = np.where(lengths > 0xFFFFFF, (lengths + 0xFFFFFF - 1) // 0xFFFFFF, 1)
+        piece_idx = np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        run_lengths = np.repeat(lengths, pieces)
+        starts = np.repeat(starts, pieces) + piece_idx * 0xFFFFFF
+        lengths = np.minimum(run_lengths - piece_idx * 0xFFFFFF, 0xFFFFFF)
+        encoded = np.repeat(encoded, pieces)
+
+    # output length of each run : the run itself, or byte + separator + count
+    one_byte = encoded & (lengths < 255)
+    two_bytes = encoded & (lengths >= 255) & (lengths < 65535) & ((lengths & 0xFF) != 0xFF)
+    three_bytes = encoded & ~one_byte & ~two_bytes
+    out_lengths = np.where(encoded, 3, lengths) + 2 * two_bytes + 4 * three_bytes
+    out_starts = np.cumsum(out_lengths) - out_lengths
+    result = np.empty(int(out_lengths.sum()), dtype=np.uint8)
+
+    # bytes of the runs that stay as they are
+    plain = np.repeat(~encoded, lengths)
+    shift = np.repeat(out_starts - starts, lengths)
+    plain_idx = np.flatnonzero(plain)
+    result[plain_idx + shift[plain_idx]] = data[plain_idx]
+
+    at = out_starts[encoded]
+    count = lengths[encoded]
+    result[at] = data[starts[encoded]]
+    result[at + 1] = separator
+    (one, two, three) = (one_byte[encoded], two_bytes[encoded], three_bytes[encoded])
+    result[at[one] + 2] = count[one]
+    result[at[two] + 2] = 255
+    result[at[two] + 3] = count[two] & 0xFF
+    result[at[two] + 4] = count[two] >> 8
+    result[at[three] + 2] = 255
+    result[at[three] + 3] = 255
+    result[at[three] + 4] = count[three] & 0xFF
+    result[at[three] + 5] = (count[three] >> 8) & 0xFF
+    result[at[three] + 6] = count[three] >> 16
+    return bytearray(result.tobytes())
+
+def expand_repeating_chars(byte_array, separator):
+    # inverse of replace_repeating_chars
+    import numpy as np
+
+    raw = bytes(byte_array)
+    data = np.frombuffer(raw, dtype=np.uint8)
+    # a separator inside the count of the previous run is a count byte, the separators are walked in order
+    separators = []
+    rep_nums = []
+    ends = []
+    end = 0
+    for idx in np.flatnonzero(data == separator).tolist():
+        if (idx < end):
+            continue
+        if (raw[idx + 1:idx + 3] == b'\xFF\xFF'):
+            rep_nums.append(int.from_bytes(raw[idx + 3:idx + 6], 'little'))
+            end = idx + 6
+        elif (raw[idx + 1] == 255):
+            rep_nums.append(int.from_bytes(raw[idx + 2:idx + 4], 'little'))
+            end = idx + 4
         else:
-            if count >= n:
-                # Replace repetitions with encoded value (repeated byte value + separator (maybe one or more bytes, that do not appear
-                # in the stream) + total repetition count encoded on one byte (count <255) 
-                # or two bytes(two bytes for count<65535, + one byte at 255 to signal encoding on two bytes)
-
-                # special cases :
-                #current_char == separator : impossible since separator is verified not to be in the charset
-                #number of repetitions == separator, possible, but we jump over.
-
-                debugw("will replace repetitions n=" + str(count))
-                encoded_value = bytearray(current_char.to_bytes(1,'little'))
-                encoded_value.extend(separator.to_bytes(1,'little'))
-                if (count < 255):
-                    encoded_value.append(count.to_bytes(1,'little')[0])
-                else:
-                    encoded_value.append(255)
-                    encoded_value.extend(count.to_bytes(2,'little'))                    
-                #encoded_value = bytes([current_char, separator, count])
-                result_array.extend(encoded_value)
-                debugw("encoded value:")
-                debugw("".join([f"\\x{byte:02x}" for byte in encoded_value]))
-            else:
-                result_array.extend(byte_array[current_start:i])
-                debugw("no change:")
-                debugw("".join([f"\\x{byte:02x}" for byte in byte_array[current_start:i]]))
-            
-
-            current_char = byte_array[i]
-            current_start = i
-            count = 1
-
-    # Check for the last character sequence
-    if count >= n:
-        encoded_value = bytearray(current_char.to_bytes(1,'little'))
-        encoded_value.extend(separator.to_bytes(1,'little'))
-        if (count < 255):
-            encoded_value.append(count.to_bytes(1,'little')[0])
+            rep_nums.append(raw[idx + 1])
+            end = idx + 2
+        separators.append(idx)
+        ends.append(end)
+
+    # each byte is written repeats[idx] times : separators and counts 0 times, repeated bytes count times
+    repeats = np.ones(len(data), dtype=np.int64)
+    separators = np.array(separators, dtype=np.int64)
+    repeats[separators - 1] = rep_nums
+    in_field = np.zeros(len(data) + 1, dtype=np.int8)
+    in_field[separators] = 1
+    in_field[np.array(ends, dtype=np.int64)] -= 1
+    repeats[np.cumsum(in_field[:-1]) > 0] = 0
+    return bytearray(np.repeat(data, repeats).tobytes())
+
+# In-band RLE of the sentinel-free BWT output (primary_index_bwt) : after run identical bytes, the next byte is the
+# count of further repeats of that byte (0 .. 255), longer runs are written as several runs. No separator is needed,
+# the decoder counts identical bytes. run is chosen per block (choose_inband_run), 0 is no RLE.
+inband_runs = (2, 3, 4)
+# first byte of a sentinel-free block, after the final huffmann pass is decoded (0xFF, 0xFE, 0xFD : version 1 blocks)
+block_header_primary = 0xFC
+
+def replace_runs_inband(byte_array, run):
+    import numpy as np
+
+    data = np.frombuffer(bytes(byte_array), dtype=np.uint8)
+    if ((len(data) == 0) or (run == 0)):
+        return bytearray(data.tobytes())
+    starts = np.concatenate(([0], np.flatnonzero(data[1:] != data[:-1]) + 1))
+    lengths = np.diff(np.append(starts, len(data)))
+
+    # runs of more than run + 255 bytes are cut into pieces of run + 255 (and the rest)
+    span = run + 255
+    full = np.where(lengths >= run, lengths // span, 0)
+    rest = lengths - full * span
+    pieces = full + (rest > 0)
+    piece_lengths = np.full(int(pieces.sum()), span, dtype=np.int64)
+    piece_lengths[(np.cumsum(pieces) - 1)[rest > 0]] = rest[rest > 0]
+    values = np.repeat(data[starts], pieces)
+
+    # a piece of at least run bytes is written as run bytes and its count
+    counted = piece_lengths >= run
+    out_lengths = np.minimum(piece_lengths, run) + counted
+    result = np.repeat(values, out_lengths)
+    result[(np.cumsum(out_lengths) - 1)[counted]] = piece_lengths[counted] - run
+    return bytearray(result.tobytes())
+
+def expand_runs_inband(byte_array, run):
+    # inverse of replace_runs_inband
+    import numpy as np
+
+    raw = bytes(byte_array)
+    data = np.frombuffer(raw, dtype=np.uint8)
+    if ((run == 0) or (len(data) < run)):
+        return bytearray(raw)
+    # window[idx] : the run bytes from idx are identical. After a count, bytes are counted again from the next one,
+    # the windows are walked in order.
+    same = data[1:] == data[:-1]
+    window = np.ones(len(data) - run + 1, dtype=bool)
+    for idx in range(0, run - 1):
+        window &= same[idx:idx + len(window)]
+    counts = []
+    end = 0
+    for idx in np.flatnonzero(window).tolist():
+        if (idx < end):
+            continue
+        end = idx + run + 1
+        counts.append(end - 1)
+    counts = np.array(counts, dtype=np.int64)
+    if (len(counts) and (counts[-1] >= len(data))):
+        raise ValueError("truncated run count")
+
+    # the last byte of each run is written count + 1 times, the counts 0 times
+    repeats = np.ones(len(data), dtype=np.int64)
+    repeats[counts - 1] += data[counts]
+    repeats[counts] = 0
+    return bytearray(np.repeat(data, repeats).tobytes())
+
+def choose_inband_run(byte_array, codec):
+    # (run, RLE output) of the run in (0,) + inband_runs whose output has the shortest code with the final pass codec,
+    # from the code lengths of the codec and the byte histogram of each output.
+    import numpy as np
+
+    code_lengths = huffman_code_lengths(codec)
+    best = None
+    for run in (0,) + inband_runs:
+        encoded = replace_runs_inband(byte_array, run)
+        bits = int(np.dot(np.bincount(np.frombuffer(bytes(encoded), dtype=np.uint8), minlength=256), code_lengths))
+        debugw("in-band run " + str(run) + ": " + str(len(encoded)) + " bytes, " + str(bits) + " bits")
+        if ((best is None) or (bits < best[0])):
+            best = (bits, run, encoded)
+    return best[1:]
+
+def bwt_second_stage(byte_array, separator, mtf):
+    # RLE of the BWT output, or move-to-front and zero runs (the separator is not used then).
+    if (mtf):
+        return mtf_encode(byte_array)
+    return replace_repeating_chars(byte_array, rle_min_run, separator)
+
+# Move-to-front and zero run coding (bzip2 style) of the BWT output, mtf_stage.
+# Each byte is replaced by its rank in a list of the 256 byte values, which it is then moved to the front of.
+# Runs of rank 0 are written in bijective base 2, least significant digit first, with the digits mtf_runa (1)
+# and mtf_runb (2). Ranks 1 .. 253 are written as rank + 1, ranks 254 and 255 as mtf_escape then the rank.
+mtf_runa = 0
+mtf_runb = 1
+mtf_escape = 255
+
+def mtf_encode(byte_array):
+    import numpy as np
+
+    data = np.frombuffer(bytes(byte_array), dtype=np.uint8)
+    result = bytearray()
+    if (len(data) == 0):
+        return result
+    # a rank is only looked up at the start of a run of identical bytes, the rest of the run is rank 0
+    starts = np.concatenate(([0], np.flatnonzero(data[1:] != data[:-1]) + 1))
+    lengths = np.diff(np.append(starts, len(data)))
+
+    order = bytearray(range(0, 256))
+    zero_run = 0
+    for (byte, length) in zip(data[starts].tolist(), lengths.tolist()):
+        rank = order.index(byte)
+        if (rank == 0):
+            zero_run += length
+            continue
+        mtf_write_zero_run(result, zero_run)
+        if (rank < mtf_escape - 1):
+            result.append(rank + 1)
         else:
-            encoded_value.append(255)
-            encoded_value.extend(count.to_bytes(2,'little'))  
-        #encoded_value = bytes([current_char, separator, count])
-        result_array.extend(encoded_value)
-    else:
-        result_array.extend(byte_array[current_start:])
-
-    return result_array
+            result.append(mtf_escape)
+            result.append(rank)
+        order[1:rank + 1] = order[0:rank]
+        order[0] = byte
+        zero_run = length - 1
+    mtf_write_zero_run(result, zero_run)
+    return result
+
+def mtf_write_zero_run(result, zero_run):
+    while (zero_run > 0):
+        if (zero_run & 1):
+            result.append(mtf_runa)
+            zero_run = (zero_run - 1) >> 1
+        else:
+            result.append(mtf_runb)
+            zero_run = (zero_run - 2) >> 1
+
+def mtf_decode(symbols):
+    result = bytearray()
+    order = bytearray(range(0, 256))
+    zero_run = 0
+    digit = 1
+    escaped = False
+    for symbol in symbols:
+        if ((symbol == mtf_runa) or (symbol == mtf_runb)) and (not escaped):
+            zero_run += digit if (symbol == mtf_runa) else 2 * digit
+            digit *= 2
+            continue
+        if (zero_run):
+            result.extend(order[0:1] * zero_run)
+            zero_run = 0
+            digit = 1
+        if (escaped):
+            rank = symbol
+            escaped = False
+        elif (symbol == mtf_escape):
+            escaped = True
+            continue
+        else:
+            rank = symbol - 1
+        byte = order[rank]
+        order[1:rank + 1] = order[0:rank]
+        order[0] = byte
+        result.append(byte)
+    if (zero_run):
+        result.extend(order[0:1] * zero_run)
+    return result
 
 def find_absent_sequences(byte_array,n,forbidden_char=-1,no_overlap=False):
-    # Step 1: Build a set of all contiguous two-byte sequences present in the file
-    present_sequences = set()
-    for i in range(len(byte_array) - 1):
-        present_sequences.add((byte_array[i], byte_array[i + 1]))
+    import numpy as np
 
-    # Step 2: Build a list of all possible two-byte sequences, excluding : 254, identical chars, and forbidden char.
-    all_possible_sequences = [(high, low) if ((high != low) or (high == forbidden_char) or (low == forbidden_char)) else None for high in range(253,0,-1) for low in range(253,0,-1)]
+    # Step 1: 65536 bin histogram of all contiguous two-byte sequences present in the file
+    data = np.frombuffer(bytes(byte_array), dtype=np.uint8)
+    pairs = np.bincount(data[:-1].astype(np.int32) * 256 + data[1:], minlength=65536).reshape(256, 256)
 
-    # Step 3: Find sequences not present in the file, stopping when at least n absent sequences are found
-    absent_sequences = []
-    count = 0
+    # Step 2: candidates are all two-byte sequences from 253 down to 1 (highest first), excluding
+    # identical chars and sequences containing the forbidden char.
+    values = np.arange(253, 0, -1)
+    absent = (pairs[253:0:-1, 253:0:-1] == 0)
+    absent &= (values[:, None] != values[None, :])
+    if (forbidden_char > 0):
+        absent &= (values[:, None] != forbidden_char) & (values[None, :] != forbidden_char)
 
-    if(not no_overlap):
-        debugw("overlap allowed")
-        for seq in all_possible_sequences:
-            if seq == None:
-                debugw("skipping None sequence")
-                continue
-    
-            if (seq not in present_sequences):
-                tmp_abs = bytearray(seq)
-                absent_sequences.append(tmp_abs)
-                count += 1
-                if count >= n:
-                    break
-    else:
+    # Step 3: keep the first n absent sequences
+    absent_sequences = []
+    prevseq = ()
+    if(no_overlap):
         debugw("overlap not allowed")
-        prevseq = []
-        for seq in all_possible_sequences:
-            if seq == None:
-                debugw("skipping None sequence")
-                continue                
-            if (seq not in present_sequences):
-                    overlap = False
-                    for single_char in seq:
-                        if single_char in prevseq:
-                            debugw("overlap detected, not adding")
-                            overlap = True
-                            break
-                    if(overlap):
-                        overlap = False
-                        continue            
-                    tmp_abs = bytearray(seq)
-                    absent_sequences.append(tmp_abs)
-                    count += 1
-                    prevseq = seq
-                    if count >= n:
-                        break
+    for candidate in np.flatnonzero(absent):
+        seq = (int(values[candidate // 253]), int(values[candidate % 253]))
+        if (no_overlap and ((seq[0] in prevseq) or (seq[1] in prevseq))):
+            continue
+        absent_sequences.append(bytearray(seq))
+        prevseq = seq
+        if (len(absent_sequences) >= n):
+            break
 
     return absent_sequences
 
@@ -1294,268 +1782,217 @@ def encode_unknown(token,treecode):
                 debugw("non ascii character in unknown token, silent drop")
 
         return bytes_unknown
-    if (treecode == 1):
-        return codec_lower.encode(token)
-    if (treecode == 2):
-        return codec_upperlower.encode(token)           
-    if (treecode == 3):
-        return codec_alphanumeric.encode(token)                      
-    if (treecode == 4):
-        return codec_all.encode(token)                      
+    if (treecode in unknown_token_codecs):
+        return get_codec(unknown_token_codecs[treecode]).encode(token)
 
 def decode_unknown(bytetoken,treecode):
 
-    if (treecode == 1):
-        return codec_lower.decode(bytetoken)
-    if (treecode == 2):
-        return codec_upperlower.decode(bytetoken)           
-    if (treecode == 3):
-        return codec_alphanumeric.decode(bytetoken)                      
-    if (treecode == 4):
-        return codec_all.decode(bytetoken)  
+    if (treecode in unknown_token_codecs):
+        return get_codec(unknown_token_codecs[treecode]).decode(bytetoken)
+
+def pack_token_id(tokenid):
+
+    # variable length encoding of a token id, see ALGORITHM above.
+    if (tokenid < 128):
+        # super common word
+        return bytes((tokenid,))
+    if (tokenid < 16384 + 128):
+        # common word : 14 bits, msb of first byte set
+        v = tokenid - 128
+        return bytes(((v & 0x7f) | 0x80, v >> 7))
+    if (tokenid < 2097152 + 16384 + 128):
+        # rare word or ngram : 21 bits, msb of first and second bytes set
+        v = tokenid - (16384 + 128)
+        return bytes(((v & 0x7f) | 0x80, ((v >> 7) & 0x7f) | 0x80, v >> 14))
+    if (tokenid < 4194304 - 5):
+        # unknown word from session DIC : 21 bits, msb of the three bytes set
+        v = tokenid - (2097152 + 16384 + 128)
+        return bytes(((v & 0x7f) | 0x80, ((v >> 7) & 0x7f) | 0x80, (v >> 14) | 0x80))
+    # huffmann tree codes 4194299 to 4194303 are encoded without offset, the range sets the msb of the third byte.
+    return bytes(((tokenid & 0x7f) | 0x80, ((tokenid >> 7) & 0x7f) | 0x80, tokenid >> 14))
+
+def encode_token_id(tokenid):
+
+    # the one and two bytes encodings (ids below 16512) cover the bulk of english text, they are looked up
+    # in a table built on first use. a table of the whole primary dictionary would cost ~15 MB per process
+    # for the rare words tier, where packing the id is nearly as fast.
+    if (tokenid < 16384 + 128):
+        if (encode_token_id.table is None):
+            encode_token_id.table = [pack_token_id(i) for i in range(0, 16384 + 128)]
+        return encode_token_id.table[tokenid]
+    return pack_token_id(tokenid)
+
+encode_token_id.table = None
+
+# below this many tokens, numpy setup costs more than encoding token by token.
+encode_token_ids_min = 64
+
+def encode_token_ids(token_ids, literals):
+
+    # bulk encoding of a sequence of token ids, returns the compressed bytearray.
+    # literals maps a position in token_ids to the bytes that follow the encoded id (unknown token payloads).
+    count = len(token_ids)
+    if (count < encode_token_ids_min):
+        compressed = bytearray()
+        for idx in range(0, count):
+            compressed.extend(encode_token_id(token_ids[idx]))
+            if (idx in literals):
+                compressed.extend(literals[idx])
+        return compressed
 
-def compress_token_or_subtoken(compressed,line_token,token_of_line_count,lentoken,gendic):
-  
-    
-    global unknown_token_idx
+    import numpy as np
+
+    ids = np.asarray(token_ids, dtype=np.int64)
+    one_byte = ids < 128
+    two_bytes = (ids >= 128) & (ids < 16384 + 128)
+    three_bytes = ids >= 16384 + 128
+    session = (ids >= 2097152 + 16384 + 128) & (ids < 4194304 - 5)
+
+    # offset of each tier, huffmann tree codes have none (see pack_token_id)
+    offsets = np.where(two_bytes, 128, 0)
+    offsets[three_bytes & (ids < 2097152 + 16384 + 128)] = 16384 + 128
+    offsets[session] = 2097152 + 16384 + 128
+    values = ids - offsets
+
+    lengths = np.where(one_byte, 1, np.where(two_bytes, 2, 3))
+    literal_lengths = np.zeros(count, dtype=np.int64)
+    for (idx, literal) in literals.items():
+        literal_lengths[idx] = len(literal)
+    ends = np.cumsum(lengths + literal_lengths)
+    starts = ends - literal_lengths - lengths
+
+    # one allocation for the whole stream, numpy writes into the bytearray through a view.
+    compressed = bytearray(int(ends[-1]))
+    out = np.frombuffer(compressed, dtype=np.uint8)
+
+    # first byte : 7 bits, msb set unless one byte tier
+    out[starts] = np.where(one_byte, values, (values & 0x7f) | 0x80)
+    # second byte : 7 bits, msb set for three bytes tiers
+    multi = ~one_byte
+    second = np.where(two_bytes, values >> 7, ((values >> 7) & 0x7f) | 0x80)
+    out[starts[multi] + 1] = second[multi]
+    # third byte : remaining bits, msb set for session ids
+    third = np.where(session, (values >> 14) | 0x80, values >> 14)
+    out[starts[three_bytes] + 2] = third[three_bytes]
+
+    for (idx, literal) in literals.items():
+        end = int(ends[idx])
+        compressed[end - len(literal):end] = literal
+    return compressed
 
-    try:
+# bounded LRU cache of the resolution of tokens missing from the primary dictionary, keyed by the raw token.
+# Repeated unknown strings (signatures, product codes, names with trailing punctuation) then cost one dict hit
+# instead of a failed lookup, a word_tokenize call and a lookup per subtoken.
+# value : (subtokens, primary ids), the primary id of a subtoken is None if it is not in the compiled dictionary.
+# Such subtokens are looked up in the session dictionary at each use, as it grows along the stream.
+subtoken_cache_size = 65536
+
+def resolve_unknown_token(line_token):
+
+    cache = resolve_unknown_token.cache
+    resolved = cache.get(line_token)
+    if (resolved is not None):
+        cache.move_to_end(line_token)
+        resolve_unknown_token.hits += 1
+        return resolved
+
+    resolve_unknown_token.misses += 1
+    # let's try to split the unknown word from possible adjunct special chars
+    # for this we use another tokenizer
+    subtokens = tuple(word_tokenize(line_token))
+    if (len(subtokens) == 1):
+        primary_ids = (None,)
+    else:
+        primary_ids = tuple(dicts['en'][0].compiled_word_id(subtoken) for subtoken in subtokens)
+    resolved = (subtokens, primary_ids)
+    cache[line_token] = resolved
+    if (len(cache) > subtoken_cache_size):
+        cache.popitem(last=False)
+    return resolved
+
+resolve_unknown_token.cache = OrderedDict()
+resolve_unknown_token.hits = 0
+resolve_unknown_token.misses = 0
+
+
+def compress_token_or_subtoken(token_ids,literals,session,line_token,token_of_line_count,lentoken,gendic):
+
+    # appends the token ids of line_token to token_ids, they are encoded in bulk by encode_token_ids.
+    # the unknown token payload that follows a huffmann tree code is stored in literals, keyed by the position
+    # of the code in token_ids. Unknown tokens are added to the session dictionary of the stream (session).
+
+    # is the token in english dictionary ?
+    debugw("line_token:" + line_token)
+    primary = dicts['en'][0]
+    if (line_token in resolve_unknown_token.cache):
+        # known miss of the compiled dictionary
+        tokenid = session.get(line_token)
+    else:
+        tokenid = primary.compiled_word_id(line_token)
+        if (tokenid is None):
+            tokenid = session.get(line_token)
 
-        # is the token in english dictionary ?
-        debugw("line_token:" + line_token)
-        tokenid = dicts['en'][0].inverse[line_token]
+    if (tokenid is not None):
+        subtokens = [line_token]
         subtokensid = [tokenid]
-
-        
-    except:
+    else:
         debugw("unknown word, special chars adjunct, or possessive form")
-        # let's try to split the unknown word from possible adjunct special chars
-        # for this we use another tokenizer
-        subtokens = nltk.word_tokenize(line_token)
+        (subtokens, primary_ids) = resolve_unknown_token(line_token)
         if (len(subtokens) == 1):
             # no luck...
             # TODO : do not drop the word silently, encode it !
             # If we encode a ngram dic, skip ngrams with unknown tokens in the primary dic.
-            # and return empty bytearray to signify ngram compression failure 
+            # and return None to signify ngram compression failure 
             if(gendic):
-                compressed = bytearray()
                 debugw("gendic : unknown word")
-                return (compressed, token_of_line_count)
+                return None
         
             debugw("unknown word")
 
             #AMEND dictionary 
             # add this unknown subtoken to a session dic so it can be recalled.
-            debugw("unknown word: " + subtokens[0] + " adding to session dic at id: " + str(unknown_token_idx))
-            debugw("unknown word, adding to session dic at id: " + str(unknown_token_idx))
-            
-            dicts['en'][0].inverse[subtokens[0]] = unknown_token_idx
-            dicts['en'][0][unknown_token_idx] = subtokens[0]
-            unknown_token_idx += 1
+            debugw("unknown word: " + subtokens[0] + " adding to session dic")
+            session.add(subtokens[0])
                        
-
-            #subtokensid = [4194304 - 1] # subtoken code for unknown word escape sequence.                       
             subtokensid = [4194303 - find_huffmann_to_use(subtokens[0])]                   
-            #print(subtokensid)
-            #continue
         else:
             debugw("possible special char found")
             subtokensid = []
-            for subtoken in subtokens:
+            for (subtoken, subtokenid) in zip(subtokens, primary_ids):
                 debugw("subtoken=")
                 debugw(subtoken)
-                try:
-                    subtokensid.append(dicts['en'][0].inverse[subtoken])
-                except:
+                if (subtokenid is None):
+                    subtokenid = session.get(subtoken)
+                if (subtokenid is not None):
+                    subtokensid.append(subtokenid)
+                else:
                     # no luck...
-                    # TODO : do not drop the word silently, encode it !
-        
                     # If we encode a ngram dic, skip ngrams with unknown tokens in the primary dic.
-                    # and return empty bytearray to signify ngram compression failure 
+                    # and return None to signify ngram compression failure 
                     if(gendic):
-                        compressed = bytearray()
                         debugw("gendic : unknown word")
-                        return (compressed, token_of_line_count)
+                        return None
         
                     debugw("unknown subtoken")
                     subtokensid.append(4194303 - find_huffmann_to_use(subtoken))
-                    #subtokensid.append(4194304 - 1)
                     
-                    # add this unknown subtoken to a session dic so it can be recalled.
                     #AMEND dictionary 
                     # add this unknown subtoken to a session dic so it can be recalled.
-                    debugw("unknown subtoken: " + subtoken + " adding to session dic at id: " + str(unknown_token_idx))
-                    debugw("unknown subtoken, adding to session dic at id: " + str(unknown_token_idx))
-                    dicts['en'][0].inverse[subtoken] = unknown_token_idx
-                    dicts['en'][0][unknown_token_idx] = subtoken
-                    unknown_token_idx += 1
-                    #continue
+                    debugw("unknown subtoken: " + subtoken + " adding to session dic")
+                    session.add(subtoken)
     subtokenidx = 0
     for subtokenid in subtokensid:        
         
         debugw("subtokenid=")
         debugw(subtokenid)
         # maximum level of token unpacking is done
-        if(subtokenid < 128):
-
-            debugw("super common word")
-            debugw(dicts['en'][0][subtokenid])
-
-            #convert to bytes
-            byte0 = subtokenid.to_bytes(1, byteorder='little')
-            debugw("hex:")
-            debugw(byte0.hex())
-
-            #append to bytearray
-            compressed.append(byte0[0])
-
-        if(128 <= subtokenid < 16384 + 128):
-
-            debugw("common word")
-
-            #remove offset
-            debugw(dicts['en'][0][subtokenid])
-            subtokenid -= 128
-            
-            #convert to bytes1 (array of 2 bytes)
-            bytes1 = subtokenid.to_bytes(2,byteorder='little')
-            debugw("".join([f"\\x{byte:02x}" for byte in bytes1]))
-        
-            #convert to bitarray
-            c = bitarray(endian='little')
-            c.frombytes(bytes1)
-            debugw(c)
-            
-            # set msb of first byte to 1 and shift the more significant bits up.
-            c.insert(7,1)
-            debugw(c)
-            
-            # remove excess bit
-            del c[16:17:1]
-            debugw(c)
-            
-            # append our two tweaked bytes to the compressed bytearray
-            compressed.append((c.tobytes())[0])
-            compressed.append((c.tobytes())[1])
-
-        #if(16384 +128 <= subtokenid < 4194304 - 1):
-        if(16384 +128 <= subtokenid < 2097152 + 16384 + 128):
-
-
-            debugw("rare word")
-            
-            # remove offset
-            debugw(dicts['en'][0][subtokenid])
-            subtokenid -= (16384 + 128)
-
-            #convert to bytes1 (array of 3 bytes)
-            bytes2 = subtokenid.to_bytes(3,byteorder='little')
-            debugw("".join([f"\\x{byte:02x}" for byte in bytes2]))
-
-            #convert to bitarray
-            c = bitarray(endian='little')
-            c.frombytes(bytes2)
-            debugw(c)
-            
-            # set msb of first byte to 1 and shift the bits above up.
-            c.insert(7,1)
-            debugw(c)
-
-            # set msb of second byte to 1 and shift the bits above up.
-            c.insert(15,1)
-            debugw(c)
-
-            # remove two excess bits that arose from our shifts
-            del c[24:26:1]
-            debugw(c)
-            
-            # append our three tweaked bytes to the compressed bytearray
-            compressed.append((c.tobytes())[0])
-            compressed.append((c.tobytes())[1])
-            compressed.append((c.tobytes())[2])
-
-
-                #if(16384 +128 <= subtokenid < 4194304 - 1):
-        if(16384 +128 + 2097152 <= subtokenid < 4194304 - 5):
-
-
-            debugw("unknown word from session DIC")
-            
-            # remove offset
-            debugw(dicts['en'][0][subtokenid])
-            subtokenid -= (2097152 + 16384 + 128)
-
-            #convert to bytes1 (array of 3 bytes)
-            bytes2 = subtokenid.to_bytes(3,byteorder='little')
-            debugw("".join([f"\\x{byte:02x}" for byte in bytes2]))
-
-            #convert to bitarray
-            c = bitarray(endian='little')
-            c.frombytes(bytes2)
-            debugw(c)
-            
-            # set msb of first byte to 1 and shift the bits above up.
-            c.insert(7,1)
-            debugw(c)
-
-            # set msb of second byte to 1 and shift the bits above up.
-            c.insert(15,1)
-            debugw(c)
-
-            # set msb of third byte to 1 and shift the bits above up.
-            c.insert(23,1)
-            debugw(c)
-
-
-            # remove three excess bits that arose from our shifts
-            del c[24:27:1]
-            debugw(c)
-            
-            # append our three tweaked bytes to the compressed bytearray
-            compressed.append((c.tobytes())[0])
-            compressed.append((c.tobytes())[1])
-            compressed.append((c.tobytes())[2])
-
 
         #if(subtokenid == (4194304 - 1)):
         if(subtokenid in range(4194299,4194304)):
 
-            #compressed.append(255)
-            #compressed.append(255)
-            #compressed.append(255)
+            # the three bytes that signify the huffmann tree to use are followed by the unknown token.
             debugw("huffmann tree code :" + str(subtokenid))
-
-            # TODO : Use Huffmann tree instead of byte->byte encoding.
-            
-            #convert to bytes1 (array of 3 bytes)
-            bytes2 = subtokenid.to_bytes(3,byteorder='little')
-            debugw("".join([f"\\x{byte:02x}" for byte in bytes2]))
-
-            #convert to bitarray
-            c = bitarray(endian='little')
-            c.frombytes(bytes2)
-            debugw(c)
-            
-            # set msb of first byte to 1 and shift the bits above up.
-            c.insert(7,1)
-            debugw(c)
-
-            # set msb of second byte to 1 and shift the bits above up.
-            c.insert(15,1)
-            debugw(c)
-
-            # no need to set  msb of third byte to 1 since the range will take care of it.
-            #c.insert(23,1)
-            #debugw(c)
-
-            # remove two excess bits that arose from our shifts
-            del c[24:26:1]
-            debugw(c)
-            
-            # append our three tweaked bytes that signify the huffmann tree to use to the compressed bytearray
-            compressed.append((c.tobytes())[0])
-            compressed.append((c.tobytes())[1])
-            compressed.append((c.tobytes())[2])
+            compressed = bytearray()
 
             if (len(subtokens) == 1):
                 if(not use_huffmann):
@@ -1584,6 +2021,8 @@ def compress_token_or_subtoken(compressed,line_token,token_of_line_count,lentoke
                     huffmann_tree_code = -(subtokenid - 4194303)
                     compressed.extend(encode_unknown(subtokens[subtokenidx],huffmann_tree_code))
             compressed.append(0) # terminate c string style
+            literals[len(token_ids)] = compressed
+        token_ids.append(subtokenid)
         subtokenidx += 1        
     token_of_line_count += 1
 
@@ -1595,17 +2034,20 @@ def compress_token_or_subtoken(compressed,line_token,token_of_line_count,lentoke
     if((token_of_line_count == lentoken) and (not gendic)):
         # newline
         debugw("append new line")
-        compressed.append(0)
+        token_ids.append(0)
         #quit()  
 
-    return (compressed,token_of_line_count)
+    return token_of_line_count
 
 
 def compress_tokens(tokens,gendic):
 
     #time.sleep(0.001)    
-    # Init byte array
-    compressed = bytearray()
+    # token ids of the whole sequence, and unknown token payloads keyed by position
+    token_ids = []
+    literals = {}
+    # tokens is a whole stream, its session dictionary is dropped on return
+    session = SessionDict()
     
     debugw("tokens are:")
     debugw(tokens)
@@ -1619,19 +2061,21 @@ def compress_tokens(tokens,gendic):
         # start compression run
         if(not len(token) and (not gendic)):
             debugw("paragraph")
-            compressed.append(0)
+            token_ids.append(0)
             #compressed.append(0)
             #quit()
         lentoken = len(token)
         if (not gendic):
             for line_token in token:           
-                (compressed, token_of_line_count) = compress_token_or_subtoken(compressed,line_token,token_of_line_count,lentoken,gendic)
+                token_of_line_count = compress_token_or_subtoken(token_ids,literals,session,line_token,token_of_line_count,lentoken,gendic)
         else:
-                (compressed, token_of_line_count) = compress_token_or_subtoken(compressed,token,token_of_line_count,lentoken,gendic)           
-                if(not len(compressed)):
+                token_of_line_count = compress_token_or_subtoken(token_ids,literals,session,token,token_of_line_count,lentoken,gendic)           
+                if(token_of_line_count is None):
                     debugw("unknown word in gendic sequence, aborting")
                     compressed = bytearray()
                     return compressed
+
+    compressed = encode_token_ids(token_ids,literals)
     # dump whole compressed stream
     debugw("compressed ngram is=")
     debugw(compressed.hex())
@@ -1722,12 +2166,9 @@ def compress_second_pass(compressed):
             # try to replace the ngram if it exists, and only if ngram_byte_length is > 3, otherwise there will be no compression gain.
             # save index jumps for rewind operations.
             # TO BE CONTINUED .....
-            try: 
-                
-                ngram_compressed_no_ascii = "".join([f"\\x{byte:02x}" for byte in ngram_compressed])
-                ngram_compressed_no_ascii = ngram_compressed_no_ascii.replace("\\","")
-                debugw(ngram_compressed_no_ascii)
-                code = dicts['en'][1][ngram_compressed_no_ascii]
+            # packed integer key, a hit or a miss costs a few integer operations, no string building.
+            code = dicts['en'][1].get(ngram_key(ngram_compressed))
+            if (code is not None):
                 debugw("****FOUND*****")
                 ratio = ngram_byte_length/3 # all ngrams are encoded in a 3 byte address space, hence div by 3
                 removebytes = ngram_byte_length
@@ -1736,8 +2177,7 @@ def compress_second_pass(compressed):
                 else:
                     insertpos = idx - ngram_byte_length                
                 candidates.append((code,insertpos,removebytes,ratio))
-            except:
-                #traceback.print_exc()
+            else:
                 debugw("no luck 3N/4N")
 
             # reset all ngram data
@@ -2126,12 +2566,643 @@ def decompress_ngram_bytes(compressed):
     debugw("detokenizer_ngram: " + str(detokenizer_ngram))
     return detokenizer_ngram
 
-def Decode_Huffmann_RLE_BWT(compressed):
+def final_pass_codec_path(codec_id):
+
+    if (codec_id == 0):
+        return "huffmann_final_pass.bin"
+    return "huffmann_final_pass_" + str(codec_id) + ".bin"
+
+def load_final_pass_codec(codec_id=0):
+    # loaded once per process, the codec tables are static.
+    if (codec_id not in load_final_pass_codec.codecs):
+        load_final_pass_codec.codecs[codec_id] = HuffmanCodec.load(final_pass_codec_path(codec_id))
+    return load_final_pass_codec.codecs[codec_id]
+
+load_final_pass_codec.codecs = {}
+
+def huffman_code_lengths(codec):
+    # code length in bits of each byte value in a codec, as a numpy array (see choose_inband_run)
+    import numpy as np
+
+    if (codec not in huffman_code_lengths.lengths):
+        table = codec.get_code_table()
+        huffman_code_lengths.lengths[codec] = np.array([table[byte][0] if (byte in table) else 0 for byte in range(0, 256)],
+                                                       dtype=np.int64)
+    return huffman_code_lengths.lengths[codec]
+
+# the codec caches are weakly keyed : the code of a block (see encode_block_table) goes away with it
+huffman_code_lengths.lengths = WeakKeyDictionary()
+
+# final pass code of mtf_stage streams : move-to-front ranks and zero runs are close to a power law, symbol s gets
+# the weight 2**20 / (s + 1) ** mtf_codec_exponent (the end of stream symbol of the codec has weight 1).
+# The code is built, not loaded, it only depends on the exponent.
+mtf_codec_exponent = 1.9
+
+def load_mtf_codec():
+    if (load_mtf_codec.codec is None):
+        load_mtf_codec.codec = HuffmanCodec.from_frequencies(
+            {symbol : round((1 << 20) / ((symbol + 1) ** mtf_codec_exponent)) for symbol in range(0, 256)})
+    return load_mtf_codec.codec
+
+load_mtf_codec.codec = None
+
+# Bulk encoding with the codecs (final pass, -hc) : the codes of the codec as bitarrays, packed by bitarray.encode.
+# The end of stream code is handled as HuffmanCodec.encode does, the bitstream is the same.
+def huffman_encode_codes(codec):
+    # (symbol -> code bitarray, end of stream code bitarray) of a codec, built once per codec
+    if (codec not in huffman_encode_codes.codes):
+        codes = {}
+        eof_code = bitarray(endian='big')
+        for (symbol, (bits, value)) in codec.get_code_table().items():
+            code = bitarray(format(value, '0' + str(bits) + 'b'), endian='big')
+            if (isinstance(symbol, (int, str))):
+                codes[symbol] = code
+            else:
+                eof_code = code
+        huffman_encode_codes.codes[codec] = (codes, eof_code)
+    return huffman_encode_codes.codes[codec]
+
+huffman_encode_codes.codes = WeakKeyDictionary()
+
+def huffman_encode(codec, data):
+    # codec.encode(data), as bytes
+    (codes, eof_code) = huffman_encode_codes(codec)
+    bits = bitarray(endian='big')
+    bits.encode(codes, data)
+    # a last byte that is not full is completed with the start of the end of stream code, then zeros
+    size = len(bits)
+    if (size % 8):
+        bits.extend(eof_code)
+        del bits[(size + 7) // 8 * 8:]
+    return bits.tobytes()
+
+# Table driven decoding of the final pass codecs, bit-compatible with HuffmanCodec.decode (the code tables are used as
+# they are). The symbol and code length at every bit position are looked up at once, from the next
+# huffman_table_bits bits (primary table), or for the longer codes from the next max code length bits (a subtable per
+# primary entry). The symbols are then chained as in bwt_decode : each position jumps to the next code, the chain is
+# walked huffman_decode_stride codes at a time and expanded with vectorized gathers, over huffman_decode_chunk bytes
+# of input at a time.
+huffman_table_bits = 12
+huffman_decode_stride = 8
+huffman_decode_chunk = 1 << 12
+
+def huffman_decode_tables(codec):
+    # (window bits, primary symbols, primary lengths, subtable bases, subtable symbols, subtable lengths) of a codec,
+    # built once per codec. The end of stream symbol is 256, a length of 0 in the primary table is a subtable.
+    # None if the code does not fit (symbols other than bytes, codes longer than 25 bits) : HuffmanCodec.decode then.
+    import numpy as np
+
+    if (codec not in huffman_decode_tables.tables):
+        code_table = codec.get_code_table()
+        max_bits = max(bits for (bits, value) in code_table.values())
+        if ((max_bits > 25) or any(isinstance(symbol, int) and not (0 <= symbol < 256) for symbol in code_table)):
+            huffman_decode_tables.tables[codec] = None
+            return None
+        primary_bits = huffman_table_bits
+        window_bits = max(max_bits, primary_bits)
+        sub_bits = window_bits - primary_bits
+        symbols = np.zeros(1 << primary_bits, dtype=np.int16)
+        lengths = np.zeros(1 << primary_bits, dtype=np.int32)
+        bases = np.zeros(1 << primary_bits, dtype=np.int32)
+        sub_symbols = []
+        sub_lengths = []
+        for (symbol, (bits, value)) in code_table.items():
+            if (not isinstance(symbol, int)):
+                symbol = 256
+            if (bits <= primary_bits):
+                start = value << (primary_bits - bits)
+                symbols[start:start + (1 << (primary_bits - bits))] = symbol
+                lengths[start:start + (1 << (primary_bits - bits))] = bits
+                continue
+            prefix = value >> (bits - primary_bits)
+            if (bases[prefix] == 0):
+                bases[prefix] = len(sub_symbols) * (1 << sub_bits) + 1
+                sub_symbols.append(np.zeros(1 << sub_bits, dtype=np.int16))
+                sub_lengths.append(np.zeros(1 << sub_bits, dtype=np.int32))
+            sub = (bases[prefix] - 1) >> sub_bits
+            start = (value & ((1 << (bits - primary_bits)) - 1)) << (window_bits - bits)
+            sub_symbols[sub][start:start + (1 << (window_bits - bits))] = symbol
+            sub_lengths[sub][start:start + (1 << (window_bits - bits))] = bits
+        if (len(sub_symbols)):
+            sub_symbols = np.concatenate(sub_symbols)
+            sub_lengths = np.concatenate(sub_lengths)
+        else:
+            sub_symbols = np.zeros(1, dtype=np.int16)
+            sub_lengths = np.zeros(1, dtype=np.int32)
+        huffman_decode_tables.tables[codec] = (window_bits, symbols, lengths, bases - 1, sub_symbols, sub_lengths)
+    return huffman_decode_tables.tables[codec]
+
+huffman_decode_tables.tables = WeakKeyDictionary()
+
+def huffman_decode(codec, data):
+    # codec.decode(data) of the final pass codecs, as a bytearray
+    import numpy as np
+
+    tables = huffman_decode_tables(codec)
+    if (tables is None):
+        return bytearray(codec.decode(data))
+    (window_bits, symbols, lengths, bases, sub_symbols, sub_lengths) = tables
+    primary_bits = huffman_table_bits
+    sub_mask = (1 << (window_bits - primary_bits)) - 1
+
+    raw = np.frombuffer(bytes(data), dtype=np.uint8)
+    total_bits = 8 * len(raw)
+    padded = np.zeros(len(raw) + 4, dtype=np.uint32)
+    padded[:len(raw)] = raw
+    # big endian 32 bits word at each byte
+    words = (padded[:-3] << 24) | (padded[1:-2] << 16) | (padded[2:-1] << 8) | padded[3:]
+    shifts = (32 - window_bits - np.arange(0, 8, dtype=np.uint32)).astype(np.uint32)
+    offsets = np.arange(0, 8 * huffman_decode_chunk, dtype=np.int32)
+
+    result = bytearray()
+    position = 0
+    while (position < total_bits):
+        first_byte = position >> 3
+        last_byte = min(first_byte + huffman_decode_chunk, len(raw))
+        size = 8 * (last_byte - first_byte)
+        base = 8 * first_byte
+        # code at every bit position of the chunk
+        windows = ((words[first_byte:last_byte, None] >> shifts[None, :]) & ((1 << window_bits) - 1)).reshape(-1)
+        primary = windows >> (window_bits - primary_bits)
+        chunk_symbols = symbols[primary]
+        chunk_lengths = lengths[primary]
+        long_codes = np.flatnonzero(chunk_lengths == 0)
+        if (len(long_codes)):
+            sub = bases[primary[long_codes]] + (windows[long_codes] & sub_mask).astype(np.int32)
+            chunk_symbols[long_codes] = np.where(bases[primary[long_codes]] >= 0, sub_symbols[sub], 256)
+            chunk_lengths[long_codes] = np.where(bases[primary[long_codes]] >= 0, sub_lengths[sub], 0)
+        # end of each code, from the start of the chunk
+        ends = offsets[:size] + chunk_lengths
+        # end of stream, code past the end of the input (the truncated end of stream code) or no code : the chain stops
+        stop = (chunk_symbols == 256) | (ends > total_bits - base) | (chunk_lengths == 0)
+
+        # next position in the chunk, size : the chain leaves the chunk, size + 1 : the chain stops
+        chain = np.empty(size + 2, dtype=np.int32)
+        np.minimum(ends, size, out=chain[:size])
+        chain[:size][stop] = size + 1
+        chain[size:] = (size, size + 1)
+        jump = chain
+        stride = 1
+        while (stride < huffman_decode_stride):
+            jump = jump[jump]
+            stride *= 2
+
+        starts = []
+        row = position - base
+        next_row = jump.item
+        while (row < size):
+            starts.append(row)
+            row = next_row(row)
+        rows = np.array(starts, dtype=np.int32)
+        path = np.empty((len(starts), stride), dtype=np.int32)
+        for idx in range(0, stride):
+            path[:, idx] = rows
+            rows = chain[rows]
+        path = path.reshape(-1)
+        path = path[path < size]
+        if (not len(path)):
+            break
+        emitted = path[~stop[path]]
+        result.extend(chunk_symbols[emitted].astype(np.uint8).tobytes())
+        if (stop[path[-1]]):
+            break
+        position = base + int(ends[path[-1]])
+    return result
+
+# Block tables (frame_flag_tables) : the final pass code of each block of the frame starts with a table byte.
+# block_table_static : the final pass codec (or the mtf codec), then its code.
+# block_table_adaptive : the code lengths of a canonical Huffmann code of the block bytes (pack_code_lengths), then
+# its code. Code lengths are at most adaptive_max_bits, the end of stream symbol (256) always has a code.
+# block_table_rans : the order-1 rANS code of the block (rans_stage, see rans_encode) instead of a Huffmann code.
+block_table_static = 0
+block_table_adaptive = 1
+block_table_rans = 2
+adaptive_max_bits = 15
+
+def adaptive_code_lengths(counts):
+    # code lengths (257, 0 : no code, 256 : end of stream) of a Huffmann code of byte counts. Past adaptive_max_bits,
+    # the counts are halved until the code fits (as bzip2 does).
+    import numpy as np
+
+    counts = np.append(np.asarray(counts, dtype=np.int64), 1)
+    while (True):
+        frequencies = {int(symbol) : int(counts[symbol]) for symbol in np.flatnonzero(counts)}
+        code_table = HuffmanCodec.from_frequencies(frequencies, eof=256).get_code_table()
+        lengths = np.zeros(257, dtype=np.int64)
+        for (symbol, (bits, value)) in code_table.items():
+            lengths[symbol] = bits
+        if (lengths.max() <= adaptive_max_bits):
+            return lengths
+        counts = np.where(counts > 0, 1 + counts // 2, 0)
+
+def canonical_codec(lengths):
+    # HuffmanCodec of the canonical code of code lengths (see adaptive_code_lengths) : codes are given in order of
+    # length, then of symbol. The end of stream symbol is the None key, as huffman_encode and huffman_decode expect
+    # (any symbol that is not a byte).
+    code_table = {}
+    code = 0
+    previous_bits = 0
+    for (bits, symbol) in sorted((int(bits), symbol) for (symbol, bits) in enumerate(lengths) if bits):
+        code <<= bits - previous_bits
+        previous_bits = bits
+        code_table[symbol if (symbol < 256) else None] = (bits, code)
+        code += 1
+    return HuffmanCodec(code_table, concat=bytes, check=False, eof=None)
+
+def pack_byte_set(bits, members):
+    # a set of byte values (members : 256 truth values) as bzip2 writes it, appended to bits : a 16 bits map of the 16
+    # byte ranges holding a member, then 16 bits for each of them.
+    ranges = [byte_range for byte_range in range(0, 16) if any(members[byte_range * 16:byte_range * 16 + 16])]
+    bits.extend(''.join('1' if (byte_range in ranges) else '0' for byte_range in range(0, 16)))
+    for byte_range in ranges:
+        bits.extend(''.join('1' if (members[byte]) else '0' for byte in range(byte_range * 16, byte_range * 16 + 16)))
+
+def unpack_byte_set(bits, position):
+    # (byte values, position after them) of a pack_byte_set set at bits[position:]
+    members = []
+    ranges = bits[position:position + 16]
+    position += 16
+    for byte_range in range(0, 16):
+        if (ranges[byte_range]):
+            members.extend(byte_range * 16 + byte for byte in range(0, 16) if bits[position + byte])
+            position += 16
+    return (members, position)
+
+def pack_code_lengths(lengths):
+    # code lengths as bzip2 writes them : the set of bytes with a code (pack_byte_set), then the first length (4 bits)
+    # and for each byte with a code, then the end of stream symbol, the steps to its length from the previous one
+    # ('10' : +1, '11' : -1), closed by '0'.
+    bits = bitarray(endian='big')
+    pack_byte_set(bits, lengths[:256])
+    symbols = [byte for byte in range(0, 256) if lengths[byte]] + [256]
+    current = int(lengths[symbols[0]])
+    bits.extend(format(current, '04b'))
+    for symbol in symbols:
+        step = int(lengths[symbol]) - current
+        bits.extend(('10' if (step > 0) else '11') * abs(step) + '0')
+        current = int(lengths[symbol])
+    return bits.tobytes()
+
+def unpack_code_lengths(data, offset):
+    # (code lengths, offset after them) of pack_code_lengths output at data[offset:]
+    import numpy as np
+
+    bits = bitarray(endian='big')
+    bits.frombytes(bytes(data[offset:offset + 2 + 32 + 2 * 257 * adaptive_max_bits // 8 + 1]))
+    (symbols, position) = unpack_byte_set(bits, 0)
+    symbols.append(256)
+    lengths = np.zeros(257, dtype=np.int64)
+    current = int(bits[position:position + 4].to01(), 2)
+    position += 4
+    for symbol in symbols:
+        while (bits[position]):
+            current += -1 if (bits[position + 1]) else 1
+            position += 2
+        position += 1
+        if (not (1 <= current <= adaptive_max_bits)):
+            raise ValueError("corrupt code lengths")
+        lengths[symbol] = current
+    return (lengths, offset + (position + 7) // 8)
+
+def encode_block_table(codec, block, overhead=0, rans=False):
+    # table byte and final pass code of a block, the smallest of : codec, the canonical code of the block's own byte
+    # counts after its code lengths (adaptive_tables), the order-1 rANS code of the block (rans). Another code than
+    # codec has to be smaller by more than overhead bytes. Sizes come from the byte histogram of the block, and for
+    # rANS from its model (see rans_code_size).
+    import numpy as np
+
+    counts = np.bincount(np.frombuffer(bytes(block), dtype=np.uint8), minlength=256)
+    static_size = (int(np.dot(counts, huffman_code_lengths(codec))) + 7) // 8
+    best = (static_size - overhead, block_table_static)
+    if (adaptive_tables):
+        lengths = adaptive_code_lengths(counts)
+        table = pack_code_lengths(lengths)
+        best = min(best, (len(table) + (int(np.dot(counts, lengths[:256])) + 7) // 8, block_table_adaptive))
+    if (rans):
+        lanes = rans_lane_symbols(block)
+        model = rans_model(*lanes)
+        best = min(best, (rans_code_size(block, lanes, model), block_table_rans))
+    debugw("final pass size, static code: " + str(static_size) + " chosen: " + str(best))
+
+    if (best[1] == block_table_adaptive):
+        return bytes((block_table_adaptive,)) + table + huffman_encode(canonical_codec(lengths), block)
+    if (best[1] == block_table_rans):
+        return bytes((block_table_rans,)) + rans_encode(block, lanes, model)
+    return bytes((block_table_static,)) + huffman_encode(codec, block)
+
+def decode_block_table(codec, compressed):
+    # (codec, final pass code) of a block that starts with a table byte (see encode_block_table)
+    if (not len(compressed)):
+        raise ValueError("missing block table")
+    if (compressed[0] == block_table_static):
+        return (codec, compressed[1:])
+    if (compressed[0] == block_table_adaptive):
+        try:
+            (lengths, offset) = unpack_code_lengths(compressed, 1)
+        except IndexError as error:
+            raise ValueError("truncated code lengths") from error
+        return (canonical_codec(lengths), compressed[offset:])
+    raise ValueError("unknown block table: " + str(compressed[0]))
+
+# Order-1 rANS final stage (rans_stage, block_table_rans) : instead of the final huffmann pass, the bytes of a block are
+# coded by rANS with frequencies that depend on the previous byte (order-1 contexts).
+# The block is cut in lanes of at most rans_lane_size bytes, coded by as many interleaved rANS states : every numpy step
+# codes one byte of each lane, the context of a byte being the previous byte of its lane (0 for the first one).
+# States are 32 bits, renormalized 16 bits at a time, the frequencies of a table sum to 1 << rans_scale_bits.
+# Layout : byte count (pack_varint), lane count (pack_varint), model (rans_model), final state of each lane
+# (4 bytes, little endian), then the 16 bits words (little endian) in decoding order.
+# Model : the set of contexts with their own table (pack_byte_set), the shared table of the other contexts, then the
+# table of each context of the set, in order. A context gets its own table when the bits it saves pay for the table.
+# Table : symbol count (9 bits), then if not 0 its precision b - 1 (4 bits), the symbols ('0' then 8 bits for the
+# first one and for each step to the next one minus 1, or '1' then pack_byte_set), the frequencies minus 1 (b bits)
+# but the last one. They sum to 1 << b, b up to rans_scale_bits, and are scaled to 1 << rans_scale_bits to code.
+rans_scale_bits = 12
+rans_lane_size = 1024
+rans_max_lanes = 4096
+rans_state_low = 1 << 16
+
+def rans_lanes(size, lanes):
+    # (byte index of each step of each lane as a steps x lanes array, lanes coding at the last step). The first lanes
+    # are one byte longer when size is not a multiple of lanes, past its end a lane repeats its last index.
+    import numpy as np
+
+    steps = -(-size // lanes)
+    last_active = size - lanes * (steps - 1)
+    lengths = np.full(lanes, steps - 1, dtype=np.int64)
+    lengths[:last_active] += 1
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    index = starts[None, :] + np.arange(0, steps, dtype=np.int64)[:, None]
+    return (np.minimum(index, (starts + lengths - 1)[None, :]), last_active)
+
+def rans_quantize(counts, precision):
+    # frequencies of byte counts summing to 1 << precision (all 0 for no count), a count but 0 gets at least 1
+    import numpy as np
+
+    total = int(counts.sum())
+    if (not total):
+        return np.zeros(len(counts), dtype=np.int64)
+    freqs = np.where(counts > 0, np.maximum(1, (counts * (1 << precision) + total // 2) // total), 0)
+    # the rounding error goes to the largest frequencies
+    excess = int(freqs.sum()) - (1 << precision)
+    while (excess):
+        largest = int(np.argmax(freqs))
+        change = min(excess, int(freqs[largest]) - 1)
+        freqs[largest] -= change
+        excess -= change
+    return freqs
+
+def rans_table_bits(freqs, precision):
+    # (size in bits of a table, its symbols are written as a byte set), see the layout above
+    import numpy as np
+
+    symbols = np.flatnonzero(freqs)
+    if (not len(symbols)):
+        return (9, False)
+    set_bits = 16 + 16 * len(np.unique(symbols >> 4))
+    return (9 + 4 + 1 + min(8 * len(symbols), set_bits) + (len(symbols) - 1) * precision, set_bits < 8 * len(symbols))
+
+def pack_rans_table(bits, freqs, precision):
+
+    symbols = [symbol for symbol in range(0, 256) if freqs[symbol]]
+    bits.extend(format(len(symbols), '09b'))
+    if (not len(symbols)):
+        return
+    bits.extend(format(precision - 1, '04b'))
+    if (rans_table_bits(freqs, precision)[1]):
+        bits.extend('1')
+        pack_byte_set(bits, freqs)
+    else:
+        bits.extend('0')
+        previous = -1
+        for symbol in symbols:
+            bits.extend(format(symbol - previous - 1, '08b'))
+            previous = symbol
+    for symbol in symbols[:-1]:
+        bits.extend(format(int(freqs[symbol]) - 1, '0' + str(precision) + 'b'))
+
+def unpack_rans_table(bits, position):
+    # (frequencies scaled to rans_scale_bits, position after the table) of a pack_rans_table table at bits[position:]
+    import numpy as np
+
+    freqs = np.zeros(256, dtype=np.uint64)
+    count = int(bits[position:position + 9].to01(), 2)
+    position += 9
+    if (not count):
+        return (freqs, position)
+    precision = int(bits[position:position + 4].to01(), 2) + 1
+    position += 4
+    if (bits[position]):
+        (symbols, position) = unpack_byte_set(bits, position + 1)
+    else:
+        position += 1
+        symbols = []
+        previous = -1
+        for idx in range(0, count):
+            previous += int(bits[position:position + 8].to01(), 2) + 1
+            symbols.append(previous)
+            position += 8
+    if ((len(symbols) != count) or (symbols[-1] > 255) or (precision > rans_scale_bits)):
+        raise ValueError("corrupt rans table")
+    for symbol in symbols[:-1]:
+        freqs[symbol] = int(bits[position:position + precision].to01(), 2) + 1
+        position += precision
+    last = (1 << precision) - int(freqs.sum())
+    if (last < 1):
+        raise ValueError("corrupt rans table")
+    freqs[symbols[-1]] = last
+    return (freqs << np.uint64(rans_scale_bits - precision), position)
+
+def rans_lane_symbols(block):
+    # (bytes, contexts, coded) of each step of each lane of a block as steps x lanes arrays, see rans_lanes. The lanes
+    # past the last active one at the last step repeat their last byte, it is not coded.
+    import numpy as np
+
+    data = np.frombuffer(bytes(block), dtype=np.uint8).astype(np.int64)
+    lanes = max(1, min(rans_max_lanes, -(-len(data) // rans_lane_size)))
+    if (not len(data)):
+        empty = np.zeros((0, lanes), dtype=np.int64)
+        return (empty, empty, empty.astype(bool))
+    (index, last_active) = rans_lanes(len(data), lanes)
+    symbols = data[index]
+    contexts = np.zeros_like(symbols)
+    contexts[1:] = symbols[:-1]
+    coded = np.ones(symbols.shape, dtype=bool)
+    coded[-1, last_active:] = False
+    return (symbols, contexts, coded)
+
+def rans_model(symbols, contexts, coded):
+    # (table of each context (0 : shared table), frequencies of each table scaled to rans_scale_bits, packed model) of
+    # the lanes of a block (see rans_lane_symbols), see the layout above.
+    import numpy as np
+
+    counts = np.bincount(contexts[coded] * 256 + symbols[coded], minlength=65536).reshape(256, 256)
+    totals = counts.sum(axis=1)
+    # a context gets its own table when its bytes cost more bits with the shared table of all contexts than with its
+    # own table plus the table itself
+    shared = rans_quantize(counts.sum(axis=0), rans_scale_bits)
+    shared_bits = rans_scale_bits - np.log2(np.maximum(shared, 1))
+    own = np.zeros(256, dtype=bool)
+    tables = {}
+    for context in np.flatnonzero(totals):
+        precision = min(rans_scale_bits, int(totals[context]).bit_length())
+        freqs = rans_quantize(counts[context], precision)
+        present = np.flatnonzero(freqs)
+        own_bits = np.dot(counts[context][present], precision - np.log2(freqs[present]))
+        if (np.dot(counts[context], shared_bits) - own_bits > rans_table_bits(freqs, precision)[0]):
+            own[context] = True
+            tables[context] = (freqs, precision)
+
+    shared = rans_quantize(counts[~own].sum(axis=0), rans_scale_bits)
+    bits = bitarray(endian='big')
+    pack_byte_set(bits, own)
+    pack_rans_table(bits, shared, rans_scale_bits)
+    table_index = np.zeros(256, dtype=np.int64)
+    scaled = np.zeros((1 + len(tables), 256), dtype=np.uint64)
+    scaled[0] = shared
+    for (idx, context) in enumerate(sorted(tables)):
+        (freqs, precision) = tables[context]
+        pack_rans_table(bits, freqs, precision)
+        table_index[context] = idx + 1
+        scaled[idx + 1] = freqs << (rans_scale_bits - precision)
+    debugw("rans contexts with their own table: " + str(len(tables)) + " model bytes: " + str((len(bits) + 7) // 8))
+    return (table_index, scaled, bits.tobytes())
+
+def unpack_rans_model(data, offset):
+    # (table of each context, scaled frequencies of each table, offset after the model) of a rans_model model
+    import numpy as np
+
+    bits = bitarray(endian='big')
+    bits.frombytes(bytes(data[offset:]))
+    (contexts, position) = unpack_byte_set(bits, 0)
+    table_index = np.zeros(256, dtype=np.int64)
+    table_index[contexts] = np.arange(1, len(contexts) + 1)
+    scaled = np.zeros((1 + len(contexts), 256), dtype=np.uint64)
+    for idx in range(0, 1 + len(contexts)):
+        (scaled[idx], position) = unpack_rans_table(bits, position)
+    return (table_index, scaled, offset + (position + 7) // 8)
+
+def rans_code_size(block, lanes, model):
+    # size in bytes of the rans_encode code of a block from its model, the words being estimated from the frequencies
+    import numpy as np
+
+    (symbols, contexts, coded) = lanes
+    (table_index, scaled, packed) = model
+    freqs = scaled[table_index[contexts[coded]], symbols[coded]].astype(np.float64)
+    words = int(np.ceil(np.sum(rans_scale_bits - np.log2(freqs)) / 16))
+    header_size = len(pack_varint(len(block))) + len(pack_varint(symbols.shape[1])) + len(packed)
+    return header_size + 4 * symbols.shape[1] + 2 * words
+
+def rans_encode(block, lanes=None, model=None):
+    # order-1 rANS code of a block, see the layout above. lanes and model : of rans_lane_symbols and rans_model if
+    # already known.
+    import numpy as np
+
+    if (lanes is None):
+        lanes = rans_lane_symbols(block)
+    (symbols, contexts, coded) = lanes
+    size = int(np.count_nonzero(coded))
+    lane_count = symbols.shape[1]
+    if (not size):
+        return pack_varint(0) + pack_varint(lane_count)
+    if (model is None):
+        model = rans_model(*lanes)
+    (table_index, scaled, packed) = model
+    last_active = int(np.count_nonzero(coded[-1]))
+    cumulative = np.cumsum(scaled, axis=1) - scaled
+    tables = table_index[contexts]
+    freqs = scaled[tables, symbols]
+    starts = cumulative[tables, symbols]
+
+    # bytes are coded from the last step to the first, the decoder reads the words back from the first step
+    states = np.full(lane_count, rans_state_low, dtype=np.uint64)
+    words = []
+    for step in range(len(symbols) - 1, -1, -1):
+        active = last_active if (step == len(symbols) - 1) else lane_count
+        state = states[:active]
+        freq = freqs[step, :active]
+        flush = state >= (freq << np.uint64(32 - rans_scale_bits))
+        if (flush.any()):
+            words.append((state[flush] & np.uint64(0xffff)).astype('<u2'))
+            state[flush] >>= np.uint64(16)
+        states[:active] = ((state // freq) << np.uint64(rans_scale_bits)) + (state % freq) + starts[step, :active]
+    words.reverse()
+    encoded = pack_varint(size) + pack_varint(lane_count) + packed + states.astype('<u4').tobytes()
+    if (len(words)):
+        encoded += np.concatenate(words).tobytes()
+    return encoded
+
+def rans_decode(data):
+    # block of a rans_encode code
+    import numpy as np
+
+    (size, offset) = unpack_varint(data, 0)
+    (lanes, offset) = unpack_varint(data, offset)
+    if (not (1 <= lanes <= rans_max_lanes)):
+        raise ValueError("corrupt rans lane count: " + str(lanes))
+    if (not size):
+        return bytearray()
+    try:
+        (table_index, scaled, offset) = unpack_rans_model(data, offset)
+    except IndexError as error:
+        raise ValueError("truncated rans model") from error
+    if (len(data) < offset + 4 * lanes):
+        raise ValueError("truncated rans states")
+    states = np.frombuffer(bytes(data[offset:offset + 4 * lanes]), dtype='<u4').astype(np.uint64)
+    offset += 4 * lanes
+    words = np.frombuffer(bytes(data[offset:offset + (len(data) - offset) // 2 * 2]), dtype='<u2').astype(np.uint64)
+    cumulative = np.cumsum(scaled, axis=1) - scaled
+    # symbol of each slot of each table
+    slots = np.zeros((len(scaled), 1 << rans_scale_bits), dtype=np.int64)
+    for (idx, freqs) in enumerate(scaled):
+        if (freqs.sum()):
+            slots[idx] = np.repeat(np.arange(0, 256), freqs.astype(np.int64))
+
+    (index, last_active) = rans_lanes(size, lanes)
+    output = np.zeros(index.shape, dtype=np.int64)
+    previous = np.zeros(lanes, dtype=np.int64)
+    slot_mask = np.uint64((1 << rans_scale_bits) - 1)
+    position = 0
+    for step in range(0, len(index)):
+        active = last_active if (step == len(index) - 1) else lanes
+        state = states[:active]
+        slot = state & slot_mask
+        tables = table_index[previous[:active]]
+        symbols = slots[tables, slot]
+        state = scaled[tables, symbols] * (state >> np.uint64(rans_scale_bits)) + slot - cumulative[tables, symbols]
+        refill = state < rans_state_low
+        count = int(np.count_nonzero(refill))
+        if (count):
+            if (position + count > len(words)):
+                raise ValueError("truncated rans words")
+            state[refill] = (state[refill] << np.uint64(16)) | words[position:position + count]
+            position += count
+        states[:active] = state
+        previous[:active] = symbols
+        output[step, :active] = symbols
+
+    block = np.zeros(size, dtype=np.uint8)
+    coded = np.ones(index.shape, dtype=bool)
+    coded[-1, last_active:] = False
+    block[index[coded]] = output[coded]
+    return bytearray(block.tobytes())
+
+def Decode_Huffmann_RLE_BWT(compressed, mtf=False, codec_id=0, tables=False):
 
     # Huffmann decode first
-    final_pass_codec = HuffmanCodec.load("huffmann_final_pass.bin")
-    #final_pass_codec.print_code_table()
-    compressed = final_pass_codec.decode(compressed)
+    # mtf : the stream was encoded with move-to-front and zero runs instead of RLE (frame_flag_mtf).
+    # codec_id : final pass codec of the stream (see final_pass_codec_id).
+    # tables : the stream starts with a table byte (frame_flag_tables), see decode_block_table.
+    if (tables and len(compressed) and (compressed[0] == block_table_rans)):
+        compressed = rans_decode(compressed[1:])
+    else:
+        if (mtf):
+            final_pass_codec = load_mtf_codec()
+        else:
+            final_pass_codec = load_final_pass_codec(codec_id)
+        if (tables):
+            (final_pass_codec, compressed) = decode_block_table(final_pass_codec, compressed)
+        #final_pass_codec.print_code_table()
+        compressed = huffman_decode(final_pass_codec, compressed)
 
     # checkpoint : printing after attempting BWT,RLE,Huffmann for debugging purposes
     checkpoint = "".join([f"\\x{byte:02x}" for byte in compressed])
@@ -2139,6 +3210,10 @@ def Decode_Huffmann_RLE_BWT(compressed):
     debugw(checkpoint)
 
 
+    if (len(compressed) and (compressed[0] == block_header_primary)):
+        debugw("compressed stream uses the sentinel-free BWT")
+        return decode_primary_index_block(compressed, mtf)
+
     #Interpret Header
     debugw("compressed[0:4]")
     debugw(compressed[0:4])
@@ -2147,8 +3222,8 @@ def Decode_Huffmann_RLE_BWT(compressed):
     next_header_idx = 0
     if (compressed[0] == 255):
         debugw("compressed stream uses BWT and RLE - two absent chars")
-        rle_sep = bytearray((compressed[1]).to_bytes(1,"little")) # xFF forbidden as RLE sep.
-        bwt_shiftpos = bytearray((compressed[2]).to_bytes(1,"little"))
+        rle_sep = compressed[1] # xFF forbidden as RLE sep.
+        bwt_shiftpos = compressed[2]
         unused_seqs.append(compressed[1])
         unused_seqs.append(compressed[2])
         next_header_idx += 3
@@ -2177,59 +3252,11 @@ def Decode_Huffmann_RLE_BWT(compressed):
     debugw("bwt_shiftpos")
     debugw(bwt_shiftpos)
     
-    compressed_new = bytearray()
-    jump = 0
-    #now restore repeating chars
-    for idx in range(next_header_idx,len(compressed)):  # there is always a character left of separator, the repeated byte, hence next_header_idx+1  
-        
-        idx += jump
-        
-        if(idx>=len(compressed)):
-            break
-        
-        debugw("compressed_slice")
-        debugw(int.from_bytes(compressed[idx:idx+1],'little'))
-
-        # special cases backward checks
-        rle_sep_found = (int.from_bytes(compressed[idx:idx+1],'little') == rle_sep)
-        #char_before_is_rle_sep = (int.from_bytes(compressed[idx-1:idx+1-1],'little') == int.from_bytes(rle_sep,'little'))
-        #char_idx_1_is_255 = (int.from_bytes(compressed[idx-1:idx+1-1],'little') == 255)
-        #char_idx_2_is_255 = (int.from_bytes(compressed[idx-2:idx+1-2],'little') == 255)
-
-
-        # char before is rle sep is the case where the number of repetitions is equal to rle_sep.
-        # we don't want to treat the repetitions as an rle char.
- 
-        if (rle_sep_found):
-            print("separator found")
-            rep_char = compressed[idx-1]
-            print("rep_char")
-            print(rep_char)
-            
-            if (int.from_bytes(compressed[idx+1:idx+1+2],'little') == 65535):
-                #repetitions encoded on three bytes
-                debugw("repetitions encoded on three bytes")
-                rep_num = int.from_bytes(compressed[idx+1+2:idx+1+5], 'little')
-                jump += 5
-            elif (int.from_bytes(compressed[idx+1:idx+1+1],'little') == 255):
-                #repetitions encoded on two bytes
-                debugw("repetitions encoded on two bytes")
-                rep_num = int.from_bytes(compressed[idx+1+1:idx+1+3], 'little')
-                jump += 3
-            else:
-                #repetitions encoded on one byte
-                debugw("repetitions encoded on one byte")
-                rep_num = int.from_bytes(compressed[idx+1:idx+1+1], 'little')
-                jump += 1
-
-            print("rep_num")
-            print(rep_num)
-
-            replace_with_bytes = bytearray(rep_char.to_bytes(1,'little')) * (rep_num - 1) # rep_num - 1 ...
-            #because the previous match idx was on the repeated char (in the following else statement)
-            compressed_new.extend(replace_with_bytes)
-        else:
-            compressed_new.append(compressed[idx])
+    if (mtf):
+        compressed_new = mtf_decode(compressed[next_header_idx:])
+    else:
+        #now restore repeating chars
+        compressed_new = expand_repeating_chars(compressed[next_header_idx:], rle_sep)
 
     # checkpoint : printing after attempting BWT,RLE,Huffmann for debugging purposes
     checkpoint = "".join([f"\\x{byte:02x}" for byte in compressed_new])
@@ -2237,7 +3264,7 @@ def Decode_Huffmann_RLE_BWT(compressed):
     debugw(checkpoint)
 
     #now do inverse bwt
-    print(len(compressed_new))
+    debugw(len(compressed_new))
     #compressed_new2 = bwt_decode(compressed[3:],bytearray(b'\xFF'))
     compressed_new2 = bwt_decode(compressed_new,bytearray(b'\xFF'))
 
@@ -2259,10 +3286,538 @@ def Decode_Huffmann_RLE_BWT(compressed):
 
 
 
-def compress_file(infile,outfile):
-    
+def decode_primary_index_block(compressed, mtf):
+    # in-band RLE (or move-to-front) and BWT stages of a sentinel-free block (see compress_block), after huffmann.
+    if (len(compressed) < 3):
+        raise ValueError("truncated block header")
+    run = compressed[1]
+    (primary, offset) = unpack_varint(compressed, 2)
+    debugw("run: " + str(run) + " primary index: " + str(primary))
+    if (mtf):
+        bw = mtf_decode(compressed[offset:])
+    else:
+        bw = expand_runs_inband(compressed[offset:], run)
+    return bwt_decode(bw, None, primary)
+
+def pack_varint(value):
+    # 7 bits per byte, least significant first, msb set on all bytes but the last
+    packed = bytearray()
+    while (value >= 128):
+        packed.append((value & 0x7f) | 0x80)
+        value >>= 7
+    packed.append(value)
+    return packed
+
+def unpack_varint(data, offset):
+    # (value, offset after it) of the pack_varint value at offset
+    value = 0
+    shift = 0
+    while (True):
+        if (offset >= len(data)):
+            raise ValueError("truncated varint")
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if (not (byte & 0x80)):
+            return (value, offset)
+        shift += 7
+
+def compress_lines(Linesin):
+
+    # full compression pipeline of a list of text lines, returns the compressed stream.
     tokens = []
+    for line in Linesin:
+        tokens.append(tokenize_text_line(line))
+
+    if (bwt_block_size or mtf_stage or rans_stage or final_pass_codec_id):
+        # block mode, mtf_stage, rans_stage and trained codec streams only exist in the framed container : a container
+        # of a single frame
+        stream = io.BytesIO()
+        stream.write(container_header())
+        write_frame(stream, *compress_frame(tokens))
+        return stream.getvalue()
+    if ((not adaptive_tables) or (not primary_index_bwt) or no_final_huf):
+        return compress_token_lines(tokens)
+
+    # a -c stream has no flags for a table byte : the code of its block is written in a container of a single frame,
+    # when it saves the container header and frame header as well.
+    payload = compress_block(compress_token_passes(tokens), False, True, len(container_header()) + frame_header.size)
+    if (payload[0] == block_table_static):
+        return payload[1:]
+    stream = io.BytesIO()
+    stream.write(container_header())
+    write_frame(stream, payload, frame_flag_tables)
+    return stream.getvalue()
+
+def tokenize_text_line(line):
+
+    line = line.lower()
+
+    # First pass tokenizer (does not split adjunct special chars)
+    return tokenize_line(line)
+
+def compress_token_lines(tokens):
+
+    # compression pipeline of the token lists of the lines of a stream (see tokenize_text_line)
+    return compress_block(compress_token_passes(tokens))
+
+def compress_token_passes(tokens):
+
+    # first (dictionary) and second (ngrams) passes over the token lists of the lines of a stream,
+    # returns the token stream.
+    debugw(tokens)
+
+    compressed = compress_tokens(tokens,False)
+    debugw("unknown token cache hits: " + str(resolve_unknown_token.hits) + " misses: " + str(resolve_unknown_token.misses)
+           + " size: " + str(len(resolve_unknown_token.cache)))
+
+    if(secondpass):
+        candidates = compress_second_pass(compressed)
+        debugw("candidates:")
+        debugw(candidates)
+        processed_candidates = process_candidates_v2(candidates)
+        debugw("processed candidates:")
+        debugw(processed_candidates)
+        #compressed = replace_candidates_in_processed(processed_candidates,compressed)
+        compressed = replace_candidates_in_processed_v2(processed_candidates,compressed)
+        debugw("end process candidates.")
+
+    return compressed
+
+def compress_block(compressed, mtf=False, tables=False, table_overhead=0, rans=False):
+
+    # BWT, in-band RLE, header and final huffmann pass of a token stream, or of a block of it (see compress_frame).
+    # mtf : move-to-front and zero runs instead of RLE, see mtf_encode.
+    # tables : the final pass code starts with a table byte (frame_flag_tables), the code of the block is used when it
+    # saves more than table_overhead bytes, see encode_block_table.
+    # rans : with tables, the order-1 rANS code of the block is used when it is the smallest, see rans_encode.
+    # Header : block_header_primary, the in-band RLE run (0 with mtf), the BWT primary index (pack_varint).
+    if (not primary_index_bwt):
+        return compress_block_sentinel(compressed, mtf)
+
+    if (mtf):
+        codec_final_pass = load_mtf_codec()
+    else:
+        codec_final_pass = load_final_pass_codec(final_pass_codec_id)
+    block = compress_block_stages(compressed, mtf, codec_final_pass)
+
+    if (no_final_huf):
+        return block
+    if (tables):
+        return encode_block_table(codec_final_pass, block, table_overhead, rans)
+    return huffman_encode(codec_final_pass, block)
+
+def compress_block_stages(compressed, mtf, codec):
+
+    # BWT, in-band RLE (or move-to-front) and header of a sentinel-free block, before the final pass with codec.
+    (bw, primary) = bwt_encode_primary(compressed)
+    if (mtf):
+        (run, encoded) = (0, mtf_encode(bw))
+    else:
+        (run, encoded) = choose_inband_run(bw, codec)
+    block = bytearray((block_header_primary, run)) + pack_varint(primary) + encoded
+    debugw("len after bwt and in-band rle: " + str(len(block)))
+    return block
+
+def compress_block_sentinel(compressed, mtf=False):
+
+    # version 1 block format (primary_index_bwt off) : shiftdown, BWT, RLE, header and final huffmann pass.
+    # mtf : move-to-front and zero runs instead of RLE, see mtf_encode.
+    # checkpoint : printing before attempting BWT,RLE,Huffmann for debugging purposes
+    checkpoint = "".join([f"\\x{byte:02x}" for byte in compressed])
+    debugw("checkpoint_compress after pass 2")
+    debugw(checkpoint)
+    len_before_shiftdown = len(compressed)
+    debugw("len before shiftdown: " + str(len_before_shiftdown))
+    
+    frequency = Counter(compressed).most_common()
+    frequency_dic = {}
+
+    for (ascii_code, count) in frequency:
+        frequency_dic[ascii_code] = count
+
+    #for key,value in sorted(frequency_dic2.items()):
+    #    debugw(str(key) + " " + str(value))
+    #key_idx = 0
+    
+    
+    
+    #for key,value in sorted(frequency_dic2.items()):
+    #    if key != key_idx:
+    #        debugw("absent char!: "+ str(key_idx) + ", use as EOF for bwt")
+    #        abs_chars.append(key_idx)
+    #        #break
+    #    key_idx += 1
+
+
+
+    # for now we simplify the use case where there are at least two absent chars in the compressed
+    # bin stream, which happens quite a lot for short to medium original text inputs.
+
+    '''
+    abs_chars = []
+    
+
+    for charval in range(0,256):
+        if charval not in frequency_dic.keys():
+            abs_chars.append(charval)
+
+    debugw("asbent chars:")
+    debugw(abs_chars)
+
+    abs_seq = []
+    if(len(abs_chars) < 2):
+        debugw("no two single byte absent chars were found in compressed stream")
+        abs_seq = find_absent_sequences(compressed,2)
+    else:
+        debugw("at least two single byte absent chars were found in compressed stream")
+        abs_seq.append(bytearray((abs_chars[0]).to_bytes(1,'little')))
+        abs_seq.append(bytearray((abs_chars[1]).to_bytes(1,'little')))
+    debugw("asbent seq:")
+    debugw(abs_seq)
+    '''
+
+
+
+    (absent_chars,compressed) = reuse_unused_chars_shiftdown(compressed)
+    # absent_chars[0] # is the RLE char. it is free
+    # absent_chars[1] # is the previously free char used to shift higher bytes into.
+
+
+    # checkpoint : printing before attempting BWT,RLE,Huffmann for debugging purposes
+    checkpoint = "".join([f"\\x{byte:02x}" for byte in compressed])
+    debugw("checkpoint_compress after shiftdown")
+    debugw(checkpoint)
+    len_after_shiftdown = len(compressed)
+    debugw("len after shiftdown: " + str(len_after_shiftdown))
+    debugw("len gain+/loss-: " + str(len_after_shiftdown - len_after_shiftdown))
+    
+
+    # force not to use RLE and BWT
+    #absent_chars =  [-1]
+
+    #orig_idx = 0
+
+    # absent_chars[0] and absent_chars[1] are both bytes. (general case with two available absent chars)
+    
+    # or absent_chars[0] is bytearray \x00\x00 and absent_chars[1] is  byte (only one originally available absent char)
+    # the additional absent char (255) has been constructed through an escape sequence \x00\x00 
+    # and by shifting each char in the whole ascii table down one position.
+
+
+    # or absent_chars[0] is bytearray \x00\x00 and absent_chars[1] is \x01\x01
+    # the two absent chars (255) and (254) have been constructed through two escape sequences \x00\x00 and \x01\x01 
+    # and by shifting each char in the whole ascii table down two positions. 
+
+
+    if (isinstance(absent_chars[0],int) and (isinstance(absent_chars[1],int))):
+        # first case
+        compressed3 = bwt_encode(compressed,bytearray(b'\xFF')) # 255 is always the bwt eof.
+        compressed3 = bytearray(compressed3)
+
+
+        # checkpoint : printing before attempting BWT,RLE,Huffmann for debugging purposes
+        checkpoint = "".join([f"\\x{byte:02x}" for byte in compressed3])
+        debugw("checkpoint_compress_after_bwt_two_absent")
+        debugw(checkpoint)
+
+
+        debugw("wheeler:")
+        debugw(len(compressed3))
+
+        #compressed3 = replace_repeating_chars(compressed3,4,abs_chars[1])
+        # RLE format repeated char + separator + number of repeats
+        # repeated_char cannot be equal to separator, which is a non issue since it is an absent char.
+        # however there is the case where the number of repeats is equal to the separator.
+        # in that case, two contiguous identical bytes to the separators will appear.
+        # the second separator should not be treated as such in the scan.
+        
+        # debug disable RLE
+        #compressed3 = replace_repeating_chars(compressed3,4,absent_chars[1])
+        compressed3 = bwt_second_stage(compressed3,absent_chars[0],mtf)
+        
+
+        # checkpoint : printing before attempting BWT,RLE,Huffmann for debugging purposes
+        checkpoint = "".join([f"\\x{byte:02x}" for byte in compressed3])
+        debugw("checkpoint_compress_after_rle_two_absent")
+        debugw(checkpoint)
+
+    elif (isinstance(absent_chars[0],bytearray) and (isinstance(absent_chars[1],int))):
+        # a single absent char is present originally.
+        # second case
+        compressed3 = bwt_encode(compressed,bytearray(b'\xFF')) # 255 is always the bwt eof.
+        compressed3 = bytearray(compressed3)
+
+                    # checkpoint : printing before attempting BWT,RLE,Huffmann for debugging purposes
+        checkpoint = "".join([f"\\x{byte:02x}" for byte in compressed3])
+        debugw("checkpoint_compress_after_bwt_single_absent")
+        debugw(checkpoint)
+
+
+        debugw("wheeler:")
+        debugw(len(compressed3))
+
+        #compressed3 = replace_repeating_chars(compressed3,4,abs_chars[1])
+        # RLE format repeated char + separator + number of repeats
+        # repeated_char cannot be equal to separator, which is a non issue since it is an absent char.
+        # however there is the case where the number of repeats is equal to the separator.
+        # in that case, two contiguous identical bytes to the separators will appear.
+        # the second separator should not be treated as such in the scan.
+        
+        # format : abs_char[0] = \xFE\xFE. escape sequence for RLE.
+        # format : abs_char[1] = tmpchar (original absent char). the char in which bwt eof (255) has been swapped into. 
+    
+        # debug disable RLE
+        #compressed3 = replace_repeating_chars(compressed3,4,absent_chars[1])
+        compressed3 = bwt_second_stage(compressed3,254,mtf) # in that particular case
+        # xFE is always rle char
+        
+
+        # checkpoint : printing before attempting BWT,RLE,Huffmann for debugging purposes
+        checkpoint = "".join([f"\\x{byte:02x}" for byte in compressed3])
+        debugw("checkpoint_compress_after_rle_single_absent")
+        debugw(checkpoint)
+
+    elif (isinstance(absent_chars[0],bytearray) and (isinstance(absent_chars[1],bytearray))):
+        # no absent chars are presents originally
+        # third case
+        compressed3 = bwt_encode(compressed,bytearray(b'\xFF')) # 255 is always the bwt eof.
+        compressed3 = bytearray(compressed3)
+
+                    # checkpoint : printing before attempting BWT,RLE,Huffmann for debugging purposes
+        checkpoint = "".join([f"\\x{byte:02x}" for byte in compressed3])
+        debugw("checkpoint_compress_after_bwt_no_absent")
+        debugw(checkpoint)
+
+
+        debugw("wheeler:")
+        debugw(len(compressed3))
+
+        #compressed3 = replace_repeating_chars(compressed3,4,abs_chars[1])
+        # RLE format repeated char + separator + number of repeats
+        # repeated_char cannot be equal to separator, which is a non issue since it is an absent char.
+        # however there is the case where the number of repeats is equal to the separator.
+        # in that case, two contiguous identical bytes to the separators will appear.
+        # the second separator should not be treated as such in the scan.
+        
+        # debug disable RLE
+        #compressed3 = replace_repeating_chars(compressed3,4,absent_chars[1])
+        compressed3 = bwt_second_stage(compressed3,254,mtf) # in that particular case
+        # absent char serving as RLE separator is 254.
+        
+
+        # checkpoint : printing before attempting BWT,RLE,Huffmann for debugging purposes
+        checkpoint = "".join([f"\\x{byte:02x}" for byte in compressed3])
+        debugw("checkpoint_compress_after_rle_no_absent")
+        debugw(checkpoint)
+
+
+    else:
+        #should never enter here
+        compressed3 = compressed
+        debugw("not a single absent char, not performing wheeler and rle")
+
+    len_after_rle = len(compressed3)
+    debugw("len after rle: " + str(len_after_rle))
+    debugw("len gain+/loss-: " + str(len_after_rle - len_after_shiftdown))
+
+
+    if (isinstance(absent_chars[0],int) and (isinstance(absent_chars[1],int))):
+    
+        
+        compressed3[:0] = [absent_chars[1]] # prepend BWT highest absent char in bin, in order to shift back in decompression.       
+        compressed3[:0] = [absent_chars[0]] # prepend RLE separator       
+        compressed3[:0] = bytearray(b'\xFF') # prepend BWT eof to signal use of bwt+rle TODO: use bit flags        
+        debugw("header:")
+        debugw(compressed3[0:3])
+
+    
+    elif (isinstance(absent_chars[0],bytearray) and (isinstance(absent_chars[1],int))):
+        
+        # format : abs_char[0] = absent sequence of two different chars that do not contain 255,254 or absent_char to make room bwt eof 255
+        # format : abs_char[1] = tmpchar (original absent char). the char in which rle sep (254) has been swapped into. 
+        compressed3[:0] = [absent_chars[1]] # prepend char in which rle sep has been swapped into.       
+        compressed3[:0] = absent_chars[0] # prepend absent sequence used to make room for bwt eof.      
+        compressed3[:0] = bytearray(b'\xFE') # prepend char to signify single absent char
+        debugw("header:")
+        debugw(compressed3[0:4])
+    
+    
+    elif (isinstance(absent_chars[0],bytearray) and (isinstance(absent_chars[1],bytearray))):
+        
+        # format : abs_char[0] = first found escape sequence to make room for rle sep
+        # format : abs_char[1] = second escape sequence to make room for bwt eof
+        compressed3[:0] = absent_chars[1] # prepend absent sequence used to make room for rle sep.       
+        compressed3[:0] = absent_chars[0] # prepend absent sequence used to make room for bwt eof.              
+        compressed3[:0] = bytearray(b'\xFD') # prepend char to signify no absent char   TODO: use bit flags        
+        debugw("header:")
+        debugw(compressed3[0:5])
+
+
+    else:
+        compressed3[:0] = bytearray(b'\x00') # 0 to signal neither bwt or rle was performed.
+        debugw("header:")
+        debugw(compressed3[0])
+
+    
+    debugw("absent_chars:")
+    debugw(absent_chars)
+
+
+    len_after_header = len(compressed3)
+    debugw("len after header add: " + str(len_after_header))
+    debugw("len gain+/loss-: " + str(len_after_header - len_after_rle))
+
+
+    codec_final_pass = load_final_pass_codec(final_pass_codec_id) #based on compressed interface.txt (interface.bin)
+    if (mtf):
+        codec_final_pass = load_mtf_codec()
+    #codec_final_pass.print_code_table()
+    # TODO : use several compressed files from second pass compression (dic + ngram + session dic)
+    # as a training base to get averaged context and more uniform final compression pass results.
+    
+    #codec_final_pass.load("huffmann_test.bin")
+    #codec_final_pass = HuffmanCodec.from_frequencies(frequency_dic)
+    #codec_final_pass.save("huffmann_final_pass.bin")
+    #codec_final_pass.print_code_table()
+    
+    if(not no_final_huf):
+
+        compressed4 = huffman_encode(codec_final_pass, compressed3)
+        compressed4_bytesarray = bytearray(compressed4)
+        frequency4 = Counter(compressed4).most_common()
+        frequency_dic4 = {}
+
+        for (ascii_code, count) in frequency4:
+            frequency_dic4[ascii_code] = count
+
+    else:
+        compressed4 = compressed3
 
+    len_after_final_pass = len(compressed4)
+    debugw("len after huffmann_final_pass: " + str(len_after_final_pass))
+    debugw("len gain+/loss-: " + str(len_after_final_pass - len_after_header))
+
+
+
+    """
+    posit_idx = {}
+    for byte_idx in range(0,len(compressed3)):
+        if compressed3[byte_idx] in posit_idx.keys():
+            #print()
+            tmplist = posit_idx[compressed3[byte_idx]] 
+            tmplist.append(byte_idx)
+            posit_idx[compressed3[byte_idx]] = tmplist
+        else:
+            posit_idx[compressed3[byte_idx]] = [byte_idx]
+
+    posit_idx2 = {}
+    for byte_idx2 in range(0,len(compressed)):
+        if compressed[byte_idx2] in posit_idx2.keys():
+            #print()
+            tmplist2 = posit_idx2[compressed[byte_idx2]] 
+            tmplist2.append(byte_idx2)
+            posit_idx2[compressed[byte_idx2]] = tmplist2
+        else:
+            posit_idx2[compressed[byte_idx2]] = [byte_idx2]
+
+    #debugw(sorted(posit_idx2.items()))
+    debugw(sorted(posit_idx.items()))
+    sorted_indexes = sorted(posit_idx.items())
+    
+    prevlastindex = -1
+    concat_index = []
+    for sorted_index in sorted_indexes:
+        for posidx in range(0,len(sorted_index[1])):
+            sorted_index[1][posidx] += 1
+        if (prevlastindex != -1):
+            if prevlastindex < sorted_index[1][0]:
+                #encode exception : last index of prev char is below first index of next char. 
+                concat_index.append(0)
+        concat_index.extend(sorted_index[1])
+        debugw(sorted_index[1])
+        prevlastindex = sorted_index[1][-1]
+
+    debugw(concat_index)
+
+    concat_index = []
+    final_idx = []
+    for sorted_index in sorted_indexes:
+        for posidx in range(0,len(sorted_index[1])):
+            reduce = 0
+            for previndex in concat_index:
+                if (sorted_index[1][posidx] > previndex):
+                    reduce -= 1
+            final_idx.append(sorted_index[1][posidx] + reduce)
+        concat_index.extend(sorted_index[1])
+        debugw(sorted_index[1])
+        prevlastindex = sorted_index[1][-1]
+
+    debugw(final_idx)
+    
+    avg1 = 0
+    avg2 = 0
+    
+    # before wheeler
+    idx_tot = 0
+    for (key,indexes) in posit_idx2.items():
+        #print(np.std(indexes))
+        avg1 += np.std(indexes)
+        idx_tot += 1
+    debugw(avg1/idx_tot)
+    
+    
+    # after wheeler
+    idx_tot = 0
+    debugw("after_bwt_std")      
+    for (key,indexes) in posit_idx.items():
+        #print(np.std(indexes))
+        avg2 += np.std(indexes) 
+        idx_tot += 1
+    debugw(avg2/idx_tot)
+    idx_tot = 0
+
+    
+    for (key,indexes) in posit_idx2.items():
+        #print(np.std(indexes))
+        upbound = 0
+        x = []
+        for i in range(0,len(indexes)):
+            x.append(i)
+            upbound = i
+        debugw(str(key))
+        plt.style.use('_mpl-gallery')
+        debugw(str(key))
+        fig, ax = plt.subplots()
+        debugw(str(key))
+        ax.plot(x, indexes, linewidth=1.0)
+        debugw(str(key))
+        ax.set(xlim=(0, upbound), xticks=np.arange(1, upbound),
+        ylim=(0, indexes[upbound]), yticks=np.arange(0, indexes[upbound],100))
+        debugw(str(key))
+        plt.savefig('distrib_nonbwt' + str(key) + '.png')
+    """
+    
+    ## index compression
+    ## list absent chars + sep "\x0\x0"
+    ## concatenate indexes. usually a decrease signals jump to next char index list. if not add
+    ## chr(0) between to signal it. all indexes should be shifted + 1.
+    ## now delta encode.
+
+
+    """
+    print("final entropy:")
+    print(frequency_dic2)
+    print("final sorted:")
+    for key,value in sorted(frequency_dic2.items()):
+        print(key,value)
+    """
+
+    return compressed4
+
+
+def compress_file(infile,outfile):
+    
     # we use a 'static' variable as a workaround for bad file descriptor error when trying to reopen stdout using
     # os.fdopen(sys.stdin.fileno(), 'wb', 0) in subsequent calls to compress_file in interactive mode.
     # with a static variable, initialized at the end of the function, os.fdopen(sys.stdin.fileno(), 'wb', 0)  is called only once.
@@ -2281,7 +3836,8 @@ def compress_file(infile,outfile):
             # the best option for now it check for chr(0) presence before writing the unknown token representation.
             ascii_content = utf8_file.read().encode('ascii', 'ignore').decode('ascii')
             #debugw(ascii_content)
-            languages = detect_language(ascii_content)
+            if(not huffmann_only):
+                languages = detect_language(ascii_content)
             #TODO : manage multiple languages
             Linesin = ascii_content.splitlines()
             if(debug_on):
@@ -2289,18 +3845,19 @@ def compress_file(infile,outfile):
                 with codecs.open(outfile_ascii, "w", encoding='ascii') as ascii_file:
                     ascii_file.write(ascii_content)
             if(huffmann_only):
-               huff_compressed = codec_all_whitespace.encode(ascii_content)
+               huff_compressed = huffman_encode(get_codec('all_whitespace'), ascii_content)
                
     else:
         # Reading file to be compressed
         file2 = open(infile,'r')
         ascii_content = file2.read()
-        detect_language(ascii_content)
+        if(not huffmann_only):
+            detect_language(ascii_content)
         Linesin = ascii_content.splitlines(keepends=True)
         #Linesin = file2.readlines()
         if(huffmann_only):
                #TODO generate codec_all_whitespace for french too
-               huff_compressed = codec_all_whitespace.encode(file2.read())
+               huff_compressed = huffman_encode(get_codec('all_whitespace'), ascii_content)
 
     if(huffmann_only):
         #if(len(outfile)):
@@ -2314,17 +3871,13 @@ def compress_file(infile,outfile):
         #if(len(outfile)):
         compress_file.fh = open(outfile, 'wt')
 
-    lineidx = 0
-    for line in Linesin:
-        line = line.lower()
+        lineidx = 0
+        for line in Linesin:
+            line = line.lower()
 
-        # First pass tokenizer (does not split adjunct special chars)
-        line_tokens = tknzr.tokenize(line)
-        #debugw(line_tokens)
+            # First pass tokenizer (does not split adjunct special chars)
+            line_tokens = tokenize_line(line)
 
-        if( not gendic):
-            tokens.append(line_tokens)
-        else:
             compressed = compress_tokens(line_tokens,gendic)
             if(len(outfile) and len(compressed)):
                 # write compressed binary stream to file if supplied in args or to stdout otherwise.
@@ -2339,452 +3892,660 @@ def compress_file(infile,outfile):
             else:
                 compress_file.fh.write(compressed)
                 #sys.stdout.buffer.write(b"\n")
-        lineidx += 1
-    #line_tokens.append("\n")
-    #tokens = tokens + line_tokens
-    debugw(tokens)
-    
-    if (not gendic):
-
-        compressed = compress_tokens(tokens,gendic)
-
-        if(secondpass):
-            candidates = compress_second_pass(compressed)
-            debugw("candidates:")
-            debugw(candidates)
-            processed_candidates = process_candidates_v2(candidates)
-            debugw("processed candidates:")
-            debugw(processed_candidates)
-            #compressed = replace_candidates_in_processed(processed_candidates,compressed)
-            compressed = replace_candidates_in_processed_v2(processed_candidates,compressed)
-            debugw("end process candidates.")
-        
-        
-        # checkpoint : printing before attempting BWT,RLE,Huffmann for debugging purposes
-        checkpoint = "".join([f"\\x{byte:02x}" for byte in compressed])
-        debugw("checkpoint_compress after pass 2")
-        debugw(checkpoint)
-        len_before_shiftdown = len(compressed)
-        debugw("len before shiftdown: " + str(len_before_shiftdown))
-        
-        frequency = Counter(compressed).most_common()
-        frequency_dic = {}
+            lineidx += 1
 
-        for (ascii_code, count) in frequency:
-            frequency_dic[ascii_code] = count
-
-        #for key,value in sorted(frequency_dic2.items()):
-        #    debugw(str(key) + " " + str(value))
-        #key_idx = 0
-        
-        
-        
-        #for key,value in sorted(frequency_dic2.items()):
-        #    if key != key_idx:
-        #        debugw("absent char!: "+ str(key_idx) + ", use as EOF for bwt")
-        #        abs_chars.append(key_idx)
-        #        #break
-        #    key_idx += 1
-
-
-
-        # for now we simplify the use case where there are at least two absent chars in the compressed
-        # bin stream, which happens quite a lot for short to medium original text inputs.
-
-        '''
-        abs_chars = []
-        
-
-        for charval in range(0,256):
-            if charval not in frequency_dic.keys():
-                abs_chars.append(charval)
+    else:
 
-        debugw("asbent chars:")
-        debugw(abs_chars)
+        compressed4 = compress_lines(Linesin)
 
-        abs_seq = []
-        if(len(abs_chars) < 2):
-            debugw("no two single byte absent chars were found in compressed stream")
-            abs_seq = find_absent_sequences(compressed,2)
+        # write compressed binary stream to file if supplied in args or to stdout otherwise.
+        if(len(outfile)):
+            compress_file.fh.write(compressed4)
         else:
-            debugw("at least two single byte absent chars were found in compressed stream")
-            abs_seq.append(bytearray((abs_chars[0]).to_bytes(1,'little')))
-            abs_seq.append(bytearray((abs_chars[1]).to_bytes(1,'little')))
-        debugw("asbent seq:")
-        debugw(abs_seq)
-        '''
+            compressed_hex = "".join([f"{byte:02x}" for byte in compressed4])
+            compress_file.fh.write(compressed_hex.encode('ascii'))
 
 
+    if len(outfile): 
+        compress_file.fh.close()
 
-        (absent_chars,compressed) = reuse_unused_chars_shiftdown(compressed)
-        # absent_chars[0] # is the RLE char. it is free
-        # absent_chars[1] # is the previously free char used to shift higher bytes into.
+    
+compress_file.fh = os.fdopen(sys.stdin.fileno(), 'wb', 0)
 
+# Worker pool (--jobs) : the frames of a framed stream and the blocks of a block mode frame are independent, they are
+# compressed and decompressed by a pool of worker processes and reassembled in order (map_ordered).
+# A worker loads the modules, dictionaries and codec once, when it starts, and gets the settings of this process.
+# Tasks never start a pool of their own.
+
+def worker_config():
+
+    # settings of this process (defaults changed by the command line or by a caller) that the tasks depend on
+    return {"debug_on" : debug_on, "secondpass" : secondpass, "regex_tokenizer" : regex_tokenizer,
+            "session_capacity" : session_capacity, "no_final_huf" : no_final_huf, "bwt_block_size" : bwt_block_size,
+            "mtf_stage" : mtf_stage, "mtf_min_size" : mtf_min_size, "final_pass_codec_id" : final_pass_codec_id,
+            "primary_index_bwt" : primary_index_bwt, "adaptive_tables" : adaptive_tables, "rans_stage" : rans_stage,
+            "compress" : compress, "jobs" : 1}
+
+def init_worker(config):
+
+    globals().update(config)
+    import_codec_modules()
+    if (compress):
+        import_tokenizer_modules()
+    if ('en' not in dicts):
+        dicts['en'] = load_dicts('en')
+    load_final_pass_codec(final_pass_codec_id)
+
+def worker_pool():
+
+    # started on first use, shut down at exit
+    if (worker_pool.pool is None):
+        from concurrent.futures import ProcessPoolExecutor
+        worker_pool.pool = ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(worker_config(),))
+    return worker_pool.pool
+
+worker_pool.pool = None
+
+def map_ordered(function, items):
+
+    # yields function(item) for each item, in order. With jobs > 1 the calls run in the worker pool, at most
+    # 2 * jobs of them submitted ahead of the result being yielded, so that a stream is not read all at once.
+    if (jobs <= 1):
+        for item in items:
+            yield function(item)
+        return
+
+    pool = worker_pool()
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(function, item))
+        if (len(pending) >= 2 * jobs):
+            yield pending.popleft().result()
+    while (len(pending)):
+        yield pending.popleft().result()
+
+# Framed stream container (-sc), for inputs of any size : memory is bounded by the frame size, not the input size.
+# header : container_magic + version (1 byte)
+# then frames : payload length (4 bytes, little endian) + flags (1 byte) + payload, up to the end of the stream.
+# each payload is a compress_lines stream of whole lines, with its own session dictionary.
+# flags : frame_flag_blocks (block mode, see compress_frame), frame_flag_mtf (mtf_stage, see mtf_encode),
+# frame_flag_tables (adaptive_tables and rans_stage, see encode_block_table),
+# the 4 high bits are the final pass codec id (final_pass_codec_id), other bits reserved.
+# -x detects the container from its magic, the daemon does as well.
+
+container_magic = b"PLTS"
+# version 2 : sentinel-free blocks (primary_index_bwt), version 1 : absent char blocks (0xFF, 0xFE, 0xFD headers).
+# both are read.
+container_version = 2
+container_version_sentinel = 1
+frame_header = struct.Struct("<IB")
+# a frame is closed at the end of the line that reaches this many input chars
+stream_frame_size = 1 << 20
+
+# block mode (bwt_block_size) : the token stream of the frame is cut into blocks of bwt_block_size bytes, each with
+# its own shiftdown header, BWT, RLE and final huffmann pass. The payload starts with a block table :
+# block count (4 bytes, little endian), then per block its compressed length, token stream length and token stream
+# crc32 (block_entry), then the blocks. A block can be located (skipped) from the table without decoding the others.
+frame_flag_blocks = 0x01
+frame_flag_mtf = 0x02
+frame_codec_shift = 4
+frame_codec_max = 15
+frame_flag_tables = 0x04
+frame_flags_known = frame_flag_blocks | frame_flag_mtf | frame_flag_tables | (frame_codec_max << frame_codec_shift)
+block_count = struct.Struct("<I")
+block_entry = struct.Struct("<III")
+
+def container_header():
+
+    return container_magic + bytes([container_version if (primary_index_bwt) else container_version_sentinel])
+
+def read_text_lines(infile):
+
+    # lines of a text file or of stdin ("-"), read incrementally and transcoded to ASCII as compress_file does.
+    if (infile == "-"):
+        binary = sys.stdin.buffer
+    else:
+        binary = open(infile, 'rb')
+    with io.TextIOWrapper(binary, encoding='utf-8', errors='ignore') as text:
+        for line in text:
+            for ascii_line in line.encode('ascii', 'ignore').decode('ascii').splitlines():
+                yield ascii_line
+
+def write_frame(fh, compressed, flags):
+
+    fh.write(frame_header.pack(len(compressed), flags))
+    fh.write(compressed)
+    fh.flush()
+
+def compress_frame(tokens):
+
+    # payload and flags of the frame of the token lists of the lines of a stream
+    compressed = compress_token_passes(tokens)
+    # the move-to-front ranks of a short stream are too spread for the power law code of load_mtf_codec, RLE is smaller
+    mtf = mtf_stage and (len(compressed) >= mtf_min_size)
+    flags = frame_flag_mtf if (mtf) else (final_pass_codec_id << frame_codec_shift)
+    # version 1 readers do not know the table byte
+    tables = (adaptive_tables or rans_stage) and primary_index_bwt and not no_final_huf
+    if (tables):
+        flags |= frame_flag_tables
+    if (not bwt_block_size):
+        return (compress_block(compressed, mtf, tables, 0, rans_stage), flags)
+
+    return (compress_token_blocks(compressed, mtf, tables, rans_stage), flags | frame_flag_blocks)
+
+def compress_token_blocks(compressed, mtf=False, tables=False, rans=False):
+
+    # block mode payload of a token stream : block table, then the blocks
+    blocks = []
+    table = bytearray(block_count.pack((len(compressed) + bwt_block_size - 1) // bwt_block_size))
+    plain_blocks = [compressed[start:start + bwt_block_size] for start in range(0, len(compressed), bwt_block_size)]
+    # crc and length first : compress_block works in place
+    entries = [(len(block), zlib.crc32(block)) for block in plain_blocks]
+    encoded_blocks = map_ordered(partial(compress_block, mtf=mtf, tables=tables, rans=rans), plain_blocks)
+    for ((length, crc), block) in zip(entries, encoded_blocks):
+        blocks.append(block)
+        table.extend(block_entry.pack(len(block), length, crc))
+    debugw("blocks: " + str(len(blocks)))
+    return table + b''.join(blocks)
+
+def frame_blocks(payload):
+
+    # (block, token stream length, crc32) of the blocks of a block mode payload, located from its block table.
+    if (len(payload) < block_count.size):
+        raise ValueError("truncated block table")
+    (count,) = block_count.unpack_from(payload, 0)
+    offset = block_count.size + count * block_entry.size
+    if (len(payload) < offset):
+        raise ValueError("truncated block table")
+    blocks = []
+    for (length, tokens_length, crc) in block_entry.iter_unpack(payload[block_count.size:offset]):
+        if (len(payload) < offset + length):
+            raise ValueError("truncated block")
+        blocks.append((payload[offset:offset + length], tokens_length, crc))
+        offset += length
+    return blocks
+
+def decode_block_stages(block, flags):
+
+    return bytearray(decode_stream_stages(block, flags))
+
+def decode_frame_stages(payload, flags):
+
+    # token stream of a frame payload
+    if (not (flags & frame_flag_blocks)):
+        return decode_stream_stages(payload, flags)
+
+    blocks = frame_blocks(payload)
+    decoded_blocks = map_ordered(partial(decode_block_stages, flags=flags), [block for (block, tokens_length, crc) in blocks])
+    return join_blocks(blocks, decoded_blocks)
+
+def join_blocks(blocks, decoded_blocks):
+
+    # token stream of the blocks of a frame (see frame_blocks), checked against the block table.
+    # decoded_blocks yields the decode_block_stages result of each block, in order.
+    compressed = bytearray()
+    for (block_idx, (block, tokens_length, crc)) in enumerate(blocks):
+        try:
+            block_tokens = next(decoded_blocks)
+        except (ValueError, IndexError, KeyError) as error:
+            raise ValueError("corrupt block: " + str(block_idx)) from error
+        if ((len(block_tokens) != tokens_length) or (zlib.crc32(block_tokens) != crc)):
+            raise ValueError("corrupt block: " + str(block_idx))
+        compressed.extend(block_tokens)
+    return compressed
 
-        # checkpoint : printing before attempting BWT,RLE,Huffmann for debugging purposes
-        checkpoint = "".join([f"\\x{byte:02x}" for byte in compressed])
-        debugw("checkpoint_compress after shiftdown")
-        debugw(checkpoint)
-        len_after_shiftdown = len(compressed)
-        debugw("len after shiftdown: " + str(len_after_shiftdown))
-        debugw("len gain+/loss-: " + str(len_after_shiftdown - len_after_shiftdown))
-        
+def read_frame_lines(infile):
 
-        # force not to use RLE and BWT
-        #absent_chars =  [-1]
+    # lines of a text file or of stdin, in lists of at least stream_frame_size chars (but the last one)
+    lines = []
+    frame_chars = 0
+    for line in read_text_lines(infile):
+        lines.append(line)
+        frame_chars += len(line) + 1
+        if (frame_chars >= stream_frame_size):
+            yield lines
+            lines = []
+            frame_chars = 0
+    if (len(lines)):
+        yield lines
 
-        #orig_idx = 0
+def compress_frame_lines(lines):
 
-        # absent_chars[0] and absent_chars[1] are both bytes. (general case with two available absent chars)
-        
-        # or absent_chars[0] is bytearray \x00\x00 and absent_chars[1] is  byte (only one originally available absent char)
-        # the additional absent char (255) has been constructed through an escape sequence \x00\x00 
-        # and by shifting each char in the whole ascii table down one position.
+    return compress_frame([tokenize_text_line(line) for line in lines])
 
+def compress_stream(infile,outfile):
 
-        # or absent_chars[0] is bytearray \x00\x00 and absent_chars[1] is \x01\x01
-        # the two absent chars (255) and (254) have been constructed through two escape sequences \x00\x00 and \x01\x01 
-        # and by shifting each char in the whole ascii table down two positions. 
+    # streaming compression : a frame is compressed and written out every stream_frame_size input chars, frames are
+    # compressed in order or by the worker pool (map_ordered). The output is binary, also on stdout.
+    if (len(outfile)):
+        fh = open(outfile, 'wb')
+    else:
+        fh = sys.stdout.buffer
+    fh.write(container_header())
 
+    frame_count = 0
+    for (payload, flags) in map_ordered(compress_frame_lines, read_frame_lines(infile)):
+        write_frame(fh, payload, flags)
+        frame_count += 1
+    debugw("frames written: " + str(frame_count))
 
-        if (isinstance(absent_chars[0],int) and (isinstance(absent_chars[1],int))):
-            # first case
-            compressed3 = bwt_encode(compressed,bytearray(b'\xFF')) # 255 is always the bwt eof.
-            compressed3 = bytearray(compressed3)
+    if (len(outfile)):
+        fh.close()
+    else:
+        fh.flush()
 
 
-            # checkpoint : printing before attempting BWT,RLE,Huffmann for debugging purposes
-            checkpoint = "".join([f"\\x{byte:02x}" for byte in compressed3])
-            debugw("checkpoint_compress_after_bwt_two_absent")
-            debugw(checkpoint)
+def decode_stream_stages(compressed0, flags=0):
 
+    # huffmann, RLE and BWT stages of a compressed stream, returns its token stream.
+    # flags : of its frame, for frame_flag_mtf, frame_flag_tables and the final pass codec id.
 
-            debugw("wheeler:")
-            debugw(len(compressed3))
+    # decoding part
+    debugw("decoding...")
 
-            repeats = find_repeating_chars(compressed3,4)
+    #First we need to retrieve the preamble/header (separators)
+    #and apply operations in reverse :
+    # 1- huffmann final pass decode
+    # 2- RLE decode
+    # 3- BWT
 
-            debugw("number of repeats:")
-            debugw(len(repeats))
 
-            #compressed3 = replace_repeating_chars(compressed3,4,abs_chars[1])
-            # RLE format repeated char + separator + number of repeats
-            # repeated_char cannot be equal to separator, which is a non issue since it is an absent char.
-            # however there is the case where the number of repeats is equal to the separator.
-            # in that case, two contiguous identical bytes to the separators will appear.
-            # the second separator should not be treated as such in the scan.
-            
-            # debug disable RLE
-            #compressed3 = replace_repeating_chars(compressed3,4,absent_chars[1])
-            compressed3 = replace_repeating_chars(compressed3,4,absent_chars[0])
-            
+    # checkpoint : printing after attempting BWT,RLE,Huffmann for debugging purposes
+    if (debug_on):
+        checkpoint = "".join([f"\\x{byte:02x}" for byte in compressed0])
+        debugw("checkpoint_decompress_after_second pass")
+        debugw(checkpoint)
 
-            # checkpoint : printing before attempting BWT,RLE,Huffmann for debugging purposes
-            checkpoint = "".join([f"\\x{byte:02x}" for byte in compressed3])
-            debugw("checkpoint_compress_after_rle_two_absent")
-            debugw(checkpoint)
+    compressed = Decode_Huffmann_RLE_BWT(compressed0, bool(flags & frame_flag_mtf), flags >> frame_codec_shift,
+                                         bool(flags & frame_flag_tables))
 
-        elif (isinstance(absent_chars[0],bytearray) and (isinstance(absent_chars[1],int))):
-            # a single absent char is present originally.
-            # second case
-            compressed3 = bwt_encode(compressed,bytearray(b'\xFF')) # 255 is always the bwt eof.
-            compressed3 = bytearray(compressed3)
+    # checkpoint : printing after attempting BWT,RLE,Huffmann for debugging purposes
+    if (debug_on):
+        checkpoint = "".join([f"\\x{byte:02x}" for byte in compressed])
+        debugw("checkpoint_decompress_after_rle_bwt_huffmann")
+        debugw(checkpoint)
 
-                        # checkpoint : printing before attempting BWT,RLE,Huffmann for debugging purposes
-            checkpoint = "".join([f"\\x{byte:02x}" for byte in compressed3])
-            debugw("checkpoint_compress_after_bwt_single_absent")
-            debugw(checkpoint)
+    return compressed
 
+def decompress_bytes(compressed0):
+
+    # full decompression of a compressed stream, returns the clear text.
+    return ''.join(decompress_bytes_chunks(compressed0))
+
+def decompress_bytes_chunks(compressed0):
+
+    # full decompression of a compressed stream, yields the clear text in chunks as it is decoded.
+    return decode_token_stream_chunks(decode_stream_stages(compressed0))
+
+# kinds of the tokens found by parse_token_stream
+token_word = 0 # primary dictionary word, value is its id
+token_ngram = 1 # value is the ngram code
+token_session = 2 # session dictionary word, value is its id
+token_escape = 3 # unknown word, value is the huffmann tree code, the word follows the token
+
+def parse_token_stream(compressed):
+
+    # finds every token of a token stream in bulk, returns the lists (starts, kinds, values, payload_ends, line_events).
+    # payload_ends is the position of the chr(0) termination of an escape payload, 0 for other tokens.
+    # line_events drive the capitalization state of decode_token_stream : 1 for a newline that starts a new
+    # line (not followed by another newline), 2 for the other tokens, 0 for a one byte token ending the stream.
+
+    # Every byte with msb at 0 ends a token. The msb 1 bytes before it (run of length k, since the previous
+    # msb 0 byte) hold k // 3 tokens of three msb 1 bytes (session words and escapes), then the k % 3
+    # first bytes of the token that the msb 0 byte ends. Escape payloads are ascii (msb 0) and end on chr(0),
+    # so they never merge with the surrounding tokens : they are parsed as one byte tokens, and masked afterwards.
+    import numpy as np
+
+    buf = np.frombuffer(bytes(compressed), dtype=np.uint8)
+    length = len(buf)
+    high = buf >= 128
+    ends = np.flatnonzero(~high)
+    previous = np.empty(len(ends), dtype=np.int64)
+    previous[0:1] = -1
+    previous[1:] = ends[:-1]
+    runs = ends - previous - 1
+
+    # a trailing msb 1 run holds complete three bytes tokens only
+    tail = np.flatnonzero(~high[::-1])
+    tail_start = length - int(tail[0]) if len(tail) else 0
+    run_starts = np.append(previous + 1, tail_start)
+    groups = np.append(runs // 3, (length - tail_start) // 3)
+    group_idx = np.arange(int(groups.sum())) - np.repeat(np.cumsum(groups) - groups, groups)
+    group_starts = np.repeat(run_starts, groups) + 3 * group_idx
+
+    remainders = runs % 3
+    starts = np.concatenate((group_starts, ends - remainders))
+    sizes = np.concatenate((np.full(len(group_starts), 3), remainders + 1))
+    order = np.argsort(starts, kind='stable')
+    starts = starts[order]
+    sizes = sizes[order]
+
+    padded = np.append(buf, np.zeros(2, dtype=np.uint8)).astype(np.int64)
+    b0 = padded[starts]
+    b1 = padded[starts + 1]
+    b2 = padded[starts + 2]
+    three_high = (sizes == 3) & (b2 >= 128)
+    v21 = (b0 & 0x7f) | ((b1 & 0x7f) << 7) | ((b2 & 0x7f) << 14)
+
+    values = np.where(sizes == 1, b0, ((b0 & 0x7f) | (b1 << 7)) + 128)
+    kinds = np.full(len(starts), token_word)
+    rare = (sizes == 3) & ~three_high
+    ngram = rare & (v21 >= 524416)
+    values[rare] = v21[rare] + (16384 + 128)
+    values[ngram] = v21[ngram] - 524416
+    kinds[ngram] = token_ngram
+    escape = three_high & (v21 >= 2097151 - 4)
+    session = three_high & ~escape
+    values[session] = v21[session] + (2097152 + 16384 + 128)
+    kinds[session] = token_session
+    values[escape] = 2097151 - v21[escape]
+    kinds[escape] = token_escape
+
+    payload_ends = np.zeros(len(starts), dtype=np.int64)
+    escapes = np.flatnonzero(escape)
+    if (len(escapes)):
+        # escapes are rare : their payloads are resolved in order, an escape lookalike inside
+        # a (huffmann) payload is part of that payload.
+        zeros = np.flatnonzero(buf == 0)
+        inside = np.zeros(length + 1, dtype=np.int64)
+        covered = 0
+        for token in escapes.tolist():
+            start = int(starts[token])
+            if (start < covered):
+                continue
+            zero = np.searchsorted(zeros, start + 3)
+            payload_end = int(zeros[zero]) if (zero < len(zeros)) else length
+            payload_ends[token] = payload_end
+            inside[start + 3] += 1
+            inside[min(payload_end + 1, length)] -= 1
+            covered = payload_end + 1
+        keep = np.cumsum(inside)[starts] == 0
+        starts = starts[keep]
+        kinds = kinds[keep]
+        values = values[keep]
+        payload_ends = payload_ends[keep]
+
+    # a newline is the one byte token 0
+    newline = (kinds == token_word) & (values == 0)
+    next_newline = np.append(newline[1:], False)
+    line_events = np.where(starts < length - 1, np.where(newline & ~next_newline, 1, 2), 0)
+
+    return (starts.tolist(), kinds.tolist(), values.tolist(), payload_ends.tolist(), line_events.tolist())
+
+# below this many tokens, the dense id -> word list costs more to build than it saves.
+dense_words_min = 16384
+
+# first chars of the tokens that trigger a detokenizer rule
+detokenizer_rule_chars = frozenset("!?.,;:/@")
+
+# the detokenizer rules look back at most 3 strings : older strings are joined and yielded
+# every decode_window strings, so the output does not have to be held in memory.
+decode_window = 4096
+decode_window_keep = 4
+
+def decode_token_stream(compressed):
+
+    # token stream (after RLE, BWT and huffmann decoding) -> clear text
+    return ''.join(decode_token_stream_chunks(compressed))
+
+def decode_token_stream_chunks(compressed):
+
+    # token stream (after RLE, BWT and huffmann decoding) -> chunks of clear text, yielded as tokens are decoded
+
+    (starts, kinds, values, payload_ends, line_events) = parse_token_stream(compressed)
+    count = len(starts)
+    primary = dicts['en'][0]
+    # unknown words of the stream, in order of appearance
+    session = SessionWords()
+
+    # words of the primary dictionary tokens, None for the tokens resolved in the loop (ngrams, session words, escapes)
+    if (count >= dense_words_min):
+        words = primary.words()
+        texts = [words[value] if (kind == token_word) else None for (kind, value) in zip(kinds, values)]
+    else:
+        texts = [primary[value] if (kind == token_word) else None for (kind, value) in zip(kinds, values)]
 
-            debugw("wheeler:")
-            debugw(len(compressed3))
+    detokenizer = []
+    detokenizer_idx = 0
+    append = detokenizer.append
+    ngram_texts = {}
 
-            repeats = find_repeating_chars(compressed3,4)
+    #FirstCharOfLine = 1
+    CharIsUpperCase = 1
+    #CharIsUpperCase2 = 0
+    
+    # main decoding loop
+    for token in range(0, count):
+
+            line_event = line_events[token]
+            if(line_event == 1):
+                #FirstCharOfLine = 1
+                CharIsUpperCase = 1
+            elif(line_event == 2 and CharIsUpperCase == 1):
+                #FirstCharOfLine = 2
+                CharIsUpperCase = 2
+                        
+            if(detokenizer_idx > 0):
 
-            debugw("number of repeats:")
-            debugw(len(repeats))
+                ### VARIOUS DETOKENIZER CLEANUP/FORMATTING OPERATIONS
+                previous = detokenizer[detokenizer_idx-2]
 
-            #compressed3 = replace_repeating_chars(compressed3,4,abs_chars[1])
-            # RLE format repeated char + separator + number of repeats
-            # repeated_char cannot be equal to separator, which is a non issue since it is an absent char.
-            # however there is the case where the number of repeats is equal to the separator.
-            # in that case, two contiguous identical bytes to the separators will appear.
-            # the second separator should not be treated as such in the scan.
-            
-            # format : abs_char[0] = \xFE\xFE. escape sequence for RLE.
-            # format : abs_char[1] = tmpchar (original absent char). the char in which bwt eof (255) has been swapped into. 
-        
-            # debug disable RLE
-            #compressed3 = replace_repeating_chars(compressed3,4,absent_chars[1])
-            compressed3 = replace_repeating_chars(compressed3,4,254) # in that particular case
-            # xFE is always rle char
-            
+                #ensure this is not the end of an ngram. ngrams necessarily contain whitespaces
+                if (previous[:1] in detokenizer_rule_chars and " " not in previous):
+                    # English syntactic rules : remove whitespace left of "!?." 
+                    # and enforce capitalization on first non whitespace character following.
+                    if (previous[:1] in ("!", "?", ".") and detokenizer_idx > 2):
+                        del detokenizer[detokenizer_idx-3]
+                        detokenizer_idx -= 1
+                        if(CharIsUpperCase != 1):
+                            CharIsUpperCase = 2
 
-            # checkpoint : printing before attempting BWT,RLE,Huffmann for debugging purposes
-            checkpoint = "".join([f"\\x{byte:02x}" for byte in compressed3])
-            debugw("checkpoint_compress_after_rle_single_absent")
-            debugw(checkpoint)
+                    # English syntactic rules : remove whitespace left of ",;:" 
+                    if (previous[:1] in (",", ";", ":") and detokenizer_idx > 2):         
+                        del detokenizer[detokenizer_idx-3]
+                        detokenizer_idx -= 1
 
-        elif (isinstance(absent_chars[0],bytearray) and (isinstance(absent_chars[1],bytearray))):
-            # no absent chars are presents originally
-            # third case
-            compressed3 = bwt_encode(compressed,bytearray(b'\xFF')) # 255 is always the bwt eof.
-            compressed3 = bytearray(compressed3)
+                    # URL/URI detected, remove any spurious whitespace before "//" 
+                    if (previous.startswith("//") and detokenizer_idx > 2):         
+                        del detokenizer[detokenizer_idx-3]
+                        detokenizer_idx -= 1
+                    
+                    # E-mail detected, remove whitespaces left and right of "@"
+                    if (previous.startswith("@") and detokenizer_idx > 2):         
+                        del detokenizer[detokenizer_idx-3]
+                        detokenizer_idx -= 1
+                        del detokenizer[detokenizer_idx-1]
+                        detokenizer_idx -= 1
 
-                        # checkpoint : printing before attempting BWT,RLE,Huffmann for debugging purposes
-            checkpoint = "".join([f"\\x{byte:02x}" for byte in compressed3])
-            debugw("checkpoint_compress_after_bwt_no_absent")
-            debugw(checkpoint)
+            word = texts[token]
+            if (word is None):
 
+                kind = kinds[token]
+                inta = values[token]
 
-            debugw("wheeler:")
-            debugw(len(compressed3))
+                if (kind == token_ngram):
 
-            repeats = find_repeating_chars(compressed3,4)
+                    # process ngram through ngram dictionary
+                    # replace ngram code with corresponding ngram string and add them to the tokenizer
+                    # the same ngrams come back often, their decoding is done once per stream.
+                    ngram_text = ngram_texts.get(inta)
+                    if (ngram_text is None):
+                        subtokens = decompress_ngram_bytes(dicts['en'][1].inverse[inta])
+                        # We know there shouldn't be any new lines in the subtokens.
+                        # Rules are processed for the first subtoken insertion only (detokenizer_idx - 2),
+                        # the rest of the ngram has inline processing.
+                        # Such a special token will be the only one to have whitespaces in it,
+                        # so that the backward detokenizer processor does not mingle with the rest of the ngram string.
+                        ngram_text = (subtokens[0], ngram_process_rules(subtokens[1:]))
+                        ngram_texts[inta] = ngram_text
 
-            debugw("number of repeats:")
-            debugw(len(repeats))
+                    if(CharIsUpperCase == 2):
+                        append(ngram_text[0].capitalize())
+                        CharIsUpperCase = 0
+                    else:
+                        append(ngram_text[0])
+                    append(ngram_text[1])
+                    detokenizer_idx += 2
+                    continue
 
-            #compressed3 = replace_repeating_chars(compressed3,4,abs_chars[1])
-            # RLE format repeated char + separator + number of repeats
-            # repeated_char cannot be equal to separator, which is a non issue since it is an absent char.
-            # however there is the case where the number of repeats is equal to the separator.
-            # in that case, two contiguous identical bytes to the separators will appear.
-            # the second separator should not be treated as such in the scan.
-            
-            # debug disable RLE
-            #compressed3 = replace_repeating_chars(compressed3,4,absent_chars[1])
-            compressed3 = replace_repeating_chars(compressed3,4,254) # in that particular case
-            # absent char serving as RLE separator is 254.
-            
+                if (kind == token_escape):
 
-            # checkpoint : printing before attempting BWT,RLE,Huffmann for debugging purposes
-            checkpoint = "".join([f"\\x{byte:02x}" for byte in compressed3])
-            debugw("checkpoint_compress_after_rle_no_absent")
-            debugw(checkpoint)
+                    # unknown word, it follows its escape sequence up to the chr(0) termination.
+                    debugw("unknown word escape sequence detected, code: " + str(inta))
+                    payload = compressed[starts[token] + 3:payload_ends[token]]
+                    if(inta == 0):
+                        word = payload.decode('latin-1')
+                    else:
+                        word = decode_unknown(bytearray(payload),inta)
 
+                    debugw("we append that unknown word in our session dic at idx: " + str(session_id_start + len(session)) + " since it may be recalled")
+                    session.add(word)
 
-        else:
-            #should never enter here
-            compressed3 = compressed
-            debugw("not a single absent char, not performing wheeler and rle")
+                else:
 
-        len_after_rle = len(compressed3)
-        debugw("len after rle: " + str(len_after_rle))
-        debugw("len gain+/loss-: " + str(len_after_rle - len_after_shiftdown))
+                    # recalled word from the session dictionary
+                    try:
+                        word = session[inta]
+                    except KeyError:
+                        debugw("something went wrong, could not find word in session DIC, size: " + str(len(session)))
+                        continue
+
+            if(CharIsUpperCase == 2):
+                append(word.capitalize())
+                CharIsUpperCase = 0
+            else:
+                append(word)
+            detokenizer_idx += 1
 
+            if(CharIsUpperCase != 1):
+                append(" ")
+                detokenizer_idx += 1
 
-        if (isinstance(absent_chars[0],int) and (isinstance(absent_chars[1],int))):
-        
-            
-            compressed3[:0] = [absent_chars[1]] # prepend BWT highest absent char in bin, in order to shift back in decompression.       
-            compressed3[:0] = [absent_chars[0]] # prepend RLE separator       
-            compressed3[:0] = bytearray(b'\xFF') # prepend BWT eof to signal use of bwt+rle TODO: use bit flags        
-            debugw("header:")
-            debugw(compressed3[0:3])
+            if(detokenizer_idx >= decode_window):
+                yield ''.join(detokenizer[:-decode_window_keep])
+                del detokenizer[:-decode_window_keep]
+                detokenizer_idx = decode_window_keep
 
-        
-        elif (isinstance(absent_chars[0],bytearray) and (isinstance(absent_chars[1],int))):
-            
-            # format : abs_char[0] = absent sequence of two different chars that do not contain 255,254 or absent_char to make room bwt eof 255
-            # format : abs_char[1] = tmpchar (original absent char). the char in which rle sep (254) has been swapped into. 
-            compressed3[:0] = [absent_chars[1]] # prepend char in which rle sep has been swapped into.       
-            compressed3[:0] = absent_chars[0] # prepend absent sequence used to make room for bwt eof.      
-            compressed3[:0] = bytearray(b'\xFE') # prepend char to signify single absent char
-            debugw("header:")
-            debugw(compressed3[0:4])
-        
-        
-        elif (isinstance(absent_chars[0],bytearray) and (isinstance(absent_chars[1],bytearray))):
-            
-            # format : abs_char[0] = first found escape sequence to make room for rle sep
-            # format : abs_char[1] = second escape sequence to make room for bwt eof
-            compressed3[:0] = absent_chars[1] # prepend absent sequence used to make room for rle sep.       
-            compressed3[:0] = absent_chars[0] # prepend absent sequence used to make room for bwt eof.              
-            compressed3[:0] = bytearray(b'\xFD') # prepend char to signify no absent char   TODO: use bit flags        
-            debugw("header:")
-            debugw(compressed3[0:5])
+    debugw(detokenizer)
+    yield ''.join(detokenizer)
 
+def read_frames(fh):
 
+    # (payload, flags) of the frames of a framed stream, fh is positioned after container_magic.
+    version = fh.read(1)
+    if (version not in (bytes([container_version]), bytes([container_version_sentinel]))):
+        raise ValueError("unsupported container version: " + repr(version))
+    while(True):
+        header = fh.read(frame_header.size)
+        if (not len(header)):
+            return
+        if (len(header) < frame_header.size):
+            raise ValueError("truncated frame header")
+        (length, flags) = frame_header.unpack(header)
+        if (flags & ~frame_flags_known):
+            raise ValueError("unsupported frame flags: " + str(flags))
+        payload = fh.read(length)
+        if (len(payload) < length):
+            raise ValueError("truncated frame")
+        yield (payload, flags)
+
+def decode_frame_chunks(frame):
+
+    (payload, flags) = frame
+    return decode_token_stream_chunks(decode_frame_stages(bytearray(payload), flags))
+
+def decode_frame_text(frame):
+
+    # worker task : the whole text of a frame, as a single chunk
+    return [''.join(decode_frame_chunks(frame))]
+
+def decode_frames_parallel(frames):
+
+    # jobs > 1 : yields the chunks of each frame, in order. Frames are decoded by the worker pool, a task per frame,
+    # but for block mode frames : a task per block, the token stream is detokenized here.
+    pool = worker_pool()
+    pending = deque()
+    for (payload, flags) in frames:
+        if (flags & frame_flag_blocks):
+            blocks = frame_blocks(payload)
+            futures = [pool.submit(decode_block_stages, block, flags) for (block, tokens_length, crc) in blocks]
+            pending.append((blocks, futures))
         else:
-            compressed3[:0] = bytearray(b'\x00') # 0 to signal neither bwt or rle was performed.
-            debugw("header:")
-            debugw(compressed3[0])
-
-        
-        debugw("absent_chars:")
-        debugw(absent_chars)
-
-
-        len_after_header = len(compressed3)
-        debugw("len after header add: " + str(len_after_header))
-        debugw("len gain+/loss-: " + str(len_after_header - len_after_rle))
+            pending.append((None, pool.submit(decode_frame_text, (payload, flags))))
+        while (len(pending) >= 2 * jobs):
+            yield frame_chunks_result(*pending.popleft())
+    while (len(pending)):
+        yield frame_chunks_result(*pending.popleft())
 
+def frame_chunks_result(blocks, futures):
 
-        codec_final_pass = HuffmanCodec.load("huffmann_final_pass.bin") #based on compressed interface.txt (interface.bin)
-        #codec_final_pass.print_code_table()
-        # TODO : use several compressed files from second pass compression (dic + ngram + session dic)
-        # as a training base to get averaged context and more uniform final compression pass results.
-        
-        #codec_final_pass.load("huffmann_test.bin")
-        #codec_final_pass = HuffmanCodec.from_frequencies(frequency_dic)
-        #codec_final_pass.save("huffmann_final_pass.bin")
-        #codec_final_pass.print_code_table()
-        
-        if(not no_final_huf):
+    if (blocks is None):
+        return futures.result()
+    return decode_token_stream_chunks(join_blocks(blocks, (future.result() for future in futures)))
 
-            compressed4 = codec_final_pass.encode(compressed3)
-            compressed4_bytesarray = bytearray(compressed4)
-            frequency4 = Counter(compressed4).most_common()
-            frequency_dic4 = {}
-
-            for (ascii_code, count) in frequency4:
-                frequency_dic4[ascii_code] = count
+def decompress_frames(fh):
 
+    # clear text of the frames of a framed stream in chunks, fh is positioned after container_magic.
+    if (jobs > 1):
+        frames_chunks = decode_frames_parallel(read_frames(fh))
+    else:
+        frames_chunks = map(decode_frame_chunks, read_frames(fh))
+
+    # the detokenizer ends a stream with a space after its last newline. Within a single stream, that space is only
+    # there before an empty line : it is held back up to the next frame, so that frames give the same text as
+    # a single stream.
+    pending = ""
+    for frame_chunks in frames_chunks:
+        # the last chunk of the frame is held back to check its end
+        text = None
+        for chunk in frame_chunks:
+            if (text is None):
+                if (chunk.startswith("\n")):
+                    chunk = pending + chunk
+            else:
+                yield text
+            text = chunk
+        if (text.endswith("\n ")):
+            pending = " "
+            text = text[:-1]
         else:
-            compressed4 = compressed3
-
-        len_after_final_pass = len(compressed4)
-        debugw("len after huffmann_final_pass: " + str(len_after_final_pass))
-        debugw("len gain+/loss-: " + str(len_after_final_pass - len_after_header))
-
-
+            pending = ""
+        yield text
+    if (len(pending)):
+        yield pending
 
-        """
-        posit_idx = {}
-        for byte_idx in range(0,len(compressed3)):
-            if compressed3[byte_idx] in posit_idx.keys():
-                #print()
-                tmplist = posit_idx[compressed3[byte_idx]] 
-                tmplist.append(byte_idx)
-                posit_idx[compressed3[byte_idx]] = tmplist
-            else:
-                posit_idx[compressed3[byte_idx]] = [byte_idx]
-
-        posit_idx2 = {}
-        for byte_idx2 in range(0,len(compressed)):
-            if compressed[byte_idx2] in posit_idx2.keys():
-                #print()
-                tmplist2 = posit_idx2[compressed[byte_idx2]] 
-                tmplist2.append(byte_idx2)
-                posit_idx2[compressed[byte_idx2]] = tmplist2
-            else:
-                posit_idx2[compressed[byte_idx2]] = [byte_idx2]
+def decompress_file(infile,outfile):
 
-        #debugw(sorted(posit_idx2.items()))
-        debugw(sorted(posit_idx.items()))
-        sorted_indexes = sorted(posit_idx.items())
-        
-        prevlastindex = -1
-        concat_index = []
-        for sorted_index in sorted_indexes:
-            for posidx in range(0,len(sorted_index[1])):
-                sorted_index[1][posidx] += 1
-            if (prevlastindex != -1):
-                if prevlastindex < sorted_index[1][0]:
-                    #encode exception : last index of prev char is below first index of next char. 
-                    concat_index.append(0)
-            concat_index.extend(sorted_index[1])
-            debugw(sorted_index[1])
-            prevlastindex = sorted_index[1][-1]
-
-        debugw(concat_index)
-
-        concat_index = []
-        final_idx = []
-        for sorted_index in sorted_indexes:
-            for posidx in range(0,len(sorted_index[1])):
-                reduce = 0
-                for previndex in concat_index:
-                    if (sorted_index[1][posidx] > previndex):
-                        reduce -= 1
-                final_idx.append(sorted_index[1][posidx] + reduce)
-            concat_index.extend(sorted_index[1])
-            debugw(sorted_index[1])
-            prevlastindex = sorted_index[1][-1]
-
-        debugw(final_idx)
-        
-        avg1 = 0
-        avg2 = 0
-        
-        # before wheeler
-        idx_tot = 0
-        for (key,indexes) in posit_idx2.items():
-            #print(np.std(indexes))
-            avg1 += np.std(indexes)
-            idx_tot += 1
-        debugw(avg1/idx_tot)
-        
-        
-        # after wheeler
-        idx_tot = 0
-        debugw("after_bwt_std")      
-        for (key,indexes) in posit_idx.items():
-            #print(np.std(indexes))
-            avg2 += np.std(indexes) 
-            idx_tot += 1
-        debugw(avg2/idx_tot)
-        idx_tot = 0
+    # the clear text is written out as it is decoded, through the buffered sink (outfile or stdout).
+    if (infile == "-"):
+        fh = sys.stdin.buffer
+    else:
+        fh = open(infile, 'rb')
 
-        
-        for (key,indexes) in posit_idx2.items():
-            #print(np.std(indexes))
-            upbound = 0
-            x = []
-            for i in range(0,len(indexes)):
-                x.append(i)
-                upbound = i
-            debugw(str(key))
-            plt.style.use('_mpl-gallery')
-            debugw(str(key))
-            fig, ax = plt.subplots()
-            debugw(str(key))
-            ax.plot(x, indexes, linewidth=1.0)
-            debugw(str(key))
-            ax.set(xlim=(0, upbound), xticks=np.arange(1, upbound),
-            ylim=(0, indexes[upbound]), yticks=np.arange(0, indexes[upbound],100))
-            debugw(str(key))
-            plt.savefig('distrib_nonbwt' + str(key) + '.png')
-        """
-        
-        ## index compression
-        ## list absent chars + sep "\x0\x0"
-        ## concatenate indexes. usually a decrease signals jump to next char index list. if not add
-        ## chr(0) between to signal it. all indexes should be shifted + 1.
-        ## now delta encode.
+    if (len(outfile)):
+        out = open(outfile, 'w')
+    else:
+        out = sys.stdout
 
-        # write compressed binary stream to file if supplied in args or to stdout otherwise.
-        
-        #if(len(outfile)):
-        #    with open(outfile, 'wb') as fh:
-        #        fh.write(compressed4)
-        #else:
-        
-        if(len(outfile)):
-            compress_file.fh.write(compressed4)
+    with fh:
+        magic = fh.read(len(container_magic))
+        if (magic == container_magic):
+            # framed stream (-sc), decoded frame by frame
+            chunks = decompress_frames(fh)
         else:
-            compressed_hex = "".join([f"{byte:02x}" for byte in compressed4])
-            compress_file.fh.write(compressed_hex.encode('ascii'))
-        
-        for sessidx in range(2113664,unknown_token_idx):
-            debugw("session_index:" + str(sessidx))
-            debugw(dicts['en'][0][sessidx])
-            #debugw(dicts['en'][0].inverse[engdict[sessidx]])
-            debugw("session_index:" + str(sessidx))
-
-        """
-        print("final entropy:")
-        print(frequency_dic2)
-        print("final sorted:")
-        for key,value in sorted(frequency_dic2.items()):
-            print(key,value)
-        """
-    if len(outfile): 
-        compress_file.fh.close()
+            compressed0 = bytearray(magic + fh.read())
+            chunks = decompress_bytes_chunks(compressed0)
 
-    
-compress_file.fh = os.fdopen(sys.stdin.fileno(), 'wb', 0)
+        for chunk in chunks:
+            out.write(chunk)
+
+    if (len(outfile)):
+        out.close()
+    else:
+        if (magic != container_magic):
+            # as print(text) did
+            out.write("\n")
+        out.flush()
 
 
 def scan_files(folder_path,extension):
@@ -2804,6 +4565,71 @@ def scan_files(folder_path,extension):
             else:
                 print("file not to process:" + str(file_name))
 
+def corpus_files(folder_path, suffix):
+
+    # files of folder_path (recursively) whose name ends with suffix, in a stable order
+    for root, dirs, files in os.walk(folder_path):
+        dirs.sort()
+        for file_name in sorted(files):
+            if (file_name.endswith(suffix)):
+                yield os.path.join(root, file_name)
+
+def final_pass_frequencies(file_path):
+
+    # byte counts of the blocks of a file before the final pass (stages 1 to 5 of compress_block), as a dict
+    # for a cheap merge. A worker task of train_final_pass.
+    import numpy as np
+
+    counts = np.zeros(256, dtype=np.int64)
+    codec = load_final_pass_codec()
+    for lines in read_frame_lines(file_path):
+        compressed = compress_token_passes([tokenize_text_line(line) for line in lines])
+        block = compress_block_stages(compressed, False, codec)
+        counts += np.bincount(np.frombuffer(bytes(block), dtype=np.uint8), minlength=256)
+    return {byte : int(count) for (byte, count) in enumerate(counts) if count}
+
+def final_pass_codec_from_frequencies(frequencies):
+
+    # every byte value keeps a code : blocks outside the corpus are still encoded
+    return HuffmanCodec.from_frequencies({byte : frequencies.get(byte, 0) + 1 for byte in range(0, 256)})
+
+def train_final_pass(folder_path, suffix):
+
+    # builds a final pass codec from the byte frequencies of the blocks of a corpus (see -tf) and saves it with the
+    # first free codec id. Files are processed by the worker pool (map_ordered), their counts merged as they come :
+    # memory holds one table of 256 counts, whatever the corpus size. A file weighs by its block size.
+    import numpy as np
+
+    codec_id = 1
+    while (os.path.isfile(final_pass_codec_path(codec_id))):
+        codec_id += 1
+    if (codec_id > frame_codec_max):
+        print("no free final pass codec id, remove one of " + final_pass_codec_path(1) + " .. "
+              + final_pass_codec_path(frame_codec_max))
+        sys.exit(1)
+
+    frequencies = Counter()
+    file_count = 0
+    for counts in map_ordered(final_pass_frequencies, corpus_files(folder_path, suffix)):
+        frequencies.update(counts)
+        file_count += 1
+    total = sum(frequencies.values())
+    if (not total):
+        print("no input in " + folder_path + " for suffix '" + suffix + "'")
+        sys.exit(1)
+
+    codec = final_pass_codec_from_frequencies(frequencies)
+    path = final_pass_codec_path(codec_id)
+    codec.save(path, metadata={'version' : codec_id, 'files' : file_count, 'bytes' : total})
+
+    counts = np.array([frequencies[byte] for byte in range(0, 256)], dtype=np.int64)
+    base_bits = int(np.dot(counts, huffman_code_lengths(load_final_pass_codec())))
+    trained_bits = int(np.dot(counts, huffman_code_lengths(codec)))
+    print("files: " + str(file_count) + " block bytes: " + str(total))
+    print("final pass bytes with codec 0: " + str((base_bits + 7) // 8) + " with codec " + str(codec_id) + ": "
+          + str((trained_bits + 7) // 8) + " (" + format(100.0 * (base_bits - trained_bits) / base_bits, ".2f") + "% smaller)")
+    print("codec " + str(codec_id) + " written to " + path + ", compress with -fp " + str(codec_id))
+
 def detect_language(cleartext):
     
     #print(cleartext)
@@ -2816,554 +4642,508 @@ def detect_language(cleartext):
         #return "en"
     languages_detected = []
     
-    languages = [Language.ENGLISH, Language.FRENCH]
-    detector = LanguageDetectorBuilder.from_languages(*languages).build()
-    for result in detector.detect_multiple_languages_of(cleartext):
+    # the detector is built once per process
+    if (detect_language.detector is None):
+        languages = [Language.ENGLISH, Language.FRENCH]
+        detect_language.detector = LanguageDetectorBuilder.from_languages(*languages).build()
+    for result in detect_language.detector.detect_multiple_languages_of(cleartext):
         language_details = (result.language.iso_code_639_1.name,result.start_index,result.end_index)
         languages_detected.append(language_details)
 
 
     return tuple(languages_detected)
 
+detect_language.detector = None
+
     
 
 
-def send_msg(compressed):
-    #Send compressed message over LoRa
-    pass
+def text_lines_from_bytes(raw):
 
-###INLINE START###
+    # same transcoding as compress_file, for text that does not come from a file.
+    try:
+        ascii_content = raw.decode('utf-8').encode('ascii', 'ignore').decode('ascii')
+    except UnicodeDecodeError:
+        debugw("invalid utf-8")
+        ascii_content = raw.decode('ascii', 'ignore')
+    detect_language(ascii_content)
+    return ascii_content.splitlines()
+
+# Compression daemon : python3 dicstrv.py -srv <socket_path>
+# Dictionaries and codecs are loaded once, then compress and decompress requests are served over a unix domain socket.
+# Each connection is served by a forked child : requests run concurrently, and each of them starts from the warm
+# parent state, with an empty session dictionary.
+
+# framing (handle_request), one request per connection :
+# request : op (1 byte, 'c' compress or 'x' decompress) + payload length (4 bytes, big endian) + payload
+# response : status (1 byte, 0 ok or 1 error) + payload length (4 bytes, big endian) + payload
+# the compress payload is the raw text, its response is the compressed stream.
+# the decompress payload is a compressed stream, its response is the clear text encoded in utf-8.
+# on error, the response payload is the error message.
+
+server_frame_header = struct.Struct(">cI")
+
+def handle_request(rfile, wfile):
+
+    header = rfile.read(server_frame_header.size)
+    if (len(header) < server_frame_header.size):
+        debugw("truncated request header")
+        return
+    (op, length) = server_frame_header.unpack(header)
+    payload = rfile.read(length)
+    if (len(payload) < length):
+        debugw("truncated request payload")
+        return
 
-#downloading tokenizer model if missing
-nltk.download('punkt')
+    try:
+        if (op == b'c'):
+            result = bytes(compress_lines(text_lines_from_bytes(payload)))
+        elif (op == b'x' and payload.startswith(container_magic)):
+            frames = io.BytesIO(payload)
+            frames.seek(len(container_magic))
+            result = ''.join(decompress_frames(frames)).encode('utf-8')
+        elif (op == b'x'):
+            result = decompress_bytes(bytearray(payload)).encode('utf-8')
+        else:
+            raise ValueError("unknown operation: " + repr(op))
+        status = b'\x00'
+    except Exception as error:
+        traceback.print_exc()
+        result = str(error).encode('utf-8')
+        status = b'\x01'
 
-#opening the english dict of most used 1/3 million words from google corpus of 1 trillion words.
-#special characters have been added with their respective prevalence (from wikipedia corpus)
-#contractions also have been added in their form with a quote just after (next line) the form 
-# without quote. ex : next line after "dont" appears "don't"
+    wfile.write(server_frame_header.pack(status, len(result)))
+    wfile.write(result)
 
-#initializing Python dicts
+def serve(socket_path):
 
-"""
-count = 1
-engdict = {}
-engdictrev = {}
+    # socketserver is only imported by the daemon mode
+    import socketserver
 
+    class CompressionRequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            handle_request(self.rfile, self.wfile)
 
-if (not os.path.isfile('count_1w.pickle')):
+    class CompressionServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+        pass
 
+    if (os.path.exists(socket_path)):
+        os.unlink(socket_path)
 
-    debugw("first load of dic")
-    file1 = open('count_1w.txt', 'r')
-    Lines = file1.readlines()
+    # static tables are built once in the parent, not in every forked child
+    encode_token_id(0)
 
-    # special case : byte val 0 is equal to new line.
-    # TODO : make sure that windows CRLF is taken care of.
-    engdict[0] = "\n"
-    engdictrev["\n"] = 0
+    # do not duplicate pending output into the forked children
+    sys.stdout.flush()
+    with CompressionServer(socket_path, CompressionRequestHandler) as server:
+        debugw("serving on: " + socket_path)
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(socket_path)
 
-    # populating dicts
-    for line in Lines:
-        # Strips the newline character
-        engdict[count] = line.strip()
-        engdictrev[line.strip()] = count
-        count += 1
+def send_msg(compressed):
+    #Send compressed message over LoRa
+    pass
 
-    debugw("pickling dictionaries")
-    with open('count_1w.pickle', 'wb') as handle:
-        pickle.dump(engdict, handle, protocol=pickle.HIGHEST_PROTOCOL)
-        pickle.dump(engdictrev, handle, protocol=pickle.HIGHEST_PROTOCOL)
+def import_codec_modules():
+    # bitarray and dahuffman : every mode that reads or writes a compressed stream.
+    global bitarray, HuffmanCodec
+    from bitarray import bitarray
+    from dahuffman import HuffmanCodec
+
+def import_tokenizer_modules():
+    # nltk and lingua : tokenization and language detection, compression modes only.
+    # nltk alone is several hundred ms of import time, it is not needed by the regex tokenizer.
+    global nltk, tknzr, Language, LanguageDetectorBuilder
+    from lingua import Language, LanguageDetectorBuilder
+    if (not regex_tokenizer):
+        import nltk
+        from nltk.tokenize import TweetTokenizer
+        tknzr = TweetTokenizer()
+
+def tokenize_line(line):
+    # first pass tokenizer (does not split adjunct special chars)
+    if (regex_tokenizer):
+        return regex_tokenize_line(line)
+    return tknzr.tokenize(line)
+
+def word_tokenize(token):
+    # second tokenizer, splits the adjunct special chars of a token that is not in the dictionary
+    if (regex_tokenizer):
+        return regex_split_token(token)
+    # downloading tokenizer model if missing, on first use only : most tokens never reach this fallback tokenizer.
+    if (not word_tokenize.punkt_checked):
+        try:
+            nltk.data.find('tokenizers/punkt')
+        except LookupError:
+            nltk.download('punkt')
+        word_tokenize.punkt_checked = True
+    return nltk.word_tokenize(token)
+
+word_tokenize.punkt_checked = False
+
+# Regex tokenizer
+# regex_tokenize_line and regex_split_token give the tokens of TweetTokenizer().tokenize(line) and
+# nltk.word_tokenize(token) for the ascii text the compressor works on, with precompiled stdlib regexes.
+# Patterns are the ones of nltk 3.x (nltk/tokenize/casual.py and destructive.py), without their non ascii parts.
+# python3 dicstrv_bench.py tokenize <txt_corpus> checks that both tokenizers give the same tokens.
+
+# first pass : one scan per line, alternatives in the order of TweetTokenizer (phone numbers enabled)
+line_token_re = re.compile(r"""
+  (?:                                   # URLs
+    https?:
+    (?:
+      /{1,3}
+      |
+      [a-z0-9%]
+    )
+    |
+    [a-z0-9.\-]{1,255}[.]
+    (?:[a-z]{2,13})
+    /
+  )
+  (?:
+    [^\s()<>{}\[\]]+
+    |
+    \([^\s()]{0,255}?\([^\s()]{1,255}\)[^\s()]{0,255}?\)
+    |
+    \([^\s]{1,255}?\)
+  )+
+  (?:
+    \([^\s()]{0,255}?\([^\s()]{1,255}\)[^\s()]{0,255}?\)
+    |
+    \([^\s]{1,255}?\)
+    |
+    [^\s`!()\[\]{};:'".,<>?]
+  )
+  |
+  (?:                                   # naked domains
+    (?<!@)
+    [a-z0-9]+
+    (?:[.\-][a-z0-9]+){0,126}
+    [.]
+    (?:[a-z]{2,13})
+    \b
+    /?
+    (?!@)
+  )
+  |
+  (?:                                   # phone numbers
+    (?:
+      \+?[01]
+      [ *\-.\)]*
+    )?
+    (?:
+      [\(]?
+      \d{3}
+      [ *\-.\)]*
+    )?
+    \d{3}
+    [ *\-.\)]*
+    \d{4}
+  )
+  |
+  (?:                                   # ascii emoticons
+    [<>]?
+    [:;=8]
+    [\-o\*\']?
+    [\)\]\(\[dDpP/\:\}\{@\|\\]
+    |
+    [\)\]\(\[dDpP/\:\}\{@\|\\]
+    [\-o\*\']?
+    [:;=8]
+    [<>]?
+    |
+    </?3
+  )
+  |
+  <[^>\s]+>                             # html tags
+  |
+  [\-]+>|<[\-]+                         # ascii arrows
+  |
+  (?:@[\w_]+)                           # usernames
+  |
+  (?:\#+[\w_]+[\w\'_\-]*[\w_]+)         # hashtags
+  |
+  [\w.+-]{1,64}@[\w-]{1,63}\.(?:[\w-]\.?){1,251}[\w-]  # email addresses
+  |
+  (?:[^\W\d_](?:[^\W\d_]|['\-_])+[^\W\d_])  # words with apostrophes or dashes
+  |
+  (?:[+\-]?\d+[,/.:-]\d+[+\-]?)         # numbers, including fractions, decimals
+  |
+  (?:[\w_]+)                            # words without apostrophes or dashes
+  |
+  (?:\.(?:\s*\.){1,})                   # ellipsis dots
+  |
+  (?:\S)                                # everything else that is not whitespace
+  """, re.VERBOSE | re.IGNORECASE)
+
+# TweetTokenizer also replaces html entities, and shortens runs of 4 or more identical non alphanumeric chars to 3.
+html_entity_re = re.compile(r"&(#?(x?))([^&;\s]+);")
+hang_re = re.compile(r"([^a-zA-Z0-9])\1{3,}")
+
+def replace_html_entity(match):
+    entity_body = match.group(3)
+    number = None
+    if (match.group(1)):
+        try:
+            number = int(entity_body, 16 if match.group(2) else 10)
+            # numeric references in the 80-9F range are windows-1252 chars
+            if (0x80 <= number <= 0x9F):
+                return bytes((number,)).decode("cp1252")
+        except ValueError:
+            number = None
+    else:
+        import html.entities
+        number = html.entities.name2codepoint.get(entity_body)
+    if (number is not None):
+        try:
+            return chr(number)
+        except (ValueError, OverflowError):
+            pass
+    return ""
+
+def regex_tokenize_line(line):
+    if ("&" in line):
+        line = html_entity_re.sub(replace_html_entity, line)
+    return line_token_re.findall(hang_re.sub(r"\1\1\1", line))
+
+# second pass, on dictionary misses only : the NLTKWordTokenizer rules of nltk.word_tokenize, for a single token.
+# sentence splitting (punkt) never splits a token without whitespace, it is skipped.
+# plain alphanumeric tokens are only split by the contraction rules.
+plain_token_re = re.compile(r"[a-zA-Z0-9_]+")
+# contraction -> length of its first part
+plain_token_splits = {"cannot" : 3, "gimme" : 3, "gonna" : 3, "gotta" : 3, "lemme" : 3, "wanna" : 3}
+
+split_token_rules = [
+    # starting quotes
+    (re.compile(r"([`]+)"), r" \1 "),
+    (re.compile(r"^\""), r"``"),
+    (re.compile(r"(``)"), r" \1 "),
+    (re.compile(r"([ \(\[{<])(\"|\'{2})"), r"\1 `` "),
+    (re.compile(r"(?i)(?<!\w)(\')(?!(?:re|ve|ll|m|t|s|d|n)\b)(?=\w)"), r"\1 "),
+    # punctuation
+    (re.compile(r'([^\.])(\.)([\]\)}>"\' ]*)\s*$'), r"\1 \2 \3 "),
+    (re.compile(r"([:,])([^\d])"), r" \1 \2"),
+    (re.compile(r"([:,])$"), r" \1 "),
+    (re.compile(r"\.{2,}"), r" \g<0> "),
+    (re.compile(r"[;@#$%&]"), r" \g<0> "),
+    (re.compile(r'([^\.])(\.)([\]\)}>"\']*)\s*$'), r"\1 \2\3 "),
+    (re.compile(r"[?!]"), r" \g<0> "),
+    (re.compile(r"([^'])' "), r"\1 ' "),
+    (re.compile(r"[*]"), r" \g<0> "),
+    # parentheses, double dashes
+    (re.compile(r"[\]\[\(\)\{\}\<\>]"), r" \g<0> "),
+    (re.compile(r"--"), r" -- "),
+]
+
+# applied to the token padded with a space on both ends
+split_token_ending_rules = [
+    # ending quotes
+    (re.compile(r"''"), " '' "),
+    (re.compile(r'"'), " '' "),
+    (re.compile(r"\s+"), " "),
+    (re.compile(r"([^' ])('[sS]|'[mM]|'[dD]|') "), r"\1 \2 "),
+    (re.compile(r"([^' ])('ll|'LL|'re|'RE|'ve|'VE|n't|N'T) "), r"\1 \2 "),
+    # contractions
+    (re.compile(r"(?i)\b(can)(not)\b"), r" \1 \2 "),
+    (re.compile(r"(?i)\b(d)('ye)\b"), r" \1 \2 "),
+    (re.compile(r"(?i)\b(gim)(me)\b"), r" \1 \2 "),
+    (re.compile(r"(?i)\b(gon)(na)\b"), r" \1 \2 "),
+    (re.compile(r"(?i)\b(got)(ta)\b"), r" \1 \2 "),
+    (re.compile(r"(?i)\b(lem)(me)\b"), r" \1 \2 "),
+    (re.compile(r"(?i)\b(more)('n)\b"), r" \1 \2 "),
+    (re.compile(r"(?i)\b(wan)(na)(?=\s)"), r" \1 \2 "),
+    (re.compile(r"(?i) ('t)(is)\b"), r" \1 \2 "),
+    (re.compile(r"(?i) ('t)(was)\b"), r" \1 \2 "),
+]
+
+def regex_split_token(token):
+    if (plain_token_re.fullmatch(token)):
+        split = plain_token_splits.get(token.lower())
+        if (split is None):
+            return [token]
+        return [token[:split], token[split:]]
+    for (regexp, substitution) in split_token_rules:
+        token = regexp.sub(substitution, token)
+    token = " " + token + " "
+    for (regexp, substitution) in split_token_ending_rules:
+        token = regexp.sub(substitution, token)
+    return token.split()
 
-else:
+###INLINE START###
 
-    debugw("loading pickled dictionaries")
-    with open('count_1w.pickle', 'rb') as handle:
-        engdict = pickle.load(handle)
-        engdictrev = pickle.load(handle)
-        
+# imported as a module (see dicstrv_bench.py) : the caller loads the modules and dictionaries it needs.
+if (__name__ == "__main__"):
 
+    if (not (0 <= final_pass_codec_id <= frame_codec_max)):
+        print("final pass codec id must be 0 .. " + str(frame_codec_max))
+        sys.exit(1)
 
-ngram_dict = {}
-ngram_dict_rev = {}
+    import_codec_modules()
+    if ((compress or interactive or server) and not huffmann_only):
+        import_tokenizer_modules()
 
-if (not os.path.isfile('ountgrams.pickle')):
+    #opening the english dict of most used 1/3 million words from google corpus of 1 trillion words.
+    #special characters have been added with their respective prevalence (from wikipedia corpus)
+    #contractions also have been added in their form with a quote just after (next line) the form 
+    # without quote. ex : next line after "dont" appears "don't"
 
-    ### populating ngram dict
+    #initializing Python dicts
 
-    filengrams = open('outngrams.bin', 'rt')
-    ngramlines = filengrams.readlines()
+    """
+    count = 1
+    engdict = {}
+    engdictrev = {}
 
-    count = 0
-    # populating dicts
-    for ngramline in ngramlines:
-    # Strips the newline character
-        #keystr = "".join([f"\\x{byte:02x}" for byte in ngramline.strip()])
-        #keystr = keystr.replace("\\","")
-        #if(count == 71374):
-        keystr = ngramline.strip()
-        #print(ngramline.strip())
-        #print(keystr)
-        #quit()
-        ngram_dict_rev[count] = keystr
-        ngram_dict[keystr] = count
-        count += 1
-
-    debugw("pickling ngram dictionaries")
-    with open('outngrams.pickle', 'wb') as handle:
-        pickle.dump(ngram_dict, handle, protocol=pickle.HIGHEST_PROTOCOL)
-        pickle.dump(ngram_dict_rev, handle, protocol=pickle.HIGHEST_PROTOCOL)
-
-else:
-
-    debugw("loading pickled ngram dictionaries")
-    with open('outngrams.pickle', 'rb') as handle:
-        ngram_dict = pickle.load(handle)
-        ngram_dict_rev = pickle.load(handle)
-        
 
+    if (not os.path.isfile('count_1w.pickle')):
 
-idx = 0
-debugw("first ngram in dict:")
-test = ngram_dict_rev[0]
-debugw(test)
-debugw(ngram_dict[test])
-count = 0
-"""
 
-dicts['en'] = load_dicts('en')
-# loads a tuple of (onegrams,fourgrams) for a given language using language id as dictionary key.
-# ex : dicts['<lang_id>'][O-1][key] first index is lang id, second index is 0 or 1, 0 is for onegrams bidict and 1 for fourgrams.
-# last key is an int for onegrams, and a string for fourgrams. for inverse access, use inverse.
-# ex dicts['en'][0][400] -> gets string of onegram at id 400
-# ex dicts['en'][0].inverse['yes'] -> gets id of onegram 'yes'
-# ex dicts['en'][1]['I do not know'] -> gets id of fourgram 'I do not know'
-# ex dicts['en'][0].inverse[400] -> gets string of fourgram at id 400
+        debugw("first load of dic")
+        file1 = open('count_1w.txt', 'r')
+        Lines = file1.readlines()
 
+        # special case : byte val 0 is equal to new line.
+        # TODO : make sure that windows CRLF is taken care of.
+        engdict[0] = "\n"
+        engdictrev["\n"] = 0
 
+        # populating dicts
+        for line in Lines:
+            # Strips the newline character
+            engdict[count] = line.strip()
+            engdictrev[line.strip()] = count
+            count += 1
 
-if (interactive):
+        debugw("pickling dictionaries")
+        with open('count_1w.pickle', 'wb') as handle:
+            pickle.dump(engdict, handle, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(engdictrev, handle, protocol=pickle.HIGHEST_PROTOCOL)
 
-    outfile = ''
-    msg = bytearray()
-    buf = ""
-    stdin_ub = os.fdopen(sys.stdin.fileno(), 'rb', buffering=0)
+    else:
 
-    while(True):
+        debugw("loading pickled dictionaries")
+        with open('count_1w.pickle', 'rb') as handle:
+            engdict = pickle.load(handle)
+            engdictrev = pickle.load(handle)
         
-        time.sleep(0.1)
-        buf = stdin_ub.readline()
-        msg += buf
-        if b'\x07' in buf:
-            #print("compressing message :")
-            msg = msg.replace(b'\x07', b'')
-            #print("replace ok")
-            msgfilename = str(int(round(time.time() * 1000))) + ".msg"
-            #print("generated file name")
-            fhu = open(msgfilename, 'wb')
-            #print("file open for writing")
-            fhu.write(msg)
-            #print("uncompressed msg written to file")
-            fhu.close()
-            #print("file closed")
-            compress_file(msgfilename,outfile)
-            print("\n")
-            msg = bytearray()
-    
 
-if (compress):
-
-    if(batch):
-        inpath = infile
-        out_ext = outfile
-        scan_files(inpath,out_ext)
-    else:
-        compress_file(infile,outfile)
 
-else:
+    ngram_dict = {}
+    ngram_dict_rev = {}
 
-    # decompress mode
-    # decoding part
-    debugw("decoding...")
-    detokenizer = []
-    detokenizer_idx = 0
+    if (not os.path.isfile('ountgrams.pickle')):
 
-    if(len(infile)):
-        with open(infile, 'rb') as fh:
-            compressed0 = bytearray(fh.read())
-            #compressed0bits = bitarray(endian='little')
-            #compressed0bits.frombytes(compressed0)
-            #print(len(compressed0bits))
-            #eof = bitarray('11110110111000',endian='little')
+        ### populating ngram dict
 
-            #eoflist = compressed0bits.search(eof)
-            #print(eoflist)
+        filengrams = open('outngrams.bin', 'rt')
+        ngramlines = filengrams.readlines()
 
-    #First we need to retrieve the preamble/header (separators)
-    #and apply operations in reverse :
-    # 1- huffmann final pass decode
-    # 2- RLE decode
-    # 3- BWT
+        count = 0
+        # populating dicts
+        for ngramline in ngramlines:
+        # Strips the newline character
+            #keystr = "".join([f"\\x{byte:02x}" for byte in ngramline.strip()])
+            #keystr = keystr.replace("\\","")
+            #if(count == 71374):
+            keystr = ngramline.strip()
+            #print(ngramline.strip())
+            #print(keystr)
+            #quit()
+            ngram_dict_rev[count] = keystr
+            ngram_dict[keystr] = count
+            count += 1
 
+        debugw("pickling ngram dictionaries")
+        with open('outngrams.pickle', 'wb') as handle:
+            pickle.dump(ngram_dict, handle, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(ngram_dict_rev, handle, protocol=pickle.HIGHEST_PROTOCOL)
 
-    # checkpoint : printing after attempting BWT,RLE,Huffmann for debugging purposes
-    checkpoint = "".join([f"\\x{byte:02x}" for byte in compressed0])
-    debugw("checkpoint_decompress_after_second pass")
-    debugw(checkpoint)
+    else:
 
-    compressed = Decode_Huffmann_RLE_BWT(compressed0)
+        debugw("loading pickled ngram dictionaries")
+        with open('outngrams.pickle', 'rb') as handle:
+            ngram_dict = pickle.load(handle)
+            ngram_dict_rev = pickle.load(handle)
+        
 
-    # checkpoint : printing after attempting BWT,RLE,Huffmann for debugging purposes
-    checkpoint = "".join([f"\\x{byte:02x}" for byte in compressed])
-    debugw("checkpoint_decompress_after_rle_bwt_huffmann")
-    debugw(checkpoint)
 
     idx = 0
-    #FirstCharOfLine = 1
-    CharIsUpperCase = 1
-    #CharIsUpperCase2 = 0
-    
-    # main decoding loop
-    while (idx < len(compressed)):
-            
-            # write each byte
-            debugw(hex(compressed[idx]))
-
-            #if( (idx > 0) and compressed[idx] == 0 and compressed[idx - 1] == 0):
-            #find len of consecutive 0 chars
-
-            if(idx < len(compressed) -1):
-                if((compressed[idx] == 0) and (compressed[idx+1] != 0)):
-                    #FirstCharOfLine = 1
-                    CharIsUpperCase = 1
-                elif(CharIsUpperCase == 1):
-                    #FirstCharOfLine = 2
-                    CharIsUpperCase = 2
-                        
-            if(len(detokenizer) > 0):
+    debugw("first ngram in dict:")
+    test = ngram_dict_rev[0]
+    debugw(test)
+    debugw(ngram_dict[test])
+    count = 0
+    """
 
+    if (not huffmann_only):
+        dicts['en'] = load_dicts('en')
+    # loads a tuple of (onegrams,fourgrams) for a given language using language id as dictionary key.
+    # ex : dicts['<lang_id>'][O-1][key] first index is lang id, second index is 0 or 1, 0 is for onegrams and 1 for fourgrams.
+    # both are memory-mapped compiled dictionaries.
+    # last key is an int for onegrams, and a packed integer key of the compressed ngram bytes for fourgrams. for inverse access, use inverse.
+    # ex dicts['en'][0][400] -> gets string of onegram at id 400
+    # ex dicts['en'][0].inverse['yes'] -> gets id of onegram 'yes'
+    # ex dicts['en'][1].get(ngram_key(b'\x1e\x03\x1e\x96\x03')) -> gets code of fourgram, None if absent
+    # ex dicts['en'][1].inverse[400] -> gets compressed bytes of fourgram at code 400
 
-                ### VARIOUS DETOKENIZER CLEANUP/FORMATTING OPERATIONS
 
-                #ensure this is not the end of an ngram. ngrams necessarily contain whitespaces
-                if (not re.search(" ",detokenizer[detokenizer_idx-2])):
-                    # English syntactic rules : remove whitespace left of "!?." 
-                    # and enforce capitalization on first non whitespace character following.
-                    if (re.match("[!\?\.]",detokenizer[detokenizer_idx-2]) and detokenizer_idx > 2):
-                        del detokenizer[detokenizer_idx-3]
-                        detokenizer_idx -= 1
-                        if(CharIsUpperCase != 1):
-                            CharIsUpperCase = 2
 
-                    # English syntactic rules : remove whitespace left of ",;:" 
-                    if (re.match("[,;:]",detokenizer[detokenizer_idx-2]) and detokenizer_idx > 2):         
-                        del detokenizer[detokenizer_idx-3]
-                        detokenizer_idx -= 1
+    # startup benchmark probe (see dicstrv_bench.py) : everything a mode needs before reading its input is loaded.
+    if (os.environ.get("DICSTRV_STARTUP_PROBE")):
+        quit()
 
-                    # URL/URI detected, remove any spurious whitespace before "//" 
-                    if (re.match("^\/\/",detokenizer[detokenizer_idx-2]) and detokenizer_idx > 2):         
-                        del detokenizer[detokenizer_idx-3]
-                        detokenizer_idx -= 1
-                    
-                    # E-mail detected, remove whitespaces left and right of "@"
-                    if (re.match("@",detokenizer[detokenizer_idx-2]) and detokenizer_idx > 2):         
-                        del detokenizer[detokenizer_idx-3]
-                        detokenizer_idx -= 1
-                        del detokenizer[detokenizer_idx-1]
-                        detokenizer_idx -= 1
+    if (interactive):
 
-            if(not (compressed[idx] & 128)):
-                
-                # current index byte msb is at 0, 
-                # it is one of the 128 first tokens in the dictionary.
-                debugw("super common word")
-                #decode in place
-                
-                inta = compressed[idx]
-                       
-                if(CharIsUpperCase == 2):
-                    detokenizer.append(dicts['en'][0][inta].capitalize())
-                    detokenizer_idx += 1
-                    CharIsUpperCase = 0
-                else:    
-                    detokenizer.append(dicts['en'][0][inta])
-                    detokenizer_idx += 1
-                  
-                # print to stdout
-                if(CharIsUpperCase != 1):
-                    detokenizer.append(" ")
-                    detokenizer_idx += 1
-
-                debugw(dicts['en'][0][inta])
-                idx += 1
-
-            elif((compressed[idx] & 128) and (not (compressed[idx+1] & 128))):
-    
-                # current index byte msb is at 1, and next byte msb is at 0. 
-                # it is one of the 16384 next tokens in the dictionary.
-                debugw("common word")
-    
-                # populate bitarray from the two bytes
-                c = bitarray(endian='little')
-                c.frombytes(bytes(compressed[idx:idx+2]))
-                debugw(c)
-    
-                # remove first byte msb (shift down the bits above)
-                del c[7]
-                debugw(c)
-
-                # convert bytes array to 16 bit unsigned integer
-                inta = (struct.unpack("<H", c.tobytes()))[0]
-                # add offset back so we get a valid dictionary key
-                inta += 128
-    
-                # print word
-                if(CharIsUpperCase == 2):
-                    detokenizer.append(dicts['en'][0][inta].capitalize())
-                    detokenizer_idx += 1
-                    CharIsUpperCase = 0
-                else:
-                    detokenizer.append(dicts['en'][0][inta])
-                    detokenizer_idx += 1   
+        outfile = ''
+        msg = bytearray()
+        buf = ""
+        stdin_ub = os.fdopen(sys.stdin.fileno(), 'rb', buffering=0)
 
-                if(CharIsUpperCase != 1):
-                    detokenizer.append(" ")
-                    detokenizer_idx += 1 
-                
-                debugw(dicts['en'][0][inta])
-                # increment byte counter with step 2, we processed 2 bytes.
-                idx += 2
+        while(True):
+        
+            time.sleep(0.1)
+            buf = stdin_ub.readline()
+            msg += buf
+            if b'\x07' in buf:
+                #print("compressing message :")
+                msg = msg.replace(b'\x07', b'')
+                #print("replace ok")
+                msgfilename = str(int(round(time.time() * 1000))) + ".msg"
+                #print("generated file name")
+                fhu = open(msgfilename, 'wb')
+                #print("file open for writing")
+                fhu.write(msg)
+                #print("uncompressed msg written to file")
+                fhu.close()
+                #print("file closed")
+                compress_file(msgfilename,outfile)
+                print("\n")
+                msg = bytearray()
     
-            #elif((compressed[idx] & 128) and (compressed[idx+1] & 128)):
-            elif((compressed[idx] & 128) and (compressed[idx+1] & 128) and (not compressed[idx+2] & 128)):
-                
-                # current index byte msb is at 1, and next byte mbs is at 1. 
-                # it is one of the 4194304 next tokens in the dictionary.
-                debugw("rare word")
-                
-                chunk = compressed[idx:idx+3]
-
-                # populate bitarray from the three bytes
-                c = bitarray(endian='little')
-                #c.frombytes(compressed[idx:idx+3])
-                c.frombytes(bytes(chunk))
-                
-                debugw(c)
-
-                # remove second byte msb (shift down the bits above)
-                del c[15]
-                debugw(c)
-
-                # remove first byte msb (shift down the bits above)
-                del c[7]
-                debugw(c)
-
-                c.extend("0000000000") 
-                # pad to 4 bytes (32 bit integer format) : 3 bytes + 10 bits 
-                # because we previously removed two bits with del c[15] and del c[7]
-                debugw(c)
-
-                # convert bytes array to 32 bit unsigned integer
-                inta = (struct.unpack("<L", c.tobytes()))[0]
-
-                if (inta >= 524416):
-                    # this is a ngram.
-                    # remove offset to get into ngram dic code range.
-                    inta -= 524416
-                    debugw("this is an ngram. code:")
-                    debugw(inta)
-                    # process ngram through ngram dictionary
-                    # replace ngram code with corresponding ngram string and add them to the tokenizer
-                    ngram_string = dicts['en'][1].inverse[inta]
-                    debugw("ngram string:")
-                    debugw(ngram_string)
-                    subs = 0
-                    #(ngram_string,subs) = re.subn(r'x',r'\\x',ngram_string)
-                    (ngram_string,subs) = re.subn(r'x',r'',ngram_string)   
-                    debugw("ngram string:")
-                    debugw(ngram_string)
-                    ngram_bytes = bytes.fromhex(ngram_string)
-                    subtokens = decompress_ngram_bytes(ngram_bytes)
-                    #bytes = bytearray(ngram_string,encoding="ascii")
-                    #subtokens.insert(0,"PREFIX")
-                    #subtokens.append("SUFFIX")
-                    
-                    
-                    #subtokens = nltk.word_tokenize(ngram_string)
-                    # We know there shouldn't be any new lines in the subtokens.
-                    # possessives, contractions or punctuation may occur.
-                    # we need to add capitalization rules and spaces after punctuation rules.
-                    # These should be catched by the detokenizer backward processor (detokenizer_idx -2)
-                    # The problem is we append more than one token.
-                    # So we should process rules for first subtoken insertion only.
-                    # The rest should have inline processing (here)
-
-                    if(CharIsUpperCase == 2):
-                        detokenizer.append(subtokens[0].capitalize())
-                        detokenizer_idx += 1
-                        CharIsUpperCase = 0
-                    else:
-                        detokenizer.append(subtokens[0])
-                        detokenizer_idx += 1 
-                    #if(CharIsUpperCase != 1):
-                    #    detokenizer.append(" ") 
-                    #    detokenizer_idx += 1
-
-                    ngram_processed_string = ngram_process_rules(subtokens[1:])
-                    # We shoud take care that the backward detokenizer processor does not mingle
-                    # with the the rest of the ngram string.
-                    # Such a special token will be the only one to have whitespaces in it
-                    # So we can detect it this way
-                    detokenizer.append(ngram_processed_string)
-                    detokenizer_idx += 1
-                                        
-
-                else:
-                    inta += (16384 + 128)
-
-                    if(CharIsUpperCase == 2):
-                        detokenizer.append(dicts['en'][0][inta].capitalize())
-                        detokenizer_idx += 1
-                        CharIsUpperCase = 0
-                    else:
-                        detokenizer.append(dicts['en'][0][inta])
-                        detokenizer_idx += 1 
-                    if(CharIsUpperCase != 1):
-                        detokenizer.append(" ") 
-                        detokenizer_idx += 1
-                    
-                    debugw(dicts['en'][0][inta])
-                    # increment byte counter with step 3, we processed 3 bytes.
-                idx += 3
 
-            #elif((compressed[idx] == 255) and (compressed[idx+1] == 255) and (compressed[idx+2] == 255)):   
-            elif((compressed[idx] & 128) and (compressed[idx+1] & 128) and (compressed[idx+2] & 128)):
-            
-                #check if Huffmann first
-
-                chunk = compressed[idx:idx+3]
-
-                # populate bitarray from the three bytes
-                c = bitarray(endian='little')
-                #c.frombytes(compressed[idx:idx+3])
-                c.frombytes(bytes(chunk))
-                
-                debugw(c)
-
-                # remove third byte msb (shift down the bits above)
-                del c[23]
-                debugw(c)
-
-                # remove second byte msb (shift down the bits above)
-                del c[15]
-                debugw(c)
-
-                # remove first byte msb (shift down the bits above)
-                del c[7]
-                debugw(c)
-
-                c.extend("00000000000") 
-                # pad to 4 bytes (32 bit integer format) : 3 bytes + 8 bits + 3 bits 
-                # because we previously removed three bits with del c[23], del c[15] and del c[7]
-                debugw(c)
-
-                # convert bytes array to 32 bit unsigned integer
-                inta = (struct.unpack("<L", c.tobytes()))[0]
-                inta -= 2097151
-                # if it is a Huffmann select tree code it will be 0 to 4 included
-                # if it is a session DIC it will be shifted in the negatives.
-
-                if (inta in range(0,5)):        
-
-                    # unknown word
-                    # end check if Huffmann first
-                    debugw("unknown word escape sequence detected, code: " + str(inta))
-                    #unknown word escape sequence detected.
-                    if(inta == 0):
-                        char = compressed[idx+3]
-                        stra = ""
-                        idxchar = 0
-                        while(char != 0):
-                            debugw("char=")
-                            debugw(char)
-                            stra += chr(char)
-                            debugw("printing string state=")
-                            debugw(stra)
-                            idxchar += 1
-                            char = compressed[idx+3 + idxchar]
-                        debugw("termination char detected=")
-                        debugw(char)
-                    else:
-                        bstr = bytearray()
-                        idxchar = 0
-                        while(char != 0):
-                            bstr.append(char)
-                            idxchar += 1
-                            char = compressed[idx+3 + idxchar]
-                        debugw("huffmann : termination char detected=")
-                        debugw(char)
-                        stra = decode_unknown(bstr,inta)
-                        #stra = codec.decode(bstr)    
-                    
-                    debugw("we append that unknown word in our session dic at idx: " + str(unknown_token_idx) + " since it may be recalled")
-                    dicts['en'][0].inverse[stra] = unknown_token_idx
-                    dicts['en'][0][unknown_token_idx] = stra
-                    unknown_token_idx += 1
-                    
-                        
-                    if(CharIsUpperCase == 2):
-                        detokenizer.append(stra.capitalize())
-                        detokenizer_idx += 1
-                        CharIsUpperCase = 0
-                    else:
-                        detokenizer.append(stra)
-                        detokenizer_idx += 1 
-                    if(CharIsUpperCase != 1):
-                        detokenizer.append(" ") 
-                        detokenizer_idx += 1
-    
-                    idx += 3 + idxchar
+    if (server):
+        serve(infile)
+        quit()
 
-                else:
+    if (train):
+        train_final_pass(infile, outfile if (len(outfile)) else '.')
+        quit()
 
-                    inta += 2097151
-                    # it is a session DIC, shifting back to 0.
-                    inta += (2097152 + 16384 + 128)
-                    # it is a session DIC, shifting back session dic address space.
+    if (compress):
 
-                    debugw("recalled word:")
-                    
-                    try:
-                        debugw(dicts['en'][0][inta])
-                        # print word
-                    
-                        if(CharIsUpperCase == 2):
-                            detokenizer.append(dicts['en'][0][inta].capitalize())
-                            detokenizer_idx += 1
-                            CharIsUpperCase = 0
-                        else:
-                            detokenizer.append(dicts['en'][0][inta])
-                            detokenizer_idx += 1   
+        if(batch):
+            inpath = infile
+            out_ext = outfile
+            scan_files(inpath,out_ext)
+        elif(stream):
+            compress_stream(infile,outfile)
+        else:
+            compress_file(infile,outfile)
 
-                        if(CharIsUpperCase != 1):
-                            detokenizer.append(" ")
-                            detokenizer_idx += 1 
-                    
-                    except:
-                        debugw("something went wrong, could not find word in session DIC")
-
-                        for sessidx in range(2113664,unknown_token_idx):
-                            debugw("session_index:" + str(sessidx))
-                            debugw(dicts['en'][0][sessidx])
-                            #debugw(engdictrev[engdict[sessidx]])
-                            debugw("session_index:" + str(sessidx))
-                    
-                    idx += 3
-                
-    debugw(detokenizer)
-    if not(len(outfile)):
-        print(''.join(detokenizer))
     else:
-        # write clear text to file if supplied in args
-        with open(outfile, 'w') as fh:
-            fh.write(''.join(detokenizer))
-    
+
+        # decompress mode
+        decompress_file(infile,outfile)
@@ -0,0 +1,1183 @@
+# Benchmarks for dicstrv.py
+# Runs from the directory holding the dictionaries, like dicstrv.py itself.
+
+# python3 dicstrv_bench.py startup [runs]
+# Startup budget per mode : wall time and peak RSS of a dicstrv.py process, measured right before the
+# first input byte is processed (DICSTRV_STARTUP_PROBE makes dicstrv.py quit at that point).
+
+# python3 dicstrv_bench.py encode <txt_corpus> [runs]
+# Token id -> bytes encoding throughput, in tokens/sec, of the legacy bitarray encoder, of encode_token_id and of
+# the bulk encoder encode_token_ids, over the dictionary tokens of a (large) english corpus.
+# All outputs are checked to be identical.
+
+# python3 dicstrv_bench.py tokenize <txt_corpus> [runs]
+# Differential check and tokens/sec of the two tokenizer modes, over the lines of a (large) english corpus :
+# nltk (TweetTokenizer, then nltk.word_tokenize on dictionary misses) vs regex_tokenizer.
+# Lines that do not give the same tokens are printed (up to 20), the exit status is 1 if there is any.
+
+# python3 dicstrv_bench.py unknown <txt_corpus> [cache_size ...]
+# First pass encoding time (compress_tokens) of a corpus for each size of the unknown token cache
+# (resolve_unknown_token), with its hit and miss counts. Size 0 is the uncached baseline.
+# All outputs are checked to be identical.
+
+# python3 dicstrv_bench.py bwt <txt_corpus> [max_bytes]
+# bwt_encode time for inputs of 10 kB up to max_bytes (default 50 MB) made of random lines of a corpus, with the
+# time per byte and per byte and doubling step (n log n). Up to 20 kB, the output is checked against the former
+# suffix array (sort of every suffix slice), which needs O(n^2) memory.
+
+# python3 dicstrv_bench.py ibwt <txt_corpus> [max_bytes]
+# bwt_decode time for inputs of 10 kB up to max_bytes (default 10 MB) made of random lines of a corpus, with the
+# time per byte. Every size is checked to give back its input, up to 100 kB the former LF walk (prepending one byte
+# at a time, O(n^2)) is timed too.
+
+# python3 dicstrv_bench.py rle <txt_corpus> [max_bytes]
+# RLE encode (replace_repeating_chars) and decode (expand_repeating_chars) throughput in MB/s of the BWT output of
+# 100 kB up to max_bytes (default 10 MB) of random lines of a corpus, and of runs of edge case lengths.
+# Both are checked against the former per byte loops, which are timed up to 1 MB and on the edge cases.
+
+# python3 dicstrv_bench.py shift <txt_corpus> [max_bytes]
+# reuse_unused_chars_shiftdown and restore_unused_chars_shiftup time vs bwt_encode time, over 100 kB up to max_bytes
+# (default 10 MB) of the token stream of a corpus, in each absent char case (zero, one or two absent bytes).
+# Every case is checked to give back its input, and up to 1 MB against the former Counter / set / per byte loops.
+
+# python3 dicstrv_bench.py huffman <txt_corpus> [runs]
+# Final huffmann pass decoding throughput, in MB/s of decoded bytes, of HuffmanCodec.decode (dahuffman) and of the
+# table driven huffman_decode, for the final pass codec and the mtf codec, over the compressed token stream of a corpus
+# (best of runs). Both outputs are checked to be identical.
+
+# python3 dicstrv_bench.py hencode <txt_corpus> [runs]
+# Huffmann encoding throughput, in MB/s of input bytes, of HuffmanCodec.encode (dahuffman) and of the bulk encoder
+# huffman_encode : final pass and mtf codecs over the corpus token stream after the BWT and RLE / move-to-front stages,
+# and the -hc codec over the corpus text (best of runs). Both outputs are checked to be identical.
+
+# python3 dicstrv_bench.py blocks <txt_corpus> [block_size ...]
+# Block mode (bwt_block_size) BWT, RLE and huffmann stages over the token stream of a corpus, for each block size
+# (0 is the single block of the default mode) : output size, encode and decode time and peak traced memory.
+# The decoded token stream is checked against the input.
+
+# python3 dicstrv_bench.py mtf <txt_corpus> [txt_corpus ...]
+# Size and time of the BWT, RLE and huffmann stages (default) vs the BWT, move-to-front / zero run and huffmann
+# stages (mtf_stage) over the token stream of each corpus file, with the totals. Both are checked to decode back
+# to the token stream.
+
+# python3 dicstrv_bench.py format <txt_corpus> [txt_corpus ...]
+# Size, encode and decode time of the block formats over the token stream of each corpus file, with the totals :
+# version 1 (absent char shiftdown, BWT eof 255, RLE separator) vs version 2 (primary_index_bwt : BWT primary index,
+# in-band RLE). Both are checked to decode back to the token stream.
+
+# python3 dicstrv_bench.py tables <txt_corpus> [txt_corpus ...]
+# Size and time of the final pass with the final pass codec vs with a table byte (adaptive_tables : the block's own
+# code when its code lengths pay for themselves), over the token stream of each corpus file, with the code chosen and
+# the totals. Both are checked to decode back to the token stream.
+
+# python3 dicstrv_bench.py rans <txt_corpus> [txt_corpus ...]
+# Final stage output size and encode / decode throughput, in MB/s of block bytes (best of 3), of the huffmann pass with
+# huffmann_final_pass.bin, of the per block code tables (encode_block_table), of the order-1 rANS stage (rans_encode)
+# and of the smallest of the three chosen per block (-rans), over the block of the token stream of each corpus file before the final stage, with the totals.
+# Every output is checked to decode back to the block.
+
+# python3 dicstrv_bench.py train <train_folder> <test_folder> [suffix]
+# Final pass output size of the files of test_folder whose name ends with suffix (default '.', as -tf) with
+# huffmann_final_pass.bin vs a codec trained like -tf on the files of train_folder, with the totals. Both are checked
+# to decode back to the token stream. Train and test folders should not share files.
+
+# python3 dicstrv_bench.py jobs <txt_corpus> [jobs ...]
+# Wall time of the streaming compression (-sc) of a corpus and of its decompression (-x) for each number of worker
+# processes (--jobs), with the speedup over 1. The corpus should span many frames (stream_frame_size).
+# Compressed streams and decompressed texts are checked to be identical for every number of workers.
+
+# python3 dicstrv_bench.py decode <txt_corpus> [runs]
+# Token stream -> text decoding time of the legacy byte by byte loop and of decode_token_stream, over the token
+# stream (first and second pass) of a (large) english corpus. Both outputs are checked to be identical.
+# Also the time to the first chunk of text of decode_token_stream_chunks.
+
+import sys
+import os
+import math
+import random
+import re
+import struct
+import time
+import tempfile
+import tracemalloc
+import subprocess
+from bitarray import bitarray
+from collections import Counter
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+dicstrv_path = os.path.join(script_dir, "dicstrv.py")
+
+
+def run_probe(argv):
+
+    # returns (wall time in seconds, peak RSS in kB) of one probed run.
+    env = dict(os.environ)
+    env["DICSTRV_STARTUP_PROBE"] = "1"
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, dicstrv_path] + argv, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    # wait4 gives the resource usage of this child only, getrusage(RUSAGE_CHILDREN) would give the max over all children.
+    (pid, status, rusage) = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    stderr = proc.stderr.read()
+    proc.stderr.close()
+    if (proc.returncode != 0):
+        raise RuntimeError("dicstrv.py " + " ".join(argv) + " failed:\n" + stderr.decode('utf-8', 'replace'))
+    return (wall, rusage.ru_maxrss)
+
+
+def bench_startup(runs):
+
+    # the probe quits before any input is read, but the arguments have to pass the command line checks.
+    with tempfile.TemporaryDirectory() as tmpdir:
+        txt_path = os.path.join(tmpdir, "probe.txt")
+        bin_path = os.path.join(tmpdir, "probe.bin")
+        with open(txt_path, 'w') as fh:
+            fh.write("startup probe\n")
+        with open(bin_path, 'wb') as fh:
+            fh.write(b'\x00')
+
+        modes = [["-c", txt_path, bin_path],
+                 ["-x", bin_path, txt_path + ".out"],
+                 ["-hc", txt_path, bin_path],
+                 ["-bc", tmpdir, "bin"]]
+
+        print("mode   wall min (ms)   wall median (ms)   peak RSS (MB)")
+        for argv in modes:
+            walls = []
+            rss = 0
+            for run in range(0, runs):
+                (wall, maxrss) = run_probe(argv)
+                walls.append(wall)
+                rss = max(rss, maxrss)
+            walls.sort()
+            print(f"{argv[0]:<6} {walls[0] * 1000:>13.1f} {walls[len(walls) // 2] * 1000:>18.1f} {rss / 1024:>15.1f}")
+
+
+def load_dicstrv():
+
+    # dicstrv.py does not run its command line when imported, we load what the benchmarks need.
+    sys.path.insert(0, script_dir)
+    import dicstrv
+    dicstrv.debug_on = False
+    dicstrv.import_codec_modules()
+    dicstrv.import_tokenizer_modules()
+    dicstrv.dicts['en'] = dicstrv.load_dicts('en')
+    return dicstrv
+
+
+def legacy_encode_token_id(subtokenid):
+
+    # token id encoder of compress_token_or_subtoken before encode_token_id, kept as the reference.
+    if(subtokenid < 128):
+        return subtokenid.to_bytes(1, byteorder='little')
+
+    if(128 <= subtokenid < 16384 + 128):
+        c = bitarray(endian='little')
+        c.frombytes((subtokenid - 128).to_bytes(2,byteorder='little'))
+        c.insert(7,1)
+        del c[16:17:1]
+        return c.tobytes()
+
+    if(16384 + 128 <= subtokenid < 2097152 + 16384 + 128):
+        c = bitarray(endian='little')
+        c.frombytes((subtokenid - (16384 + 128)).to_bytes(3,byteorder='little'))
+        c.insert(7,1)
+        c.insert(15,1)
+        del c[24:26:1]
+        return c.tobytes()
+
+    if(16384 + 128 + 2097152 <= subtokenid < 4194304 - 5):
+        c = bitarray(endian='little')
+        c.frombytes((subtokenid - (2097152 + 16384 + 128)).to_bytes(3,byteorder='little'))
+        c.insert(7,1)
+        c.insert(15,1)
+        c.insert(23,1)
+        del c[24:27:1]
+        return c.tobytes()
+
+    # huffmann tree codes
+    c = bitarray(endian='little')
+    c.frombytes(subtokenid.to_bytes(3,byteorder='little'))
+    c.insert(7,1)
+    c.insert(15,1)
+    del c[24:26:1]
+    return c.tobytes()
+
+
+def corpus_token_ids(dicstrv, corpus_path):
+
+    # primary dictionary ids of the corpus tokens, tokenized like compress_lines does. unknown tokens are skipped.
+    ids = []
+    inverse = dicstrv.dicts['en'][0].inverse
+    with open(corpus_path, 'r', encoding='utf-8', errors='ignore') as fh:
+        for line in fh:
+            for token in dicstrv.tknzr.tokenize(line.lower()):
+                try:
+                    ids.append(inverse[token])
+                except KeyError:
+                    pass
+            ids.append(0)
+    return ids
+
+
+def time_encoder(encoder, ids, runs):
+
+    # best of runs, in seconds
+    best = None
+    for run in range(0, runs):
+        compressed = bytearray()
+        start = time.perf_counter()
+        for tokenid in ids:
+            compressed.extend(encoder(tokenid))
+        elapsed = time.perf_counter() - start
+        if ((best is None) or (elapsed < best)):
+            best = elapsed
+    return (best, compressed)
+
+
+def bench_encode(corpus_path, runs):
+
+    dicstrv = load_dicstrv()
+    ids = corpus_token_ids(dicstrv, corpus_path)
+    # boundaries of every tier, session ids and huffmann tree codes
+    edge_ids = [0, 127, 128, 16511, 16512, 2113663, 2113664, 4194298] + list(range(4194299, 4194304))
+    for tokenid in edge_ids:
+        if (legacy_encode_token_id(tokenid) != dicstrv.encode_token_id(tokenid)):
+            raise RuntimeError("encoding mismatch for token id " + str(tokenid))
+
+    (legacy_time, legacy_out) = time_encoder(legacy_encode_token_id, ids, runs)
+    (table_time, table_out) = time_encoder(dicstrv.encode_token_id, ids, runs)
+    if (legacy_out != table_out):
+        raise RuntimeError("encoded streams differ")
+
+    bulk_time = None
+    for run in range(0, runs):
+        start = time.perf_counter()
+        bulk_out = dicstrv.encode_token_ids(ids, {})
+        elapsed = time.perf_counter() - start
+        if ((bulk_time is None) or (elapsed < bulk_time)):
+            bulk_time = elapsed
+    if (bulk_out != table_out):
+        raise RuntimeError("bulk encoded stream differs")
+
+    print("tokens: " + str(len(ids)) + ", encoded bytes: " + str(len(table_out)))
+    print(f"legacy bitarray encoder : {len(ids) / legacy_time:>12.0f} tokens/sec")
+    print(f"encode_token_id         : {len(ids) / table_time:>12.0f} tokens/sec")
+    print(f"encode_token_ids (bulk) : {len(ids) / bulk_time:>12.0f} tokens/sec")
+
+
+def tokenize_lines(lines, tokenize_line, split_token, inverse):
+
+    # two stage tokenization of compress_lines and compress_token_or_subtoken
+    result = []
+    for line in lines:
+        line_tokens = []
+        for token in tokenize_line(line):
+            if (token in inverse):
+                line_tokens.append(token)
+            else:
+                line_tokens.extend(split_token(token))
+        result.append(line_tokens)
+    return result
+
+
+def bench_tokenize(corpus_path, runs):
+
+    dicstrv = load_dicstrv()
+    inverse = dicstrv.dicts['en'][0].inverse
+    with open(corpus_path, 'r', encoding='utf-8', errors='ignore') as fh:
+        lines = fh.read().encode('ascii', 'ignore').decode('ascii').lower().splitlines()
+
+    modes = [("nltk", dicstrv.tknzr.tokenize, dicstrv.word_tokenize),
+             ("regex_tokenizer", dicstrv.regex_tokenize_line, dicstrv.regex_split_token)]
+    timings = {}
+    outputs = {}
+    for (name, tokenize_line, split_token) in modes:
+        for run in range(0, runs):
+            start = time.perf_counter()
+            outputs[name] = tokenize_lines(lines, tokenize_line, split_token, inverse)
+            elapsed = time.perf_counter() - start
+            if ((name not in timings) or (elapsed < timings[name])):
+                timings[name] = elapsed
+
+    mismatches = 0
+    for (line, expected, tokens) in zip(lines, outputs["nltk"], outputs["regex_tokenizer"]):
+        if (expected != tokens):
+            mismatches += 1
+            if (mismatches <= 20):
+                print("line:   " + repr(line))
+                print("nltk:   " + repr(expected))
+                print("regex:  " + repr(tokens))
+
+    token_count = sum(len(tokens) for tokens in outputs["nltk"])
+    print("lines: " + str(len(lines)) + ", tokens: " + str(token_count) + ", mismatching lines: " + str(mismatches))
+    for (name, tokenize_line, split_token) in modes:
+        print(f"{name:<16}: {token_count / timings[name]:>12.0f} tokens/sec")
+    return mismatches
+
+
+def legacy_bwt_encode(t, eof):
+
+    # bwt_encode before the prefix doubling suffix array
+    satups = sorted([(t[i:], i) for i in range(0, len(t)+1)])
+    bw = bytearray()
+    for (suffix, si) in satups:
+        if si == 0:
+            bw.extend(eof)
+        else:
+            bw.append(t[si-1])
+    return bw
+
+
+def bench_bwt(corpus_path, max_bytes):
+
+    dicstrv = load_dicstrv()
+    with open(corpus_path, 'rb') as fh:
+        lines = fh.read().splitlines(keepends=True)
+    eof = bytearray(b'\xFF')
+
+    random.seed(0)
+    data = bytearray()
+    sizes = [size for size in (10000, 20000, 100000, 1000000, 10000000, 50000000) if (size <= max_bytes)]
+    for size in sizes:
+        while (len(data) < size):
+            data.extend(random.choice(lines))
+        t = data[:size]
+        start = time.perf_counter()
+        bw = dicstrv.bwt_encode(t, eof)
+        elapsed = time.perf_counter() - start
+        checked = ""
+        if (size <= 20000):
+            if (bw != legacy_bwt_encode(t, eof)):
+                raise RuntimeError("bwt output differs from the legacy suffix array at size " + str(size))
+            checked = ", same as legacy"
+        print(f"{size:>10} bytes: {elapsed * 1000:>10.1f} ms {elapsed / size * 1e9:>8.1f} ns/byte "
+              f"{elapsed / (size * math.log2(size)) * 1e9:>6.2f} ns/(byte.log2 n){checked}")
+
+
+def legacy_bwt_decode(bw, eof):
+
+    # bwt_decode before the LF mapping array
+    tots = dict()
+    ranks = []
+    for c in bw:
+        if c not in tots:
+            tots[c] = 0
+        ranks.append(tots[c])
+        tots[c] += 1
+    first = {}
+    totc = 0
+    for c, count in sorted(tots.items()):
+        first[c] = (totc, totc + count)
+        totc += count
+
+    rowi = 0
+    t = bytearray()
+    t.extend(eof)
+    while (bw[rowi] != eof[0]):
+        c = bw[rowi]
+        t[:0] = bytearray(c.to_bytes(1, 'little'))
+        rowi = first[c][0] + ranks[rowi] + 1
+    del(t[-len(eof):])
+    return t
+
+
+def bench_ibwt(corpus_path, max_bytes):
+
+    dicstrv = load_dicstrv()
+    with open(corpus_path, 'rb') as fh:
+        lines = fh.read().splitlines(keepends=True)
+    eof = bytearray(b'\xFF')
+
+    random.seed(0)
+    data = bytearray()
+    sizes = [size for size in (10000, 100000, 1000000, 3000000, 10000000) if (size <= max_bytes)]
+    for size in sizes:
+        while (len(data) < size):
+            data.extend(random.choice(lines))
+        t = data[:size]
+        bw = dicstrv.bwt_encode(t, eof)
+        start = time.perf_counter()
+        decoded = dicstrv.bwt_decode(bw, eof)
+        elapsed = time.perf_counter() - start
+        if (decoded != t):
+            raise RuntimeError("bwt_decode does not give back the input at size " + str(size))
+        legacy = ""
+        if (size <= 100000):
+            start = time.perf_counter()
+            legacy_bwt_decode(bw, eof)
+            legacy = f", legacy {(time.perf_counter() - start) * 1000:.1f} ms"
+        print(f"{size:>10} bytes: {elapsed * 1000:>10.1f} ms {elapsed / size * 1e9:>8.1f} ns/byte{legacy}")
+
+
+def legacy_decode_token_stream(dicstrv, compressed):
+
+    # main decoding loop of decompress_bytes before decode_token_stream, without its debug output, kept as the
+    # reference. the termination char of unknown words is skipped, as decode_token_stream does.
+    dicts = dicstrv.dicts
+    session = dicstrv.SessionWords()
+    detokenizer = []
+    detokenizer_idx = 0
+    idx = 0
+    CharIsUpperCase = 1
+
+    while (idx < len(compressed)):
+
+            if(idx < len(compressed) -1):
+                if((compressed[idx] == 0) and (compressed[idx+1] != 0)):
+                    CharIsUpperCase = 1
+                elif(CharIsUpperCase == 1):
+                    CharIsUpperCase = 2
+
+            if(len(detokenizer) > 0):
+                if (not re.search(" ",detokenizer[detokenizer_idx-2])):
+                    if (re.match("[!\?\.]",detokenizer[detokenizer_idx-2]) and detokenizer_idx > 2):
+                        del detokenizer[detokenizer_idx-3]
+                        detokenizer_idx -= 1
+                        if(CharIsUpperCase != 1):
+                            CharIsUpperCase = 2
+                    if (re.match("[,;:]",detokenizer[detokenizer_idx-2]) and detokenizer_idx > 2):
+                        del detokenizer[detokenizer_idx-3]
+                        detokenizer_idx -= 1
+                    if (re.match("^\/\/",detokenizer[detokenizer_idx-2]) and detokenizer_idx > 2):
+                        del detokenizer[detokenizer_idx-3]
+                        detokenizer_idx -= 1
+                    if (re.match("@",detokenizer[detokenizer_idx-2]) and detokenizer_idx > 2):
+                        del detokenizer[detokenizer_idx-3]
+                        detokenizer_idx -= 1
+                        del detokenizer[detokenizer_idx-1]
+                        detokenizer_idx -= 1
+
+            word = None
+            if(not (compressed[idx] & 128)):
+                word = dicts['en'][0][compressed[idx]]
+                idx += 1
+
+            elif((compressed[idx] & 128) and (not (compressed[idx+1] & 128))):
+                c = bitarray(endian='little')
+                c.frombytes(bytes(compressed[idx:idx+2]))
+                del c[7]
+                inta = (struct.unpack("<H", c.tobytes()))[0] + 128
+                word = dicts['en'][0][inta]
+                idx += 2
+
+            elif((compressed[idx] & 128) and (compressed[idx+1] & 128) and (not compressed[idx+2] & 128)):
+                c = bitarray(endian='little')
+                c.frombytes(bytes(compressed[idx:idx+3]))
+                del c[15]
+                del c[7]
+                c.extend("0000000000")
+                inta = (struct.unpack("<L", c.tobytes()))[0]
+                if (inta >= 524416):
+                    subtokens = dicstrv.decompress_ngram_bytes(dicts['en'][1].inverse[inta - 524416])
+                    if(CharIsUpperCase == 2):
+                        detokenizer.append(subtokens[0].capitalize())
+                        detokenizer_idx += 1
+                        CharIsUpperCase = 0
+                    else:
+                        detokenizer.append(subtokens[0])
+                        detokenizer_idx += 1
+                    detokenizer.append(dicstrv.ngram_process_rules(subtokens[1:]))
+                    detokenizer_idx += 1
+                else:
+                    word = dicts['en'][0][inta + 16384 + 128]
+                idx += 3
+
+            else:
+                c = bitarray(endian='little')
+                c.frombytes(bytes(compressed[idx:idx+3]))
+                del c[23]
+                del c[15]
+                del c[7]
+                c.extend("00000000000")
+                inta = (struct.unpack("<L", c.tobytes()))[0] - 2097151
+                if (inta == 0):
+                    idxchar = 0
+                    stra = ""
+                    char = compressed[idx+3]
+                    while(char != 0):
+                        stra += chr(char)
+                        idxchar += 1
+                        char = compressed[idx+3 + idxchar]
+                    session.add(stra)
+                    word = stra
+                    idx += 4 + idxchar
+                else:
+                    word = session[inta + 2097151 + 2097152 + 16384 + 128]
+                    idx += 3
+
+            if (word is not None):
+                if(CharIsUpperCase == 2):
+                    detokenizer.append(word.capitalize())
+                    detokenizer_idx += 1
+                    CharIsUpperCase = 0
+                else:
+                    detokenizer.append(word)
+                    detokenizer_idx += 1
+                if(CharIsUpperCase != 1):
+                    detokenizer.append(" ")
+                    detokenizer_idx += 1
+
+    return ''.join(detokenizer)
+
+
+def corpus_token_stream(dicstrv, corpus_path):
+
+    # token stream of the corpus, as compress_lines builds it before the BWT, RLE and huffmann stages.
+    with open(corpus_path, 'r', encoding='utf-8', errors='ignore') as fh:
+        tokens = [dicstrv.tokenize_line(line.lower()) for line in fh.read().splitlines()]
+    return dicstrv.compress_token_passes(tokens)
+
+
+def bench_unknown(corpus_path, cache_sizes):
+
+    dicstrv = load_dicstrv()
+    with open(corpus_path, 'r', encoding='utf-8', errors='ignore') as fh:
+        tokens = [dicstrv.tokenize_line(line.lower()) for line in fh.read().splitlines()]
+
+    cache = dicstrv.resolve_unknown_token.cache
+    reference = None
+    for cache_size in cache_sizes:
+        # each run is a fresh stream with a cold cache
+        dicstrv.subtoken_cache_size = cache_size
+        cache.clear()
+        dicstrv.resolve_unknown_token.hits = 0
+        dicstrv.resolve_unknown_token.misses = 0
+        start = time.perf_counter()
+        compressed = dicstrv.compress_tokens(tokens, False)
+        elapsed = time.perf_counter() - start
+        if (reference is None):
+            reference = compressed
+        elif (compressed != reference):
+            raise RuntimeError("first pass output differs for cache size " + str(cache_size))
+        hits = dicstrv.resolve_unknown_token.hits
+        misses = dicstrv.resolve_unknown_token.misses
+        print(f"cache size {cache_size:>8}: {elapsed * 1000:>10.1f} ms, hits {hits:>8}, misses {misses:>8}, "
+              f"hit rate {hits / max(hits + misses, 1) * 100:>5.1f} %")
+
+
+def legacy_replace_repeating_chars(byte_array, n, separator):
+
+    # replace_repeating_chars before numpy
+    def run_bytes(current_char, count):
+        encoded_value = bytearray()
+        while (count > 0xFFFFFF):
+            encoded_value.extend(run_bytes(current_char, 0xFFFFFF))
+            count -= 0xFFFFFF
+        encoded_value.append(current_char)
+        encoded_value.append(separator)
+        if (count < 255):
+            encoded_value.append(count)
+        elif ((count < 65535) and ((count & 0xFF) != 0xFF)):
+            encoded_value.append(255)
+            encoded_value.extend(count.to_bytes(2, 'little'))
+        else:
+            encoded_value.extend(b'\xFF\xFF')
+            encoded_value.extend(count.to_bytes(3, 'little'))
+        return encoded_value
+
+    result_array = bytearray()
+    current_char = byte_array[0]
+    current_start = 0
+    count = 1
+    for i in range(1, len(byte_array)):
+        if byte_array[i] == current_char:
+            count += 1
+        else:
+            if count >= n:
+                result_array.extend(run_bytes(current_char, count))
+            else:
+                result_array.extend(byte_array[current_start:i])
+            current_char = byte_array[i]
+            current_start = i
+            count = 1
+    if count >= n:
+        result_array.extend(run_bytes(current_char, count))
+    else:
+        result_array.extend(byte_array[current_start:])
+    return result_array
+
+
+def legacy_expand_repeating_chars(compressed, rle_sep):
+
+    # RLE loop of Decode_Huffmann_RLE_BWT before numpy, without its debug output
+    compressed_new = bytearray()
+    jump = 0
+    for idx in range(0, len(compressed)):
+        idx += jump
+        if (idx >= len(compressed)):
+            break
+        if (compressed[idx] == rle_sep):
+            rep_char = compressed[idx-1]
+            if (int.from_bytes(compressed[idx+1:idx+1+2], 'little') == 65535):
+                rep_num = int.from_bytes(compressed[idx+1+2:idx+1+5], 'little')
+                jump += 5
+            elif (compressed[idx+1] == 255):
+                rep_num = int.from_bytes(compressed[idx+1+1:idx+1+3], 'little')
+                jump += 3
+            else:
+                rep_num = compressed[idx+1]
+                jump += 1
+            compressed_new.extend(bytearray(rep_char.to_bytes(1, 'little')) * (rep_num - 1))
+        else:
+            compressed_new.append(compressed[idx])
+    return compressed_new
+
+
+def bench_rle(corpus_path, max_bytes):
+
+    dicstrv = load_dicstrv()
+    with open(corpus_path, 'rb') as fh:
+        lines = fh.read().splitlines(keepends=True)
+    separator = 254
+
+    # edge cases : counts on one, two and three bytes, low byte 255, counts equal to the separator, very long runs
+    random.seed(0)
+    edge = bytearray()
+    for length in (3, 4, 5, 254, 255, 256, 511, separator, 256 + separator, 65534, 65535, 65536, 70000, 0x1000005):
+        edge.extend(bytes([random.randrange(0, 200)]) * length)
+        edge.extend(bytes([random.randrange(0, 200) for idx in range(0, 5)]))
+    samples = [("edge cases", edge, True)]
+
+    data = bytearray()
+    for size in (100000, 1000000, 10000000):
+        if (size > max_bytes):
+            break
+        while (len(data) < size):
+            data.extend(random.choice(lines))
+        samples.append((str(size) + " bytes", dicstrv.bwt_encode(data[:size], bytearray(b'\xFF')), size <= 1000000))
+
+    print(f"{'input':<16} {'rle bytes':>10} {'encode MB/s':>12} {'decode MB/s':>12} {'legacy enc':>11} {'legacy dec':>11}")
+    for (name, bw, check_legacy) in samples:
+        start = time.perf_counter()
+        encoded = dicstrv.replace_repeating_chars(bw, dicstrv.rle_min_run, separator)
+        encode_time = time.perf_counter() - start
+        start = time.perf_counter()
+        decoded = dicstrv.expand_repeating_chars(encoded, separator)
+        decode_time = time.perf_counter() - start
+        if (decoded != bw):
+            raise RuntimeError(name + ": RLE does not decode back to its input")
+        legacy = ""
+        if (check_legacy):
+            start = time.perf_counter()
+            legacy_encoded = legacy_replace_repeating_chars(bw, dicstrv.rle_min_run, separator)
+            legacy_encode_time = time.perf_counter() - start
+            start = time.perf_counter()
+            legacy_decoded = legacy_expand_repeating_chars(encoded, separator)
+            legacy_decode_time = time.perf_counter() - start
+            if ((legacy_encoded != encoded) or (legacy_decoded != bw)):
+                raise RuntimeError(name + ": RLE differs from the legacy loops")
+            legacy = f" {len(bw) / legacy_encode_time / 1e6:>11.2f} {len(bw) / legacy_decode_time / 1e6:>11.2f}"
+        print(f"{name:<16} {len(encoded):>10} {len(bw) / encode_time / 1e6:>12.1f} {len(bw) / decode_time / 1e6:>12.1f}{legacy}")
+
+
+def legacy_find_absent_sequences(byte_array, n, forbidden_char=-1, no_overlap=False):
+
+    # find_absent_sequences before numpy (set of present pairs, list of candidates), without its debug output
+    present_sequences = set()
+    for i in range(len(byte_array) - 1):
+        present_sequences.add((byte_array[i], byte_array[i + 1]))
+    absent_sequences = []
+    prevseq = ()
+    for high in range(253, 0, -1):
+        for low in range(253, 0, -1):
+            if ((high == low) or (high == forbidden_char) or (low == forbidden_char)):
+                continue
+            if ((high, low) in present_sequences):
+                continue
+            if (no_overlap and ((high in prevseq) or (low in prevseq))):
+                continue
+            absent_sequences.append(bytearray((high, low)))
+            prevseq = (high, low)
+            if (len(absent_sequences) >= n):
+                return absent_sequences
+    return absent_sequences
+
+
+def legacy_reuse_unused_chars_shiftdown(compressed):
+
+    # reuse_unused_chars_shiftdown before numpy (Counter and per byte loops), without its debug output
+    frequency_dic = dict(Counter(compressed))
+    abs_chars = [charval for charval in range(255, 0, -1) if charval not in frequency_dic][0:2]
+    if (abs_chars == [255, 254]):
+        return ([254, 255], compressed)
+    compressed_new = bytearray()
+    if (len(abs_chars) == 2):
+        for byte in compressed:
+            compressed_new.append(byte - 1 if (byte > abs_chars[1]) else byte)
+        return ([abs_chars[0] - 1, abs_chars[1]], compressed_new)
+    single_absent = ((len(abs_chars) == 1) and (abs_chars[0] != 255))
+    if (single_absent):
+        escapes = [legacy_find_absent_sequences(compressed, 1, abs_chars[0])[0], bytearray([abs_chars[0]])]
+    else:
+        escapes = legacy_find_absent_sequences(compressed, 2, -1, True)
+    for byte in compressed:
+        if (byte == 255):
+            compressed_new.extend(escapes[0])
+        elif (byte == 254):
+            compressed_new.extend(escapes[1])
+        else:
+            compressed_new.append(byte)
+    if (single_absent):
+        return ([escapes[0], abs_chars[0]], compressed_new)
+    return (escapes, compressed_new)
+
+
+def bench_shift(corpus_path, max_bytes):
+
+    dicstrv = load_dicstrv()
+    stream = corpus_token_stream(dicstrv, corpus_path)
+    if (len(stream) == 0):
+        raise RuntimeError("empty token stream")
+
+    # every absent char case of reuse_unused_chars_shiftdown : the absent bytes (in 1..255) are removed from the
+    # stream and every other byte is appended once.
+    cases = [("zero absent", ()), ("one absent", (200,)), ("only 255 absent", (255,)), ("two absent", (200, 100)),
+             ("255 254 absent", (255, 254))]
+
+    print(f"{'input':<16} {'case':<16} {'bytes out':>10} {'shiftdown ms':>13} {'shiftup ms':>11} {'bwt ms':>9} "
+          f"{'legacy down ms':>15}")
+    size = 100000
+    while (size <= max_bytes):
+        data = bytearray()
+        while (len(data) < size):
+            data.extend(stream)
+        data = bytes(data[:size])
+        for (case, absent) in cases:
+            sample = bytearray(data.translate(None, bytes(absent)) + bytes(set(range(1, 256)) - set(absent)))
+            start = time.perf_counter()
+            (absent_chars, shifted) = dicstrv.reuse_unused_chars_shiftdown(bytearray(sample))
+            down_time = time.perf_counter() - start
+            start = time.perf_counter()
+            restored = dicstrv.restore_unused_chars_shiftup(absent_chars, bytearray(shifted))
+            up_time = time.perf_counter() - start
+            if ((restored != sample) or (255 in shifted)):
+                raise RuntimeError(case + ": shiftdown / shiftup does not give back its input")
+            start = time.perf_counter()
+            dicstrv.bwt_encode(shifted, bytearray(b'\xFF'))
+            bwt_time = time.perf_counter() - start
+            legacy = ""
+            if (size <= 1000000):
+                start = time.perf_counter()
+                if (legacy_reuse_unused_chars_shiftdown(bytearray(sample)) != (absent_chars, shifted)):
+                    raise RuntimeError(case + ": shiftdown differs from the legacy loops")
+                legacy = f" {(time.perf_counter() - start) * 1000:>15.1f}"
+            print(f"{str(size) + ' bytes':<16} {case:<16} {len(shifted):>10} {down_time * 1000:>13.2f} "
+                  f"{up_time * 1000:>11.2f} {bwt_time * 1000:>9.1f}{legacy}")
+        size *= 10
+
+
+def bench_huffman(corpus_path, runs):
+
+    dicstrv = load_dicstrv()
+    compressed = corpus_token_stream(dicstrv, corpus_path)
+    print(f"{'codec':<12} {'input bytes':>12} {'output bytes':>13} {'dahuffman MB/s':>15} {'table MB/s':>11} {'speedup':>8}")
+    for (name, codec, mtf) in (("final pass", dicstrv.load_final_pass_codec(), False),
+                               ("mtf", dicstrv.load_mtf_codec(), True)):
+        encoded = bytes(dicstrv.compress_block(bytearray(compressed), mtf))
+        timings = {}
+        outputs = {}
+        for (decoder_name, decoder) in (("dahuffman", codec.decode),
+                                        ("table", lambda data: dicstrv.huffman_decode(codec, data))):
+            best = None
+            for run in range(0, runs):
+                start = time.perf_counter()
+                outputs[decoder_name] = bytes(decoder(encoded))
+                elapsed = time.perf_counter() - start
+                best = elapsed if (best is None) else min(best, elapsed)
+            timings[decoder_name] = best
+        if (outputs["table"] != outputs["dahuffman"]):
+            raise RuntimeError(name + ": huffman_decode differs from HuffmanCodec.decode")
+        size = len(outputs["table"])
+        print(f"{name:<12} {len(encoded):>12} {size:>13} {size / timings['dahuffman'] / 1e6:>15.2f} "
+              f"{size / timings['table'] / 1e6:>11.2f} {timings['dahuffman'] / timings['table']:>7.1f}x")
+
+
+def bench_hencode(corpus_path, runs):
+
+    dicstrv = load_dicstrv()
+    with open(corpus_path, 'r', encoding='utf-8', errors='ignore') as fh:
+        text = fh.read().encode('ascii', 'ignore').decode('ascii')
+    compressed = corpus_token_stream(dicstrv, corpus_path)
+    (bw, primary) = dicstrv.bwt_encode_primary(compressed)
+    (run, block) = dicstrv.choose_inband_run(bw, dicstrv.load_final_pass_codec())
+
+    # inputs of the final pass (the block of compress_block before huffmann) and of -hc (the text)
+    samples = [("final pass", dicstrv.load_final_pass_codec(), bytes(block)),
+               ("mtf", dicstrv.load_mtf_codec(), bytes(dicstrv.mtf_encode(bw))),
+               ("-hc", dicstrv.get_codec('all_whitespace'), text)]
+    print(f"{'codec':<12} {'input bytes':>12} {'output bytes':>13} {'dahuffman MB/s':>15} {'bulk MB/s':>10} {'speedup':>8}")
+    for (name, codec, data) in samples:
+        timings = {}
+        outputs = {}
+        for (encoder_name, encoder) in (("dahuffman", codec.encode),
+                                        ("bulk", lambda data: dicstrv.huffman_encode(codec, data))):
+            best = None
+            for idx in range(0, runs):
+                start = time.perf_counter()
+                outputs[encoder_name] = encoder(data)
+                elapsed = time.perf_counter() - start
+                best = elapsed if (best is None) else min(best, elapsed)
+            timings[encoder_name] = best
+        if (outputs["bulk"] != outputs["dahuffman"]):
+            raise RuntimeError(name + ": huffman_encode differs from HuffmanCodec.encode")
+        print(f"{name:<12} {len(data):>12} {len(outputs['bulk']):>13} {len(data) / timings['dahuffman'] / 1e6:>15.2f} "
+              f"{len(data) / timings['bulk'] / 1e6:>10.2f} {timings['dahuffman'] / timings['bulk']:>7.1f}x")
+
+
+def bench_blocks(corpus_path, block_sizes):
+
+    dicstrv = load_dicstrv()
+    compressed = corpus_token_stream(dicstrv, corpus_path)
+    print("token stream: " + str(len(compressed)) + " bytes")
+
+    for block_size in block_sizes:
+        dicstrv.bwt_block_size = block_size
+        tracemalloc.start()
+        start = time.perf_counter()
+        if (block_size):
+            payload = dicstrv.compress_token_blocks(compressed)
+            flags = dicstrv.frame_flag_blocks
+        else:
+            payload = dicstrv.compress_block(bytearray(compressed))
+            flags = 0
+        encode_time = time.perf_counter() - start
+        encode_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        decoded = dicstrv.decode_frame_stages(bytearray(payload), flags)
+        decode_time = time.perf_counter() - start
+        decode_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        if (bytes(decoded) != bytes(compressed)):
+            raise RuntimeError("block size " + str(block_size) + " does not give back the token stream")
+        name = str(block_size) if block_size else "single"
+        print(f"{name:>8}: {len(payload):>10} bytes, encode {encode_time * 1000:>8.1f} ms peak {encode_peak / 1e6:>7.1f} MB, "
+              f"decode {decode_time * 1000:>8.1f} ms peak {decode_peak / 1e6:>7.1f} MB")
+
+
+def bench_mtf(corpus_paths):
+
+    dicstrv = load_dicstrv()
+    totals = [0, 0, 0, 0.0, 0.0]
+    print(f"{'file':<30} {'tokens':>10} {'rle':>10} {'mtf':>10} {'gain':>7} {'rle ms':>9} {'mtf ms':>9}")
+    for corpus_path in corpus_paths:
+        compressed = corpus_token_stream(dicstrv, corpus_path)
+        sizes = []
+        timings = []
+        for mtf in (False, True):
+            start = time.perf_counter()
+            encoded = dicstrv.compress_block(bytearray(compressed), mtf)
+            timings.append(time.perf_counter() - start)
+            sizes.append(len(encoded))
+            flags = dicstrv.frame_flag_mtf if (mtf) else 0
+            if (bytes(dicstrv.decode_stream_stages(bytearray(encoded), flags)) != bytes(compressed)):
+                raise RuntimeError(corpus_path + " does not decode back to its token stream, mtf_stage " + str(mtf))
+        for (idx, value) in enumerate([len(compressed)] + sizes + timings):
+            totals[idx] += value
+        print(f"{os.path.basename(corpus_path)[-30:]:<30} {len(compressed):>10} {sizes[0]:>10} {sizes[1]:>10} "
+              f"{(1 - sizes[1] / sizes[0]) * 100:>6.1f}% {timings[0] * 1000:>9.1f} {timings[1] * 1000:>9.1f}")
+    if (len(corpus_paths) > 1):
+        print(f"{'total':<30} {totals[0]:>10} {totals[1]:>10} {totals[2]:>10} "
+              f"{(1 - totals[2] / totals[1]) * 100:>6.1f}% {totals[3] * 1000:>9.1f} {totals[4] * 1000:>9.1f}")
+
+
+def bench_format(corpus_paths):
+
+    dicstrv = load_dicstrv()
+    totals = [0, 0, 0, 0.0, 0.0, 0.0, 0.0]
+    print(f"{'file':<30} {'tokens':>10} {'v1':>10} {'v2':>10} {'gain':>7} {'v1 enc ms':>10} {'v2 enc ms':>10} "
+          f"{'v1 dec ms':>10} {'v2 dec ms':>10}")
+    for corpus_path in corpus_paths:
+        compressed = corpus_token_stream(dicstrv, corpus_path)
+        sizes = []
+        encode_timings = []
+        decode_timings = []
+        for primary_index_bwt in (False, True):
+            dicstrv.primary_index_bwt = primary_index_bwt
+            start = time.perf_counter()
+            encoded = dicstrv.compress_block(bytearray(compressed))
+            encode_timings.append(time.perf_counter() - start)
+            sizes.append(len(encoded))
+            start = time.perf_counter()
+            decoded = dicstrv.decode_stream_stages(bytearray(encoded))
+            decode_timings.append(time.perf_counter() - start)
+            if (bytes(decoded) != bytes(compressed)):
+                raise RuntimeError(corpus_path + " does not decode back to its token stream, primary_index_bwt "
+                                   + str(primary_index_bwt))
+        for (idx, value) in enumerate([len(compressed)] + sizes + encode_timings + decode_timings):
+            totals[idx] += value
+        print(f"{os.path.basename(corpus_path)[-30:]:<30} {len(compressed):>10} {sizes[0]:>10} {sizes[1]:>10} "
+              f"{(1 - sizes[1] / sizes[0]) * 100:>6.1f}% {encode_timings[0] * 1000:>10.1f} "
+              f"{encode_timings[1] * 1000:>10.1f} {decode_timings[0] * 1000:>10.1f} {decode_timings[1] * 1000:>10.1f}")
+    if (len(corpus_paths) > 1):
+        print(f"{'total':<30} {totals[0]:>10} {totals[1]:>10} {totals[2]:>10} "
+              f"{(1 - totals[2] / totals[1]) * 100:>6.1f}% {totals[3] * 1000:>10.1f} {totals[4] * 1000:>10.1f} "
+              f"{totals[5] * 1000:>10.1f} {totals[6] * 1000:>10.1f}")
+
+
+def bench_train(train_path, test_path, suffix):
+
+    # the trained codec stays in memory, under the last codec id
+    dicstrv = load_dicstrv()
+    start = time.perf_counter()
+    frequencies = Counter()
+    for file_path in dicstrv.corpus_files(train_path, suffix):
+        frequencies.update(dicstrv.final_pass_frequencies(file_path))
+    codec_id = dicstrv.frame_codec_max
+    dicstrv.load_final_pass_codec.codecs[codec_id] = dicstrv.final_pass_codec_from_frequencies(frequencies)
+    print("training: " + str(sum(frequencies.values())) + " block bytes, " + format(time.perf_counter() - start, ".2f") + " s")
+
+    totals = [0, 0, 0]
+    print(f"{'file':<30} {'tokens':>10} {'codec 0':>10} {'trained':>10} {'gain':>7}")
+    for file_path in dicstrv.corpus_files(test_path, suffix):
+        compressed = corpus_token_stream(dicstrv, file_path)
+        sizes = []
+        for final_pass_codec_id in (0, codec_id):
+            dicstrv.final_pass_codec_id = final_pass_codec_id
+            encoded = dicstrv.compress_block(bytearray(compressed))
+            sizes.append(len(encoded))
+            flags = final_pass_codec_id << dicstrv.frame_codec_shift
+            if (bytes(dicstrv.decode_stream_stages(bytearray(encoded), flags)) != bytes(compressed)):
+                raise RuntimeError(file_path + " does not decode back to its token stream, codec " + str(final_pass_codec_id))
+        for (idx, value) in enumerate([len(compressed)] + sizes):
+            totals[idx] += value
+        print(f"{os.path.basename(file_path)[-30:]:<30} {len(compressed):>10} {sizes[0]:>10} {sizes[1]:>10} "
+              f"{(1 - sizes[1] / sizes[0]) * 100:>6.1f}%")
+    if (totals[1]):
+        print(f"{'total':<30} {totals[0]:>10} {totals[1]:>10} {totals[2]:>10} {(1 - totals[2] / totals[1]) * 100:>6.1f}%")
+
+
+def bench_tables(corpus_paths):
+
+    dicstrv = load_dicstrv()
+    totals = [0, 0, 0, 0.0, 0.0]
+    print(f"{'file':<30} {'tokens':>10} {'static':>10} {'tables':>10} {'gain':>7} {'table':>6} {'static ms':>10} "
+          f"{'tables ms':>10}")
+    for corpus_path in corpus_paths:
+        compressed = corpus_token_stream(dicstrv, corpus_path)
+        sizes = []
+        timings = []
+        for tables in (False, True):
+            start = time.perf_counter()
+            encoded = dicstrv.compress_block(bytearray(compressed), False, tables)
+            timings.append(time.perf_counter() - start)
+            sizes.append(len(encoded))
+            flags = dicstrv.frame_flag_tables if (tables) else 0
+            if (bytes(dicstrv.decode_stream_stages(bytearray(encoded), flags)) != bytes(compressed)):
+                raise RuntimeError(corpus_path + " does not decode back to its token stream, tables " + str(tables))
+        # the table byte of the block tells which code was chosen
+        chosen = "block" if (encoded[0] == dicstrv.block_table_adaptive) else "codec"
+        for (idx, value) in enumerate([len(compressed)] + sizes + timings):
+            totals[idx] += value
+        print(f"{os.path.basename(corpus_path)[-30:]:<30} {len(compressed):>10} {sizes[0]:>10} {sizes[1]:>10} "
+              f"{(1 - sizes[1] / sizes[0]) * 100:>6.1f}% {chosen:>6} {timings[0] * 1000:>10.1f} {timings[1] * 1000:>10.1f}")
+    if (len(corpus_paths) > 1):
+        print(f"{'total':<30} {totals[0]:>10} {totals[1]:>10} {totals[2]:>10} {(1 - totals[2] / totals[1]) * 100:>6.1f}% "
+              f"{'':>6} {totals[3] * 1000:>10.1f} {totals[4] * 1000:>10.1f}")
+
+
+def best_time(function, data, runs):
+
+    # (best of runs in seconds, output)
+    best = None
+    for run in range(0, runs):
+        start = time.perf_counter()
+        output = function(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if (best is None) else min(best, elapsed)
+    return (best, output)
+
+
+def bench_rans(corpus_paths, runs):
+
+    dicstrv = load_dicstrv()
+    codec = dicstrv.load_final_pass_codec()
+
+    def decode_chosen(encoded):
+        # -rans blocks : the smallest of the three codes, after its table byte
+        if (encoded[0] == dicstrv.block_table_rans):
+            return dicstrv.rans_decode(encoded[1:])
+        return dicstrv.huffman_decode(*dicstrv.decode_block_table(codec, encoded))
+
+    # final stage input : the block of compress_block before the huffmann pass, of the corpus token stream
+    backends = [("huffmann", lambda block: dicstrv.huffman_encode(codec, block),
+                 lambda encoded: dicstrv.huffman_decode(codec, encoded)),
+                ("tables", lambda block: dicstrv.encode_block_table(codec, block),
+                 lambda encoded: dicstrv.huffman_decode(*dicstrv.decode_block_table(codec, encoded))),
+                ("rans", dicstrv.rans_encode, dicstrv.rans_decode),
+                ("-rans", lambda block: dicstrv.encode_block_table(codec, block, 0, True), decode_chosen)]
+    totals = {name : [0, 0.0, 0.0] for (name, encoder, decoder) in backends}
+    total_input = 0
+    print(f"{'file':<20} {'block':>9} {'backend':<9} {'output':>9} {'vs huffmann':>12} {'enc MB/s':>9} {'dec MB/s':>9}")
+    for corpus_path in corpus_paths:
+        compressed = corpus_token_stream(dicstrv, corpus_path)
+        block = bytes(dicstrv.compress_block_stages(bytearray(compressed), False, codec))
+        total_input += len(block)
+        sizes = {}
+        for (name, encoder, decoder) in backends:
+            (encode_time, encoded) = best_time(encoder, bytearray(block), runs)
+            (decode_time, decoded) = best_time(decoder, bytearray(encoded), runs)
+            if (bytes(decoded) != block):
+                raise RuntimeError(corpus_path + ": " + name + " does not decode back to the block")
+            sizes[name] = len(encoded)
+            for (idx, value) in enumerate((len(encoded), encode_time, decode_time)):
+                totals[name][idx] += value
+            print(f"{os.path.basename(corpus_path)[-20:]:<20} {len(block):>9} {name:<9} {len(encoded):>9} "
+                  f"{(1 - len(encoded) / sizes['huffmann']) * 100:>11.1f}% {len(block) / encode_time / 1e6:>9.2f} "
+                  f"{len(block) / decode_time / 1e6:>9.2f}")
+    if (len(corpus_paths) > 1):
+        for (name, encoder, decoder) in backends:
+            (size, encode_time, decode_time) = totals[name]
+            print(f"{'total':<20} {total_input:>9} {name:<9} {size:>9} {(1 - size / totals['huffmann'][0]) * 100:>11.1f}% "
+                  f"{total_input / encode_time / 1e6:>9.2f} {total_input / decode_time / 1e6:>9.2f}")
+
+
+def run_timed(argv):
+
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, dicstrv_path] + argv, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if (proc.returncode != 0):
+        raise RuntimeError("dicstrv.py " + " ".join(argv) + " failed:\n" + proc.stderr.decode('utf-8', 'replace'))
+    return time.perf_counter() - start
+
+
+def bench_jobs(corpus_path, job_counts):
+
+    print("jobs   -sc (s)  speedup   -x (s)  speedup")
+    outputs = None
+    baseline = None
+    with tempfile.TemporaryDirectory() as tmpdir:
+        bin_path = os.path.join(tmpdir, "jobs.bin")
+        txt_path = os.path.join(tmpdir, "jobs.txt")
+        for job_count in job_counts:
+            compress_time = run_timed(["-sc", corpus_path, bin_path, "--jobs", str(job_count)])
+            decompress_time = run_timed(["-x", bin_path, txt_path, "--jobs", str(job_count)])
+            with open(bin_path, 'rb') as fh:
+                compressed = fh.read()
+            with open(txt_path, 'rb') as fh:
+                text = fh.read()
+            if (outputs is None):
+                outputs = (compressed, text)
+                baseline = (compress_time, decompress_time)
+            elif (outputs != (compressed, text)):
+                raise RuntimeError("output differs with --jobs " + str(job_count))
+            print(f"{job_count:>4} {compress_time:>9.2f} {baseline[0] / compress_time:>8.2f} "
+                  f"{decompress_time:>8.2f} {baseline[1] / decompress_time:>8.2f}")
+
+
+def bench_decode(corpus_path, runs):
+
+    dicstrv = load_dicstrv()
+    compressed = corpus_token_stream(dicstrv, corpus_path)
+
+    timings = {}
+    outputs = {}
+    decoders = [("legacy", lambda stream: legacy_decode_token_stream(dicstrv, stream)),
+                ("decode_token_stream", dicstrv.decode_token_stream)]
+    for (name, decoder) in decoders:
+        for run in range(0, runs):
+            start = time.perf_counter()
+            outputs[name] = decoder(compressed)
+            elapsed = time.perf_counter() - start
+            if ((name not in timings) or (elapsed < timings[name])):
+                timings[name] = elapsed
+
+    if (outputs["legacy"] != outputs["decode_token_stream"]):
+        raise RuntimeError("decoded texts differ")
+
+    # latency of the first chunk of text of the incremental decoder
+    first_chunk = None
+    for run in range(0, runs):
+        start = time.perf_counter()
+        next(dicstrv.decode_token_stream_chunks(compressed))
+        elapsed = time.perf_counter() - start
+        if ((first_chunk is None) or (elapsed < first_chunk)):
+            first_chunk = elapsed
+
+    print("token stream: " + str(len(compressed)) + " bytes, text: " + str(len(outputs["legacy"])) + " chars")
+    for (name, decoder) in decoders:
+        print(f"{name:<20}: {timings[name] * 1000:>10.1f} ms {len(compressed) / timings[name] / 1e6:>8.2f} MB/s")
+    print(f"{'first chunk':<20}: {first_chunk * 1000:>10.1f} ms")
+
+
+if (len(sys.argv) < 2):
+    print("python3 dicstrv_bench.py startup [runs]")
+    print("Wall time and peak RSS per mode, before the first input byte is processed.")
+    print("python3 dicstrv_bench.py encode <txt_corpus> [runs]")
+    print("Token id encoding throughput, legacy bitarray encoder vs encode_token_id vs encode_token_ids.")
+    print("python3 dicstrv_bench.py tokenize <txt_corpus> [runs]")
+    print("Differential check and tokens/sec, nltk tokenizers vs regex_tokenizer.")
+    print("python3 dicstrv_bench.py unknown <txt_corpus> [cache_size ...]")
+    print("First pass encoding time and unknown token cache hits/misses per cache size.")
+    print("python3 dicstrv_bench.py bwt <txt_corpus> [max_bytes]")
+    print("bwt_encode scaling from 10 kB to max_bytes (default 50 MB).")
+    print("python3 dicstrv_bench.py ibwt <txt_corpus> [max_bytes]")
+    print("bwt_decode scaling from 10 kB to max_bytes (default 10 MB), legacy LF walk up to 100 kB.")
+    print("python3 dicstrv_bench.py rle <txt_corpus> [max_bytes]")
+    print("RLE encode / decode MB/s of BWT output, numpy vs the former per byte loops.")
+    print("python3 dicstrv_bench.py shift <txt_corpus> [max_bytes]")
+    print("Absent byte shiftdown / shiftup time per absent char case, vs bwt_encode and the former loops.")
+    print("python3 dicstrv_bench.py huffman <txt_corpus> [runs]")
+    print("Final huffmann pass decoding MB/s, dahuffman vs the table driven huffman_decode.")
+    print("python3 dicstrv_bench.py hencode <txt_corpus> [runs]")
+    print("Final pass and -hc huffmann encoding MB/s, dahuffman vs the bulk huffman_encode.")
+    print("python3 dicstrv_bench.py blocks <txt_corpus> [block_size ...]")
+    print("Block mode size, time and peak memory per block size, 0 is a single block.")
+    print("python3 dicstrv_bench.py mtf <txt_corpus> [txt_corpus ...]")
+    print("Output size and time, RLE vs move-to-front / zero run stage after the BWT, per file.")
+    print("python3 dicstrv_bench.py format <txt_corpus> [txt_corpus ...]")
+    print("Output size, encode and decode time, version 1 (absent chars) vs version 2 (primary index) blocks, per file.")
+    print("python3 dicstrv_bench.py tables <txt_corpus> [txt_corpus ...]")
+    print("Output size and time, final pass codec vs per block code lengths (adaptive_tables), per file.")
+    print("python3 dicstrv_bench.py rans <txt_corpus> [txt_corpus ...]")
+    print("Final stage size and MB/s, huffmann_final_pass.bin vs per block code tables vs order-1 rANS, per file.")
+    print("python3 dicstrv_bench.py train <train_folder> <test_folder> [suffix]")
+    print("Final pass output size, huffmann_final_pass.bin vs a codec trained on train_folder (see -tf), per test file.")
+    print("python3 dicstrv_bench.py jobs <txt_corpus> [jobs ...]")
+    print("Streaming compression and decompression wall time per number of worker processes.")
+    print("python3 dicstrv_bench.py decode <txt_corpus> [runs]")
+    print("Token stream decoding time, legacy byte by byte loop vs decode_token_stream.")
+    quit()
+
+if (sys.argv[1] == "startup"):
+    bench_startup(int(sys.argv[2]) if (len(sys.argv) > 2) else 5)
+elif ((sys.argv[1] == "encode") and (len(sys.argv) > 2)):
+    bench_encode(sys.argv[2], int(sys.argv[3]) if (len(sys.argv) > 3) else 3)
+elif ((sys.argv[1] == "tokenize") and (len(sys.argv) > 2)):
+    if (bench_tokenize(sys.argv[2], int(sys.argv[3]) if (len(sys.argv) > 3) else 3)):
+        sys.exit(1)
+elif ((sys.argv[1] == "unknown") and (len(sys.argv) > 2)):
+    bench_unknown(sys.argv[2], [int(size) for size in sys.argv[3:]] or [0, 1024, 65536])
+elif ((sys.argv[1] == "bwt") and (len(sys.argv) > 2)):
+    bench_bwt(sys.argv[2], int(sys.argv[3]) if (len(sys.argv) > 3) else 50000000)
+elif ((sys.argv[1] == "ibwt") and (len(sys.argv) > 2)):
+    bench_ibwt(sys.argv[2], int(sys.argv[3]) if (len(sys.argv) > 3) else 10000000)
+elif ((sys.argv[1] == "rle") and (len(sys.argv) > 2)):
+    bench_rle(sys.argv[2], int(sys.argv[3]) if (len(sys.argv) > 3) else 10000000)
+elif ((sys.argv[1] == "shift") and (len(sys.argv) > 2)):
+    bench_shift(sys.argv[2], int(sys.argv[3]) if (len(sys.argv) > 3) else 10000000)
+elif ((sys.argv[1] == "huffman") and (len(sys.argv) > 2)):
+    bench_huffman(sys.argv[2], int(sys.argv[3]) if (len(sys.argv) > 3) else 3)
+elif ((sys.argv[1] == "hencode") and (len(sys.argv) > 2)):
+    bench_hencode(sys.argv[2], int(sys.argv[3]) if (len(sys.argv) > 3) else 3)
+elif ((sys.argv[1] == "blocks") and (len(sys.argv) > 2)):
+    bench_blocks(sys.argv[2], [int(size) for size in sys.argv[3:]] or [0, 100000, 300000, 900000])
+elif ((sys.argv[1] == "mtf") and (len(sys.argv) > 2)):
+    bench_mtf(sys.argv[2:])
+elif ((sys.argv[1] == "format") and (len(sys.argv) > 2)):
+    bench_format(sys.argv[2:])
+elif ((sys.argv[1] == "tables") and (len(sys.argv) > 2)):
+    bench_tables(sys.argv[2:])
+elif ((sys.argv[1] == "rans") and (len(sys.argv) > 2)):
+    bench_rans(sys.argv[2:], 3)
+elif ((sys.argv[1] == "train") and (len(sys.argv) > 3)):
+    bench_train(sys.argv[2], sys.argv[3], sys.argv[4] if (len(sys.argv) > 4) else '.')
+elif ((sys.argv[1] == "jobs") and (len(sys.argv) > 2)):
+    bench_jobs(sys.argv[2], [int(job_count) for job_count in sys.argv[3:]] or [1, 2, 4, os.cpu_count()])
+elif ((sys.argv[1] == "decode") and (len(sys.argv) > 2)):
+    bench_decode(sys.argv[2], int(sys.argv[3]) if (len(sys.argv) > 3) else 3)
+else:
+    print("unknown benchmark: " + sys.argv[1])
@@ -0,0 +1,60 @@
+# Thin client for the dicstrv.py compression daemon (python3 dicstrv.py -srv <socket_path>)
+# Same -c / -x semantics as dicstrv.py, but no dictionary or codec is loaded : the daemon does the work.
+# Only the standard library is used, so the client starts in a few tens of milliseconds.
+
+# python3 dicstrv_client.py <socket_path> -c <txt_inputfile> [compressed_outputfile]
+# python3 dicstrv_client.py <socket_path> -x <compressed_inputfile> [txt_outputfile]
+
+import sys
+import socket
+import struct
+
+# see the framing description above handle_request in dicstrv.py
+frame_header = struct.Struct(">cI")
+
+
+def request(socket_path, op, payload):
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(frame_header.pack(op, len(payload)) + payload)
+        sock_file = sock.makefile('rb')
+        header = sock_file.read(frame_header.size)
+        if (len(header) < frame_header.size):
+            print("connection closed by server", file=sys.stderr)
+            sys.exit(1)
+        (status, length) = frame_header.unpack(header)
+        result = sock_file.read(length)
+
+    if (status != b'\x00'):
+        print("server error: " + result.decode('utf-8', 'replace'), file=sys.stderr)
+        sys.exit(1)
+    return result
+
+
+if ((len(sys.argv) < 4) or (len(sys.argv) > 5) or (sys.argv[2] not in ("-c", "-x"))):
+    print("python3 dicstrv_client.py <socket_path> -c <txt_inputfile> [compressed_outputfile]")
+    print("python3 dicstrv_client.py <socket_path> -x <compressed_inputfile> [txt_outputfile]")
+    sys.exit(1)
+
+socket_path = sys.argv[1]
+infile = sys.argv[3]
+outfile = sys.argv[4] if (len(sys.argv) == 5) else ''
+
+with open(infile, 'rb') as fh:
+    payload = fh.read()
+
+if (sys.argv[2] == "-c"):
+    compressed = request(socket_path, b'c', payload)
+    if (len(outfile)):
+        with open(outfile, 'wb') as fh:
+            fh.write(compressed)
+    else:
+        print(compressed.hex())
+else:
+    text = request(socket_path, b'x', payload).decode('utf-8')
+    if (len(outfile)):
+        with open(outfile, 'w') as fh:
+            fh.write(text)
+    else:
+        print(text)